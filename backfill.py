@@ -0,0 +1,206 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import date, timedelta
+
+from engine import BASE_URL, INDEX_DIR, MODELS, STATIONS, Fetcher, iter_model, model_url, model_variables
+from grids import model_grid
+from instrumentation import LOGGER_NAME, METRICS, close_log, model_label, open_log
+from sinks import OUTPUT_DIR, PartitionedSink
+from station_index import StationIndex, load_station_index
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Historical backfill
+# Rebuilds months or years of interpolated station history. The date range is split into chunks which are fetched in
+# parallel through the same grid point/IDW pipeline as the daily runs (start_date/end_date instead of past_days), and
+# written straight into the partitioned dataset, one run-date partition per chunk:
+#   output/model=gfs_backfill/run-date=2024-01-01/meteo-station=Pljevlja/part-0.parquet
+# Finished chunks are recorded in a checkpoint (output/model=<name>/_checkpoint.json), so an interrupted backfill
+# resumes with the missing chunks. A chunk that was interrupted while writing is rewritten as a whole.
+# Responses are not cached: the run cache keys responses on the latest model run and drops older runs, which suits
+# forecasts but would discard date-range responses every hour; finished chunks are skipped by the checkpoint instead.
+# The archive model uses the open-meteo Historical Weather API (ERA5 reanalysis) instead of a forecast model.
+# ----------------------------------------------------------------------------------------------------------------------
+
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+
+
+def date_chunks(start_date, end_date, chunk_days=31):
+    """
+    Split a date range into chunks
+
+    Args:
+        start_date, end_date: first and last day of the range (datetime.date)
+        chunk_days: number of days of every chunk
+
+    Returns:
+        List of (first day, last day) tuples
+    """
+    chunks = []
+    start = start_date
+    while start <= end_date:
+        end = min(start + timedelta(days=chunk_days - 1), end_date)
+        chunks.append((start, end))
+        start = end + timedelta(days=1)
+    return chunks
+
+
+class Checkpoint:
+    """
+    Finished chunks of a backfill, kept in a json file
+
+    The checkpoint is reset when the backfill configuration (stations, variables, endpoint) changes.
+
+    Args:
+        path: json file of the checkpoint
+        key: hash of the backfill configuration
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.done = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("key") == key:
+                self.done = set(data["done"])
+
+    def add(self, chunk):
+        with self._lock:
+            self.done.add(chunk)
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # Write to a temporary file first so an interrupted backfill never leaves a broken checkpoint
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"key": self.key, "done": sorted(self.done)}, f, indent=1)
+            os.replace(tmp_path, self.path)
+
+
+def backfill(model, start_date, end_date, stations=STATIONS, variables=None, chunk_days=31, parallel_chunks=4,
+             fetcher=None, base_url=BASE_URL, index_dir=INDEX_DIR, output_format="parquet", output_dir=OUTPUT_DIR,
+             daily=None, rollups=None, log_filename=None):
+    """
+    Fetch the interpolated history of a model over a date range and write it to the partitioned dataset
+
+    Args:
+        model: model name from MODELS, or archive for the Historical Weather API
+        start_date, end_date: first and last day of the range (datetime.date)
+        stations: list of (station name, latitude, longitude) tuples
+        variables: hourly variables, the defaults of the model if None
+        chunk_days: number of days fetched by a single chunk
+        parallel_chunks: number of chunks fetched at the same time (requests are limited by the fetcher)
+        fetcher: Fetcher shared between the chunks, a new one without response cache is created if not given
+        base_url: open-meteo server of the forecast models
+        index_dir: directory of the station index files, the index is rebuilt on every run if None
+        output_format: parquet or arrow
+        output_dir: root directory of the datasets
+        daily, rollups: native daily variables and rollups, see engine.iter_model
+        log_filename: JSON log file of the station info and progress, named by the model and today's date if None
+
+    Returns:
+        List of (first day, last day) of the chunks fetched by this call
+    """
+    if model == "archive":
+        url, name = ARCHIVE_URL, "archive"
+    else:
+        url, name = model_url(model, base_url), MODELS[model]["prefix"] + "_backfill"
+    variables = model_variables(model, variables)
+    grid = model_grid(model)
+    index_path = os.path.join(index_dir, f"{model}.npz") if index_dir else None
+    index = load_station_index(index_path, stations, grid) if index_path else StationIndex.build(stations, grid)
+
+    config = repr((url, index.key, variables, daily, rollups, chunk_days))
+    checkpoint = Checkpoint(os.path.join(output_dir, f"model={name}", "_checkpoint.json"),
+                            hashlib.sha1(config.encode('utf-8')).hexdigest())
+    chunks = [(start, end) for start, end in date_chunks(start_date, end_date, chunk_days)
+              if start.isoformat() not in checkpoint.done]
+    if log_filename is None:
+        log_filename = date.today().strftime(f"{name}_%Y-%m-%d.jsonl")
+    label = model_label(url)
+
+    def fetch_chunk(start, end):
+        with ExitStack() as sinks:
+            targets = {}
+            stations_iter = iter_model(url, stations, variables, fetcher=fetcher, log=log, index=index, daily=daily,
+                                       rollups=rollups, start_date=start.isoformat(), end_date=end.isoformat())
+            for i, frames in stations_iter:
+                for output, df in frames.items():
+                    if output not in targets:
+                        dataset = name if output == "hourly" else f"{name}_{output}"
+                        targets[output] = sinks.enter_context(
+                            PartitionedSink(output_dir, dataset, start.isoformat(), output_format))
+                    with METRICS.stage("write", model=label):
+                        targets[output].write(df)
+        checkpoint.add(start.isoformat())
+        log.info("chunk finished", extra={"model": label, "start_date": start.isoformat(),
+                                          "end_date": end.isoformat()})
+
+    own_fetcher = fetcher is None
+    if own_fetcher:
+        fetcher = Fetcher()
+    log = open_log(log_filename, f"{LOGGER_NAME}.{name}")
+    try:
+        stage_start = METRICS.stage_seconds(model=label)
+        log.info("backfill started", extra={"model": label, "chunks": len(chunks), "skipped": len(checkpoint.done)})
+        with ThreadPoolExecutor(max_workers=max(parallel_chunks, 1)) as executor:
+            futures = [executor.submit(fetch_chunk, start, end) for start, end in chunks]
+            for future in futures:
+                future.result()
+        log.info("backfill finished", extra={"model": label,
+                                             "stage_seconds": METRICS.stage_seconds(stage_start, model=label)})
+    except Exception:
+        log.exception("backfill failed", extra={"model": label})
+        raise
+    finally:
+        if own_fetcher:
+            fetcher.shutdown()
+        close_log(log)
+    if index_path and index.dirty:
+        index.save(index_path)
+    return chunks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill interpolated open-meteo history of meteo stations.")
+    parser.add_argument("model", choices=list(MODELS) + ["archive"],
+                        help="model to fetch, archive for the Historical Weather API (ERA5)")
+    parser.add_argument("start_date", type=date.fromisoformat, help="first day (YYYY-MM-DD)")
+    parser.add_argument("end_date", type=date.fromisoformat, help="last day (YYYY-MM-DD)")
+    parser.add_argument("--variables", nargs="+", help="hourly variables (default: variables of the model)")
+    parser.add_argument("--daily", nargs="+", default=[], help="native daily variables (e.g. precipitation_sum)")
+    parser.add_argument("--rollups", nargs="+", default=[], metavar="VARIABLE:ROLLUP",
+                        help="rollups computed at ingest time, e.g. precipitation:daily_sum")
+    parser.add_argument("--chunk-days", type=int, default=31, help="number of days fetched by a single chunk")
+    parser.add_argument("--parallel-chunks", type=int, default=4, help="number of chunks fetched at the same time")
+    parser.add_argument("--max-workers", type=int, default=8, help="maximum number of requests in flight")
+    parser.add_argument("--max-per-host", type=int, default=4,
+                        help="maximum number of requests in flight to a single host")
+    parser.add_argument("--base-url", default=BASE_URL, help="open-meteo server of the forecast models")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="directory of the station index files")
+    parser.add_argument("--output-format", default="parquet", choices=["parquet", "arrow"],
+                        help="format of the dataset")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="root directory of the datasets")
+    parser.add_argument("--metrics-file", help="Prometheus text file with per-stage timing, requests and cache stats")
+    args = parser.parse_args(argv)
+    if args.end_date < args.start_date:
+        parser.error("end_date is before start_date")
+
+    with Fetcher(max_workers=args.max_workers, max_per_host=args.max_per_host) as fetcher:
+        chunks = backfill(args.model, args.start_date, args.end_date, variables=args.variables,
+                          chunk_days=args.chunk_days, parallel_chunks=args.parallel_chunks, fetcher=fetcher,
+                          base_url=args.base_url, index_dir=args.index_dir, output_format=args.output_format,
+                          output_dir=args.output_dir, daily=args.daily, rollups=args.rollups)
+    if args.metrics_file:
+        METRICS.write_prometheus(args.metrics_file)
+    print(f"Fetched {len(chunks)} chunks")
+
+
+if __name__ == "__main__":
+    main()
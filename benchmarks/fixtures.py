@@ -0,0 +1,253 @@
+import argparse
+import os
+from datetime import datetime, timezone
+
+import flatbuffers
+import numpy as np
+import pandas as pd
+import requests
+from openmeteo_sdk.Variable import Variable
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Benchmark fixtures
+# Open-meteo responses are kept as a size-prefixed FlatBuffer body (the wire format of the API) with template series
+# of grid points. The template is either recorded from the real API (python -m benchmarks.fixtures --record) or
+# generated once from a fixed seed. The stand-in server and the interpolation benchmarks give every grid point one
+# of the template series, so any number of stations can be served without network access.
+# The fixture is committed (benchmarks/fixtures/openmeteo.fb), so every machine benchmarks the same series.
+# geoglows forecast and historical dataframes are generated in memory from a fixed seed in the format of
+# geoglows.data.forecast and geoglows.data.retrospective, they are too large to commit at 10k rivers.
+# ----------------------------------------------------------------------------------------------------------------------
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+OPENMETEO_FIXTURE = "openmeteo.fb"
+
+# Variables of the template series and the horizon of the engine defaults (past_days=2, forecast_days=7)
+VARIABLES = ["temperature_2m", "precipitation"]
+HOURS = 24 * (2 + 7)
+TEMPLATES = 64
+
+# Horizons of the geoglows data: 15 day forecast at 3 hour steps, one year of daily retrospective simulation
+FORECAST_STEPS = 15 * 8
+HISTORICAL_DAYS = 366
+
+# Region of the generated stations (Montenegro, Serbia and neighbours)
+REGION = ((41.5, 46.5), (13.5, 23.0))
+
+# openmeteo_sdk codes of the template variables as (variable, altitude)
+VARIABLE_CODES = {
+    "temperature_2m": (Variable.temperature, 2),
+    "precipitation": (Variable.precipitation, 0),
+}
+
+
+def encode_message(latitude, longitude, time, interval, values, variables=VARIABLES):
+    """
+    Encode a grid point as an open-meteo WeatherApiResponse FlatBuffer with an hourly section
+
+    Args:
+        latitude, longitude: resolved coordinates of the grid point
+        time: first time step (unix seconds)
+        interval: seconds between time steps
+        values: array (variables x time) of values
+        variables: names of the variables
+
+    Returns:
+        Encoded message (bytes)
+    """
+    values = np.asarray(values, dtype=np.float32)
+    builder = flatbuffers.Builder(64 + values.nbytes + 64 * len(values))
+    tables = []
+    for variable, series in zip(variables, values):
+        code, altitude = VARIABLE_CODES.get(variable, (Variable.undefined, 0))
+        vector = builder.CreateNumpyVector(series)
+        # VariableWithValues: variable (slot 0), values (slot 3), altitude (slot 5)
+        builder.StartObject(14)
+        builder.PrependUint8Slot(0, code, 0)
+        builder.PrependUOffsetTRelativeSlot(3, vector, 0)
+        builder.PrependInt16Slot(5, altitude, 0)
+        tables.append(builder.EndObject())
+    builder.StartVector(4, len(tables), 4)
+    for table in reversed(tables):
+        builder.PrependUOffsetTRelative(table)
+    vector = builder.EndVector()
+    # VariablesWithTime: time (slot 0), time_end (slot 1), interval (slot 2), variables (slot 3)
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, time, 0)
+    builder.PrependInt64Slot(1, time + values.shape[-1] * interval, 0)
+    builder.PrependInt32Slot(2, interval, 0)
+    builder.PrependUOffsetTRelativeSlot(3, vector, 0)
+    hourly = builder.EndObject()
+    # WeatherApiResponse: latitude (slot 0), longitude (slot 1), hourly (slot 11)
+    builder.StartObject(16)
+    builder.PrependFloat32Slot(0, latitude, 0)
+    builder.PrependFloat32Slot(1, longitude, 0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly, 0)
+    builder.Finish(builder.EndObject())
+    return bytes(builder.Output())
+
+
+def encode_body(messages):
+    """Join messages to a response body, every message is prefixed with its length (little-endian uint32)"""
+    return b"".join(len(message).to_bytes(4, "little") + message for message in messages)
+
+
+def decode_body(body):
+    """Split a response body into WeatherApiResponse objects"""
+    responses = []
+    position = 0
+    while position < len(body):
+        length = int.from_bytes(body[position:position + 4], "little")
+        responses.append(WeatherApiResponse.GetRootAs(body[position + 4:position + 4 + length], 0))
+        position += 4 + length
+    return responses
+
+
+def synthetic_templates(count=TEMPLATES, hours=HOURS, seed=0):
+    """
+    Template series with a diurnal temperature cycle and intermittent precipitation
+
+    Returns:
+        Array (templates x variables x time) of float32 values
+    """
+    rng = np.random.default_rng(seed)
+    hour = np.arange(hours)
+    temperature = (rng.uniform(-5, 25, (count, 1)) + rng.uniform(3, 8, (count, 1)) *
+                   np.sin(2 * np.pi * (hour - 9) / 24) + rng.normal(0, 0.5, (count, hours)))
+    precipitation = np.where(rng.random((count, hours)) < 0.15, rng.gamma(0.8, 1.5, (count, hours)), 0.0)
+    return np.round(np.stack([temperature, precipitation], axis=1), 1).astype(np.float32)
+
+
+def write_openmeteo_fixture(body, directory=FIXTURE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, OPENMETEO_FIXTURE), 'wb') as f:
+        f.write(body)
+
+
+def load_templates(directory=FIXTURE_DIR):
+    """
+    Template series of the open-meteo fixture, the synthetic fixture is written if there is none
+
+    Returns:
+        Array (templates x variables x time) of float32 values
+    """
+    path = os.path.join(directory, OPENMETEO_FIXTURE)
+    if not os.path.exists(path):
+        templates = synthetic_templates()
+        start = int(datetime(2024, 6, 1, tzinfo=timezone.utc).timestamp())
+        write_openmeteo_fixture(encode_body([encode_message(45.0, 20.0, start, 3600, values)
+                                             for values in templates]), directory)
+    with open(path, 'rb') as f:
+        responses = decode_body(f.read())
+    templates = []
+    for response in responses:
+        hourly = response.Hourly()
+        templates.append([hourly.Variables(k).ValuesAsNumpy() for k in range(hourly.VariablesLength())])
+    return np.array(templates, dtype=np.float32)
+
+
+def point_series(templates, latitude, longitude, steps):
+    """
+    Values of grid points taken from the templates (the same template for the same grid point)
+
+    Args:
+        templates: array (templates x variables x time) from load_templates
+        latitude, longitude: arrays with coordinates of the grid points
+        steps: number of time steps, templates are repeated or cut to this length
+
+    Returns:
+        Array (points x variables x steps) of float32 values
+    """
+    cells = (np.round(np.asarray(latitude) * 4).astype(np.int64) * 1009 +
+             np.round(np.asarray(longitude) * 4).astype(np.int64))
+    series = templates[cells % len(templates)]
+    return series[..., np.arange(steps) % series.shape[-1]] if series.shape[-1] != steps else series
+
+
+def stations(count, seed=0):
+    """List of count (station name, latitude, longitude) tuples spread over the region"""
+    rng = np.random.default_rng(seed)
+    latitude = np.round(rng.uniform(*REGION[0], count), 4)
+    longitude = np.round(rng.uniform(*REGION[1], count), 4)
+    return [(f"station-{i:05d}", float(lat), float(lon)) for i, (lat, lon) in enumerate(zip(latitude, longitude))]
+
+
+def river_ids(count):
+    """River IDs (LINKNO) and the river dictionary relating them to station names"""
+    ids = [220000000 + 7 * i for i in range(count)]
+    return ids, {river_id: f"station-{i:05d}" for i, river_id in enumerate(ids)}
+
+
+def forecast_frame(count, steps=FORECAST_STEPS, seed=0):
+    """Dataframe in the format of geoglows.data.forecast, the last day has no values (all NaN rows)"""
+    rng = np.random.default_rng(seed)
+    ids, _ = river_ids(count)
+    time = pd.date_range("2024-06-01", periods=steps, freq="3h")
+    index = pd.MultiIndex.from_product([time, ids], names=["time", "river_id"])
+    median = np.round(rng.gamma(2.0, 50.0, len(index)), 2)
+    df = pd.DataFrame({"flow_uncertainty_upper": np.round(median * 1.3, 2), "flow_median": median,
+                       "flow_uncertainty_lower": np.round(median * 0.7, 2)}, index=index)
+    df.loc[time[-8:]] = np.nan
+    return df
+
+
+def historical_frame(count, days=HISTORICAL_DAYS, seed=0):
+    """Dataframe in the format of geoglows.data.retrospective (one column per river)"""
+    rng = np.random.default_rng(seed)
+    ids, _ = river_ids(count)
+    time = pd.date_range("2023-01-01", periods=days, freq="D", name="time")
+    return pd.DataFrame(np.round(rng.gamma(2.0, 50.0, (days, count)), 2), index=time,
+                        columns=[str(river_id) for river_id in ids])
+
+
+def load_geoglows(kind, count):
+    """
+    geoglows dataframe of count rivers generated from a fixed seed
+
+    Args:
+        kind: forecast or historical
+        count: number of rivers
+
+    Returns:
+        Dataframe as returned by geoglows
+    """
+    return forecast_frame(count) if kind == "forecast" else historical_frame(count)
+
+
+def record(url, count=TEMPLATES, past_days=2, forecast_days=7, directory=FIXTURE_DIR):
+    """
+    Record the open-meteo fixture from the real API
+
+    Args:
+        url: url of an open-meteo API endpoint (e.g. https://api.open-meteo.com/v1/gfs)
+        count: number of grid points, spread over the region of the benchmark stations
+        past_days, forecast_days: period of the recorded series
+        directory: fixture directory
+    """
+    points = stations(count)
+    params = {"latitude": ",".join(str(s[1]) for s in points), "longitude": ",".join(str(s[2]) for s in points),
+              "hourly": ",".join(VARIABLES), "past_days": past_days, "forecast_days": forecast_days,
+              "format": "flatbuffers"}
+    response = requests.get(url, params=params, timeout=60)
+    response.raise_for_status()
+    decode_body(response.content)
+    write_openmeteo_fixture(response.content, directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write or record the open-meteo benchmark fixture.")
+    parser.add_argument("--record", metavar="URL",
+                        help="record the open-meteo fixture from an API endpoint instead of generating it")
+    parser.add_argument("--directory", default=FIXTURE_DIR, help="fixture directory")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record(args.record, directory=args.directory)
+    templates = load_templates(args.directory)
+    print(f"Fixture in {args.directory}: {len(templates)} open-meteo templates")
+
+
+if __name__ == "__main__":
+    main()
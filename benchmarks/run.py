@@ -0,0 +1,278 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+import numpy as np
+
+from benchmarks.fixtures import (FIXTURE_DIR, HOURS, VARIABLES, load_geoglows, load_templates, point_series,
+                                 river_ids, stations)
+from benchmarks.server import StandInServer
+from engine import Fetcher, create_client, iter_model, model_url, station_frames, time_index
+from grids import model_grid
+from sinks import CsvSink
+from station_index import StationIndex
+from utils import (bilinear_interpolation, bilinear_interpolation_batch, gglow_csv, inverse_distance_weighting,
+                   inverse_distance_weighting_batch)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Benchmark suite
+# Measures the interpolation, geoglows parsing and csv output paths at 10, 1k and 10k stations/rivers on the offline
+# fixtures (see fixtures.py), and a full engine run against the stand-in server. Every case reports the best wall
+# time of a few repeats, throughput (stations or rivers per second) and peak memory traced by tracemalloc.
+# Results are compared with a baseline file, a case slower or bigger than its baseline by more than the tolerance
+# is reported as a regression and the run exits with status 1, as it does without a baseline:
+#   python -m benchmarks.run --save-baseline     record the baseline of this machine
+#   python -m benchmarks.run                      compare with the baseline
+# ----------------------------------------------------------------------------------------------------------------------
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SIZES = {"10": 10, "1k": 1000, "10k": 10000}
+
+# Allowed slowdown and memory growth relative to the baseline, and absolute slack for very short cases
+TIME_TOLERANCE = 0.5
+MEMORY_TOLERANCE = 0.25
+TIME_NOISE = 0.005
+MEMORY_NOISE = 1.0
+
+
+def interpolation_inputs(context, count):
+    """Stations, their corners (stations x 4 x 2) and corner values (stations x 4 x variables x time)"""
+    points = stations(count)
+    index = StationIndex.build(points)
+    corners = index.points[index.station_indices]
+    values = point_series(context["templates"], corners[..., 0], corners[..., 1], HOURS)
+    return index, corners, values
+
+
+def idw(context, count):
+    # One call per station, as in the original per-station scripts
+    index, corners, values = interpolation_inputs(context, count)
+    return lambda: [inverse_distance_weighting(index.latitude[i], index.longitude[i], corners[i], values[i])
+                    for i in range(count)]
+
+
+def idw_batch(context, count):
+    index, corners, values = interpolation_inputs(context, count)
+    return lambda: inverse_distance_weighting_batch(index.latitude, index.longitude, corners, values)
+
+
+def bilinear(context, count):
+    # Corners are ordered (lat0, lon0), (lat1, lon1), (lat0, lon1), (lat1, lon0)
+    index, corners, values = interpolation_inputs(context, count)
+    return lambda: [bilinear_interpolation(index.longitude[i], index.latitude[i], corners[i, 0, 1], corners[i, 1, 1],
+                                           corners[i, 0, 0], corners[i, 1, 0],
+                                           values[i, 0], values[i, 3], values[i, 2], values[i, 1])
+                    for i in range(count)]
+
+
+def bilinear_batch(context, count):
+    index, corners, values = interpolation_inputs(context, count)
+    return lambda: bilinear_interpolation_batch(index.longitude, index.latitude, corners[:, 0, 1], corners[:, 1, 1],
+                                                corners[:, 0, 0], corners[:, 1, 0],
+                                                values[:, 0], values[:, 3], values[:, 2], values[:, 1])
+
+
+def gglow_csv_forecast(context, count):
+    df = load_geoglows("forecast", count)
+    dictionary = river_ids(count)[1]
+    return lambda: gglow_csv(df, dictionary, "forecast")
+
+
+def gglow_csv_historical(context, count):
+    df = load_geoglows("historical", count)
+    dictionary = river_ids(count)[1]
+    return lambda: gglow_csv(df, dictionary, "historical")
+
+
+def csv_write_hourly(context, count):
+    # One dataframe per station, written the same way as engine.run_model
+    index, corners, values = interpolation_inputs(context, count)
+    interpolated = index.interpolate(np.arange(count), values)
+    date_time = time_index(1717200000, 1717200000 + HOURS * 3600, 3600)
+    columns = {variable: interpolated[:, k] for k, variable in enumerate(VARIABLES)}
+    frames = station_frames([s[0] for s in stations(count)], date_time, columns)
+    path = os.path.join(context["output_dir"], f"hourly_{count}.csv")
+
+    def run():
+        with CsvSink(path) as sink:
+            for df in frames:
+                sink.write(df)
+    return run
+
+
+def csv_write_forecast(context, count):
+    df = gglow_csv(load_geoglows("forecast", count), river_ids(count)[1], "forecast")
+    path = os.path.join(context["output_dir"], f"forecast_{count}.csv")
+
+    def run():
+        with CsvSink(path) as sink:
+            sink.write(df)
+    return run
+
+
+def engine_fetch(context, count):
+    # Fetch, decode and interpolate through the engine against the stand-in server (no response or point cache)
+    points = stations(count)
+    index = StationIndex.build(points, model_grid("gfs"))
+    url = model_url("gfs", context["server"].url)
+    fetcher = context["stack"].enter_context(Fetcher(create_client(retries=0)))
+
+    def run():
+        return [frames for _, frames in iter_model(url, points, VARIABLES, fetcher=fetcher, index=index)]
+    # The server runs in this process, a first run encodes the grid points so only the client side is measured
+    run()
+    return run
+
+
+# Benchmark cases, functions returning the callable to measure for a number of stations/rivers
+CASES = {
+    "idw": idw,
+    "idw_batch": idw_batch,
+    "bilinear": bilinear,
+    "bilinear_batch": bilinear_batch,
+    "gglow_csv_forecast": gglow_csv_forecast,
+    "gglow_csv_historical": gglow_csv_historical,
+    "csv_write_hourly": csv_write_hourly,
+    "csv_write_forecast": csv_write_forecast,
+    "engine_fetch": engine_fetch,
+}
+
+
+def measure(run, repeat=3):
+    """
+    Measure a callable
+
+    Args:
+        run: callable to measure
+        repeat: number of timed calls
+
+    Returns:
+        (best wall time in seconds, peak traced memory in MB)
+    """
+    # Peak memory of a separate call, tracemalloc slows down allocations
+    gc.collect()
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    seconds = []
+    for _ in range(max(repeat, 1)):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), peak
+
+
+def run_benchmarks(cases=CASES, sizes=SIZES, repeat=3, fixture_dir=FIXTURE_DIR):
+    """
+    Run benchmark cases at every size
+
+    Args:
+        cases: list of case names from CASES
+        sizes: list of size names from SIZES
+        repeat: number of timed calls of every case
+        fixture_dir: directory of the benchmark fixtures
+
+    Returns:
+        List of results, dicts with case, size, items, seconds, throughput (items per second) and peak_mb
+    """
+    results = []
+    with ExitStack() as stack:
+        server = stack.enter_context(StandInServer(fixture_dir))
+        output_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        context = {"templates": load_templates(fixture_dir), "server": server,
+                   "output_dir": output_dir, "stack": stack}
+        for case in cases:
+            for size in sizes:
+                count = SIZES[size]
+                seconds, peak = measure(CASES[case](context, count), repeat)
+                result = {"case": case, "size": size, "items": count, "seconds": round(seconds, 6),
+                          "throughput": round(count / seconds, 1), "peak_mb": round(peak, 3)}
+                print(f"{case:<22}{size:>5}{seconds:>12.4f} s{result['throughput']:>14.1f} /s{peak:>12.2f} MB")
+                results.append(result)
+    return results
+
+
+def compare(results, baseline, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    """
+    Compare results with a baseline
+
+    Returns:
+        List of regression messages, empty if every case is within the tolerance
+    """
+    regressions = []
+    for result in results:
+        key = f"{result['case']}[{result['size']}]"
+        if key not in baseline:
+            continue
+        base = baseline[key]
+        time_limit = base["seconds"] * (1 + time_tolerance) + TIME_NOISE
+        if result["seconds"] > time_limit:
+            regressions.append(f"{key}: {result['seconds']:.4f} s, baseline {base['seconds']:.4f} s "
+                               f"(+{result['seconds'] / base['seconds'] - 1:.0%})")
+        memory_limit = base["peak_mb"] * (1 + memory_tolerance) + MEMORY_NOISE
+        if result["peak_mb"] > memory_limit:
+            regressions.append(f"{key}: {result['peak_mb']:.2f} MB, baseline {base['peak_mb']:.2f} MB "
+                               f"(+{result['peak_mb'] / max(base['peak_mb'], 1e-6) - 1:.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark interpolation, geoglows parsing and csv output offline.")
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES), help="cases to run")
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), choices=list(SIZES),
+                        help="numbers of stations/rivers")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed calls of every case")
+    parser.add_argument("--fixture-dir", default=FIXTURE_DIR, help="directory of the benchmark fixtures")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results in the baseline file instead of comparing")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE,
+                        help="allowed slowdown relative to the baseline (0.5 = 50%%)")
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE,
+                        help="allowed peak memory growth relative to the baseline")
+    parser.add_argument("--output", help="json file of the results")
+    args = parser.parse_args(argv)
+
+    print(f"{'case':<22}{'size':>5}{'best time':>14}{'throughput':>17}{'peak memory':>15}")
+    results = run_benchmarks(args.cases, args.sizes, args.repeat, args.fixture_dir)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    if args.save_baseline:
+        # Cases not run keep their baseline
+        baseline.update({f"{r['case']}[{r['size']}]": {"seconds": r["seconds"], "peak_mb": r["peak_mb"]}
+                         for r in results})
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return
+    if not baseline:
+        # Without a baseline no regression could be detected, fail instead of passing silently
+        print(f"\nNo baseline in {args.baseline}, run with --save-baseline to record one")
+        sys.exit(1)
+
+    regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+    if regressions:
+        print(f"\nREGRESSION: {len(regressions)} case(s) beyond the tolerance of the baseline")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("\nAll cases within the tolerance of the baseline")
+
+
+if __name__ == "__main__":
+    main()
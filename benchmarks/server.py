@@ -0,0 +1,186 @@
+import argparse
+import json
+import threading
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.fixtures import FIXTURE_DIR, encode_body, encode_message, load_templates, point_series
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Stand-in open-meteo server
+# Local HTTP server answering forecast/archive requests of any endpoint (/v1/forecast, /v1/gfs, ...) with FlatBuffer
+# bodies built from the fixture templates, so the engine runs end to end (HTTP, decoding, interpolation, output)
+# without network access. Multi-location requests, past_days/forecast_days and start_date/end_date are supported,
+# only the hourly section is served. Encoded grid points are kept in memory, so repeated runs measure the client.
+# Model metadata (/data/<model>/static/meta.json) reports run_time as the init time of the last run of every model.
+# Upstream errors can be simulated by answering the next requests with HTTP 500 (failures), e.g. to test retries.
+# ----------------------------------------------------------------------------------------------------------------------
+
+def _values(query, name):
+    """Values of a query parameter given repeated and/or comma separated"""
+    return [value for item in query.get(name, []) for value in item.split(",") if value]
+
+
+class StandInServer:
+    """
+    Stand-in open-meteo server on a free local port
+
+    Args:
+        fixture_dir: directory of the benchmark fixtures
+        port: port to listen on, any free port if 0
+
+    Attributes:
+        url: base url of the server (use instead of engine.BASE_URL)
+        requests: number of requests served
+        bytes: number of body bytes sent
+        failures: number of next requests answered with HTTP 500 instead of data
+        run_time: init time (unix seconds) of the last model run reported by the model metadata, the start of the
+                  current hour when the server is created
+    """
+
+    def __init__(self, fixture_dir=FIXTURE_DIR, port=0):
+        self.templates = load_templates(fixture_dir)
+        self.requests = 0
+        self.bytes = 0
+        self.failures = 0
+        self.run_time = int(datetime.now(timezone.utc).timestamp()) // 3600 * 3600
+        self._messages = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.startswith("/data/") and url.path.endswith("/static/meta.json"):
+                    self._metadata()
+                    return
+                self._respond(parse_qs(url.query))
+
+            def _metadata(self):
+                body = json.dumps({"last_run_initialisation_time": server.run_time,
+                                   "last_run_availability_time": server.run_time,
+                                   "temporal_resolution_seconds": 3600}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self._respond(parse_qs(self.rfile.read(length).decode("utf-8")))
+
+            def _respond(self, query):
+                try:
+                    if server.fail():
+                        raise RuntimeError("simulated upstream error")
+                    body = server.body(query)
+                    status = 200
+                except (KeyError, ValueError) as e:
+                    body = ('{"error": true, "reason": "%s"}' % e).encode("utf-8")
+                    status = 400
+                except RuntimeError as e:
+                    body = ('{"error": true, "reason": "%s"}' % e).encode("utf-8")
+                    status = 500
+                self.send_response(status)
+                self.send_header("Content-Type", "application/octet-stream" if status == 200 else "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def fail(self):
+        """True if the current request has to fail, counting down failures"""
+        with self._lock:
+            if self.failures > 0:
+                self.failures -= 1
+                return True
+            return False
+
+    def body(self, query):
+        """
+        Response body of a parsed query string
+
+        Args:
+            query: dict relating parameters and lists of values (urllib.parse.parse_qs)
+
+        Returns:
+            Size-prefixed FlatBuffer messages, one per requested location
+        """
+        latitude = [float(v) for v in _values(query, "latitude")]
+        longitude = [float(v) for v in _values(query, "longitude")]
+        if not latitude or len(latitude) != len(longitude):
+            raise ValueError("latitude and longitude must have the same number of values")
+        variables = tuple(_values(query, "hourly"))
+        if "start_date" in query:
+            start = date.fromisoformat(query["start_date"][0])
+            days = (date.fromisoformat(query["end_date"][0]) - start).days + 1
+        else:
+            past_days = int(query.get("past_days", ["0"])[0])
+            days = past_days + int(query.get("forecast_days", ["7"])[0])
+            start = datetime.now(timezone.utc).date() - timedelta(days=past_days)
+        time = int(datetime(start.year, start.month, start.day, tzinfo=timezone.utc).timestamp())
+        steps = 24 * days
+
+        messages = []
+        for lat, lon in zip(latitude, longitude):
+            key = (lat, lon, time, steps, variables)
+            message = self._messages.get(key)
+            if message is None:
+                series = point_series(self.templates, lat, lon, steps)
+                values = [series[k % len(series)] for k in range(len(variables))]
+                message = encode_message(lat, lon, time, 3600, values, variables)
+                with self._lock:
+                    self._messages[key] = message
+            messages.append(message)
+        body = encode_body(messages)
+        with self._lock:
+            self.requests += 1
+            self.bytes += len(body)
+        return body
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the open-meteo benchmark fixture on a local port.")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("--fixture-dir", default=FIXTURE_DIR, help="directory of the benchmark fixtures")
+    args = parser.parse_args(argv)
+
+    server = StandInServer(args.fixture_dir, args.port)
+    print(f"Serving open-meteo fixtures on {server.url} (e.g. python engine.py gfs --base-url {server.url})")
+    server.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from engine import (BASE_URL, COLUMN_NAMES, INDEX_DIR, MODELS, STATIONS, VARIABLES, Fetcher, create_cache,
+                    iter_interpolated, model_url, station_frames)
+from grids import model_grid
+from instrumentation import LOGGER_NAME, METRICS, close_log, model_label, open_log
+from point_cache import POINT_CACHE_DIR, PointCache
+from sinks import OUTPUT_DIR, OUTPUT_FORMATS, open_sink
+from station_index import StationIndex, load_station_index
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Multi-model blend
+# Fetches several open-meteo models at the same time and blends the interpolated station values in memory, instead of
+# writing one csv per model and aligning them afterwards. Every model is moved to a common hourly time axis (the union
+# of the model periods) with vectorized interpolation over all stations and variables, gaps of models with coarser
+# time steps on an hourly axis (e.g. 3-hourly ECMWF data) are filled the same way:
+#   instantaneous variables (e.g. temperature_2m) are interpolated linearly between the time steps of the model
+#   accumulated variables (e.g. precipitation, the sum over the preceding time step) are spread evenly over the hours
+#   of every time step, so 3-hourly ECMWF totals keep their sum
+# One output (blend_<date>.csv or the blend dataset) holds per station and hour the weighted consensus of the models,
+# their spread (weighted standard deviation) and the values of every model, e.g.
+#   meteo-station, date-time, temperature, temperature_spread, temperature_weather, temperature_gfs, temperature_ecmwf
+# Models without values at an hour (outside their period, missing data) are left out of the consensus of that hour.
+# ----------------------------------------------------------------------------------------------------------------------
+
+# Variables summed over the preceding time step in open-meteo responses
+ACCUMULATED = {"precipitation", "rain", "showers", "snowfall", "evapotranspiration", "et0_fao_evapotranspiration",
+               "sunshine_duration"}
+
+# Longest run of missing time steps filled between two values (models with 3-hourly data on an hourly axis)
+MAX_GAP = 6
+
+HOUR = pd.Timedelta(hours=1)
+
+
+def fill_gaps(values, accumulated=False, max_gap=MAX_GAP):
+    """
+    Fill runs of missing time steps between two values, e.g. 3-hourly model data returned on an hourly time axis
+
+    Args:
+        values: array (... x time) of values
+        accumulated: values are sums since the previous value (spread evenly over the gap and the time step of the
+                     value) instead of instantaneous values (interpolated linearly)
+        max_gap: longest run of missing time steps that is filled
+
+    Returns:
+        Array (... x time), gaps at the start and end and longer gaps stay NaN
+    """
+    steps = values.shape[-1]
+    valid = ~np.isnan(values)
+    if valid.all() or steps < 2:
+        return values
+    position = np.broadcast_to(np.arange(steps), values.shape)
+    # Last valid time step at or before, and first valid time step at or after every time step
+    previous = np.maximum.accumulate(np.where(valid, position, -1), axis=-1)
+    following = np.flip(np.minimum.accumulate(np.flip(np.where(valid, position, steps), axis=-1), axis=-1), axis=-1)
+    following_index = np.minimum(following, steps - 1)
+    following_values = np.take_along_axis(values, following_index, axis=-1)
+    if accumulated:
+        # Valid time step before the value every time step belongs to
+        before = np.concatenate([np.full(values.shape[:-1] + (1,), -1), previous[..., :-1]], axis=-1)
+        start = np.take_along_axis(before, following_index, axis=-1)
+        span = following - start
+        # The value itself is spread too, values without a known start keep their sum
+        return np.where((following < steps) & (start >= 0) & (span <= max_gap + 1),
+                        following_values / np.maximum(span, 1), np.where(valid, values, np.nan))
+    previous_values = np.take_along_axis(values, np.maximum(previous, 0), axis=-1)
+    span = following - previous
+    fraction = (position - previous) / np.maximum(span, 1)
+    filled = np.where((previous >= 0) & (following < steps) & (span <= max_gap + 1),
+                      previous_values + (following_values - previous_values) * fraction, np.nan)
+    return np.where(valid, values, filled)
+
+
+def fetch_interpolated(model, stations, variables, period, fetcher, base_url=BASE_URL, index_dir=INDEX_DIR,
+                       batch_requests=True, max_locations=100, point_cache=None):
+    """
+    Fetch a model and interpolate its hourly variables to all stations
+
+    Args:
+        model: model name from MODELS
+        stations: list of (station name, latitude, longitude) tuples
+        variables: hourly variables
+        period: request parameters of the time period (past_days and forecast_days)
+        fetcher, batch_requests, max_locations, point_cache: see engine.iter_model
+        base_url: open-meteo server the model is fetched from
+        index_dir: directory of the station index files, the index is rebuilt on every run if None
+
+    Returns:
+        (date_time, values) with the date-time index of the model and an array (stations x variables x time)
+    """
+    grid = model_grid(model)
+    index_path = os.path.join(index_dir, f"{model}.npz") if index_dir else None
+    index = load_station_index(index_path, stations, grid) if index_path else StationIndex.build(stations, grid)
+    values, date_time = None, None
+    stations_iter = iter_interpolated(model_url(model, base_url), {"hourly": list(variables)}, period, fetcher, index,
+                                      batch_requests, max_locations, point_cache)
+    for ready, section_time, interpolated in stations_iter:
+        if values is None:
+            date_time = section_time["hourly"]
+            values = np.full((len(stations), len(variables), len(date_time)), np.nan)
+        values[ready] = interpolated["hourly"]
+    if index_path and index.dirty:
+        index.save(index_path)
+    return date_time, values
+
+
+def common_time_axis(date_times):
+    """Hourly date-time index covering the date-time indexes of all models"""
+    start = min(date_time[0] for date_time in date_times)
+    end = max(date_time[-1] for date_time in date_times)
+    return pd.date_range(start.floor('h'), end.ceil('h'), freq=HOUR)
+
+
+def to_time_axis(values, date_time, axis, accumulated=False):
+    """
+    Move values of a regular date-time index to another date-time index
+
+    Args:
+        values: array (... x time) of values
+        date_time: regular date-time index of the values
+        axis: target date-time index
+        accumulated: values are sums over the preceding time step (spread evenly over the target hours) instead of
+                     instantaneous values (interpolated linearly)
+
+    Returns:
+        Array (... x len(axis)), NaN outside the period of date_time
+    """
+    steps = len(date_time)
+    interval = (date_time[1] - date_time[0]) if steps > 1 else HOUR
+    position = np.asarray((axis - date_time[0]) / interval, dtype=np.float64)
+    if accumulated:
+        # A target hour t belongs to the first time step at or after t
+        step = np.clip(np.ceil(position), 0, steps - 1).astype(np.int64)
+        result = values[..., step] * (HOUR / interval)
+        inside = (position > -1) & (position <= steps - 1)
+    else:
+        lower = np.clip(np.floor(position), 0, max(steps - 2, 0)).astype(np.int64)
+        upper = np.minimum(lower + 1, steps - 1)
+        fraction = position - lower
+        low, high = values[..., lower], values[..., upper]
+        # Exact time steps keep their value even if the next one is missing
+        result = np.where(fraction == 0, low, low + (high - low) * fraction)
+        inside = (position >= 0) & (position <= steps - 1)
+    return np.where(inside, result, np.nan)
+
+
+def blend_values(values, weights):
+    """
+    Weighted consensus and spread of models
+
+    Args:
+        values: array (models x ...) of values on a common time axis
+        weights: array (models) of model weights
+
+    Returns:
+        (consensus, spread) arrays (...), NaN values are left out, NaN where no model has a value
+    """
+    valid = ~np.isnan(values)
+    weights = np.asarray(weights, dtype=np.float64).reshape((-1,) + (1,) * (values.ndim - 1)) * valid
+    total = weights.sum(axis=0)
+    consensus = np.full(values.shape[1:], np.nan)
+    np.divide((weights * np.where(valid, values, 0.0)).sum(axis=0), total, out=consensus, where=total > 0)
+    deviation = np.where(valid, values - consensus, 0.0)
+    variance = np.full(values.shape[1:], np.nan)
+    np.divide((weights * deviation ** 2).sum(axis=0), total, out=variance, where=total > 0)
+    return consensus, np.sqrt(variance)
+
+
+def blend_columns(models, variables, axis, model_values, weights):
+    """
+    Output columns of the blend
+
+    Args:
+        models: model names
+        variables: hourly variables
+        axis: common hourly date-time index
+        model_values: list of (date_time, values) of every model, see fetch_interpolated
+        weights: list of model weights
+
+    Returns:
+        Dict relating output column names and arrays (stations x time)
+    """
+    columns = {}
+    for k, variable in enumerate(variables):
+        accumulated = variable in ACCUMULATED
+        values = np.array([to_time_axis(fill_gaps(v[:, k], accumulated), date_time, axis, accumulated)
+                           for date_time, v in model_values])
+        consensus, spread = blend_values(values, weights)
+        name = COLUMN_NAMES.get(variable, variable)
+        columns[name] = np.around(consensus, decimals=2)
+        columns[f"{name}_spread"] = np.around(spread, decimals=2)
+        for model, model_column in zip(models, values):
+            columns[f"{name}_{model}"] = np.around(model_column, decimals=2)
+    return columns
+
+
+def run_blend(models=None, stations=STATIONS, variables=VARIABLES, weights=None, past_days=2, forecast_days=7,
+              fetcher=None, batch_requests=True, max_locations=100, base_url=BASE_URL, index_dir=INDEX_DIR,
+              output_format="csv", output_dir=OUTPUT_DIR, point_cache=None, metrics_file=None):
+    """
+    Fetch several models and write their blend and JSON log to files named by today's date
+
+    Args:
+        models: list of model names from MODELS, all models if None
+        stations: list of (station name, latitude, longitude) tuples
+        variables: hourly variables fetched from every model
+        weights: dict relating model names and their weights in the consensus, 1 for models not in the dict
+        past_days, forecast_days, fetcher, batch_requests, max_locations, point_cache: see engine.iter_model
+        base_url, index_dir, output_format, output_dir, metrics_file: see engine.run_model
+
+    Returns:
+        Written csv file or dataset directory
+    """
+    models = list(models or MODELS)
+    variables = list(variables)
+    weights = [float((weights or {}).get(model, 1.0)) for model in models]
+    period = {"past_days": past_days, "forecast_days": forecast_days}
+    log = open_log(datetime.now().strftime("blend_%Y-%m-%d.jsonl"), f"{LOGGER_NAME}.blend")
+    own_fetcher = fetcher is None
+    if own_fetcher:
+        fetcher = Fetcher()
+        if point_cache is None:
+            point_cache = PointCache()
+    try:
+        stage_start = METRICS.stage_seconds(model="blend")
+        log.info("blend started", extra={"models": models, "weights": weights, "stations": len(stations),
+                                         "variables": variables})
+        # Models are fetched at the same time, requests are limited by the shared fetcher
+        with ThreadPoolExecutor(max_workers=max(len(models), 1)) as executor:
+            futures = [executor.submit(fetch_interpolated, model, stations, variables, period, fetcher, base_url,
+                                       index_dir, batch_requests, max_locations, point_cache) for model in models]
+            model_values = [future.result() for future in futures]
+        for model, (date_time, _) in zip(models, model_values):
+            log.info("model fetched", extra={"model": model_label(model_url(model, base_url)),
+                                             "start": date_time[0], "end": date_time[-1],
+                                             "interval_seconds": (date_time[1] - date_time[0]).total_seconds()
+                                             if len(date_time) > 1 else None})
+
+        with METRICS.stage("blend", model="blend"):
+            axis = common_time_axis([date_time for date_time, _ in model_values])
+            columns = blend_columns(models, variables, axis, model_values, weights)
+            frames = station_frames([s[0] for s in stations], axis, columns)
+        csv_filename = datetime.now().strftime("blend_%Y-%m-%d.csv")
+        with METRICS.stage("write", model="blend"), open_sink(output_format, "blend", csv_filename,
+                                                              output_dir) as sink:
+            for df in frames:
+                sink.write(df)
+        log.info("blend finished", extra={"hours": len(axis),
+                                          "stage_seconds": METRICS.stage_seconds(stage_start, model="blend")})
+    except Exception:
+        log.exception("blend failed", extra={"models": models})
+        raise
+    finally:
+        if own_fetcher:
+            fetcher.shutdown()
+        close_log(log)
+    if metrics_file:
+        METRICS.write_prometheus(metrics_file)
+    return sink.target
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Blend open-meteo models interpolated to meteo stations.")
+    parser.add_argument("models", nargs="*", metavar="MODEL",
+                        help=f"models to blend: {', '.join(MODELS)} (default: all)")
+    parser.add_argument("--weights", nargs="+", default=[], metavar="MODEL=WEIGHT",
+                        help="weights of the models in the consensus (default: 1), e.g. ecmwf=2 gfs=1")
+    parser.add_argument("--past-days", type=int, default=2, help="weather info for how many past days")
+    parser.add_argument("--forecast-days", type=int, default=7, help="weather info for how many future days")
+    parser.add_argument("--variables", nargs="+", default=VARIABLES, help="hourly variables fetched from every model")
+    parser.add_argument("--max-locations", type=int, default=100,
+                        help="maximum number of grid points sent in a single request")
+    parser.add_argument("--no-batch", dest="batch_requests", action="store_false",
+                        help="send one request per station")
+    parser.add_argument("--max-workers", type=int, default=8, help="maximum number of requests in flight")
+    parser.add_argument("--max-per-host", type=int, default=4,
+                        help="maximum number of requests in flight to a single host")
+    parser.add_argument("--base-url", default=BASE_URL, help="open-meteo server (e.g. a local stub server)")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="directory of the station index files")
+    parser.add_argument("--output-format", default="csv", choices=OUTPUT_FORMATS, help="format of the output")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="root directory of the parquet/arrow datasets")
+    parser.add_argument("--point-cache-dir", default=POINT_CACHE_DIR, help="directory of the grid point value cache")
+    parser.add_argument("--no-cache", dest="cache", action="store_false",
+                        help="do not cache responses and grid point values")
+    parser.add_argument("--metrics-file", help="Prometheus text file with per-stage timing, requests and cache stats")
+    args = parser.parse_args(argv)
+    unknown = [model for model in args.models if model not in MODELS]
+    if unknown:
+        parser.error(f"unknown models {', '.join(unknown)}")
+    args.models = args.models or list(MODELS)
+    weights = {}
+    for option in args.weights:
+        model, _, weight = option.partition("=")
+        try:
+            weights[model] = float(weight)
+        except ValueError:
+            parser.error(f"invalid --weights {option}")
+        if model not in args.models or weights[model] < 0:
+            parser.error(f"invalid --weights {option}")
+
+    cache = create_cache() if args.cache else None
+    point_cache = PointCache(args.point_cache_dir) if args.cache else None
+    with Fetcher(max_workers=args.max_workers, max_per_host=args.max_per_host, cache=cache) as fetcher:
+        target = run_blend(args.models, STATIONS, args.variables, weights, args.past_days, args.forecast_days,
+                           fetcher, args.batch_requests, args.max_locations, args.base_url, args.index_dir,
+                           args.output_format, args.output_dir, point_cache, args.metrics_file)
+    print(f"Blend written to {target}")
+
+
+if __name__ == "__main__":
+    main()
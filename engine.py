@@ -0,0 +1,622 @@
+import argparse
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+import numpy as np
+import openmeteo_requests
+import pandas as pd
+import requests
+from retry_requests import retry
+
+from grids import model_grid
+from instrumentation import LOGGER_NAME, METRICS, close_log, model_label, open_log, track_session
+from point_cache import POINT_CACHE_DIR, PointCache, request_key
+from response_cache import CACHE_DIR, ModelSchedule, RunCache
+from rollups import compute_rollups, parse_rollup
+from sinks import OUTPUT_DIR, OUTPUT_FORMATS, open_sink
+from station_index import StationIndex, load_station_index
+from utils import locations_params
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Shared open-meteo ingestion engine
+# Fetches and interpolates any number of open-meteo models in a single process, sharing one HTTP session and cache.
+# ----------------------------------------------------------------------------------------------------------------------
+
+# Default hourly variables and the names of their output columns (variables not listed keep their open-meteo name)
+VARIABLES = ["temperature_2m", "precipitation"]
+COLUMN_NAMES = {"temperature_2m": "temperature"}
+
+# Supported open-meteo models (path of the API endpoint, prefix of the output/log files, publish schedule of new
+# model runs as hours between runs and hours until a run is available, upstream models whose metadata tells the latest
+# run, and default hourly variables)
+BASE_URL = "https://api.open-meteo.com"
+MODELS = {
+    # Weather Forecast API, seamless models update at least hourly
+    "weather": {"path": "/v1/forecast", "prefix": "weather", "schedule": ModelSchedule(1, 0),
+                "metadata": ["dwd_icon_d2", "dwd_icon_eu", "dwd_icon", "ncep_gfs025"], "variables": VARIABLES},
+    # GFS & HRRR Forecast API, GFS runs every 6 hours (HRRR updates hourly, use ModelSchedule(1, 1) and add
+    # ncep_hrrr_conus to the metadata for US stations)
+    "gfs": {"path": "/v1/gfs", "prefix": "gfs", "schedule": ModelSchedule(6, 4),
+            "metadata": ["ncep_gfs025", "ncep_gfs013"], "variables": VARIABLES},
+    # ECMWF Weather Forecast API, IFS runs every 6 hours
+    "ecmwf": {"path": "/v1/ecmwf", "prefix": "ecmwf", "schedule": ModelSchedule(6, 7),
+              "metadata": ["ecmwf_ifs025"], "variables": VARIABLES},
+}
+
+# Default stations as (station name, latitude, longitude)
+STATIONS = [("Pljevlja", 43.35, 19.36), ("Kolašin", 42.83, 19.52), ("Zlatibor", 43.74, 19.71)]
+
+# Sections of an open-meteo response with time series of variables
+SECTIONS = {
+    "hourly": lambda response: response.Hourly(),
+    "daily": lambda response: response.Daily(),
+    "minutely_15": lambda response: response.Minutely15(),
+}
+
+# Directory of the station index files (grid points and interpolation weights of the stations)
+INDEX_DIR = ".station_index"
+
+
+def create_session(retries=5, backoff_factor=0.2):
+    """
+    Setup HTTP session with retry on error (responses are cached per model run by the RunCache)
+
+    Args:
+        retries: number of retries on error
+        backoff_factor: backoff factor between retries
+
+    Returns:
+        requests session
+    """
+    return track_session(retry(requests.Session(), retries=retries, backoff_factor=backoff_factor))
+
+
+def create_client(retries=5, backoff_factor=0.2):
+    """Setup Open-Meteo API client with retry on error, see create_session"""
+    return openmeteo_requests.Client(session=create_session(retries, backoff_factor))
+
+
+def create_cache(directory=CACHE_DIR, max_memory=256 * 2 ** 20, max_disk=2 ** 30):
+    """RunCache with the publish schedules of the models"""
+    schedules = {model["path"]: model["schedule"] for model in MODELS.values()}
+    return RunCache(create_session(), schedules, directory, max_memory, max_disk)
+
+
+class Fetcher:
+    """
+    Keeps a bounded number of open-meteo requests in flight across all models and stations
+
+    Args:
+        client: openmeteo_requests.Client, a new one is created if neither client nor cache are given
+        max_workers: maximum number of requests in flight
+        max_per_host: maximum number of requests in flight to a single host
+        cache: RunCache of the responses, fetched through its own session instead of the client, responses are not
+               cached if None
+    """
+
+    def __init__(self, client=None, max_workers=8, max_per_host=4, cache=None):
+        if client is None and cache is None:
+            client = create_client()
+        self.client = client
+        self.cache = cache
+        self.max_per_host = max_per_host
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._host_limits = {}
+        self._lock = threading.Lock()
+
+    def _host_limit(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_limits[host]
+
+    def _fetch(self, url, params):
+        with self._host_limit(url), METRICS.stage("fetch", model=model_label(url)):
+            if self.cache is not None:
+                return self.cache.weather_api(url, params)
+            return self.client.weather_api(url, params=params)
+
+    def submit(self, url, params):
+        """Schedule an API call, returns a future with the list of responses"""
+        return self._executor.submit(self._fetch, url, params)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def model_url(endpoint, base_url=BASE_URL):
+    """Url of a model from MODELS, any other endpoint is returned unchanged"""
+    return base_url + MODELS[endpoint]["path"] if endpoint in MODELS else endpoint
+
+
+def model_variables(model, variables=None):
+    """
+    Hourly variables of a model
+
+    Args:
+        model: model name from MODELS
+        variables: list of variables used for every model, or dict relating model names and their variables,
+                   the defaults from MODELS are used if None or for models missing from the dict
+
+    Returns:
+        List of hourly variables
+    """
+    if isinstance(variables, dict):
+        variables = variables.get(model)
+    if variables is None:
+        variables = MODELS[model]["variables"] if model in MODELS else VARIABLES
+    return list(variables)
+
+
+def model_schedule(url):
+    """Publish schedule of the model of an url, hourly runs for endpoints not in MODELS"""
+    path = urlparse(url).path
+    for model in MODELS.values():
+        if model["path"] == path:
+            return model["schedule"]
+    return ModelSchedule()
+
+
+def latest_model_run(model, base_url=BASE_URL, session=None, timeout=10):
+    """
+    Init time of the latest run of a model published by open-meteo, from the metadata of its upstream models
+    (/data/<upstream model>/static/meta.json)
+
+    Args:
+        model: model name from MODELS
+        base_url: open-meteo server
+        session: requests session, a new connection per request if None
+        timeout: seconds to wait for every metadata request
+
+    Returns:
+        Run time (UTC) of the newest run of the upstream models (seamless models change with any of them)
+    """
+    session = session if session is not None else requests
+    runs = []
+    for upstream in MODELS[model]["metadata"]:
+        response = session.get(f"{base_url}/data/{upstream}/static/meta.json", timeout=timeout)
+        response.raise_for_status()
+        runs.append(int(response.json()["last_run_initialisation_time"]))
+    return datetime.fromtimestamp(max(runs), timezone.utc)
+
+
+def time_index(time, time_end, interval):
+    """Date-time index from start, end and interval in seconds"""
+    return pd.date_range(start=pd.to_datetime(int(time), unit="s", utc=True),
+                         end=pd.to_datetime(int(time_end), unit="s", utc=True),
+                         freq=pd.Timedelta(seconds=int(interval)),
+                         inclusive="left")
+
+
+def log_stations(names, latitude, longitude, corners, log):
+    """
+    Log meteo station info
+
+    Args:
+        names, latitude, longitude: station names and coordinates
+        corners: array (stations x 4 x 2) of coordinates of the grid points surrounding every station
+        log: logging.Logger the station info is written to
+    """
+    for i, name in enumerate(names):
+        log.info("meteo station", extra={"station": name, "latitude": float(latitude[i]),
+                                         "longitude": float(longitude[i]), "corners": corners[i].tolist()})
+
+
+def station_frames(names, date_time, columns, time_column="date-time"):
+    """
+    Create dataframes of interpolated stations
+
+    Args:
+        names: station names
+        date_time: date-time index of the values
+        columns: dict relating output column names and arrays (stations x time) of values
+        time_column: name of the date-time column
+
+    Returns:
+        List of dataframes with the data of every station
+    """
+    frames = []
+    for i, name in enumerate(names):
+        data = {"meteo-station": name, time_column: date_time}
+        for column, values in columns.items():
+            data[column] = values[i]
+        frames.append(pd.DataFrame(data=data))
+    return frames
+
+
+def iter_interpolated(url, sections, period, fetcher, index, batch_requests=True, max_locations=100,
+                      point_cache=None):
+    """
+    Fetch an open-meteo model and interpolate it to the stations of an index, as soon as the responses of every
+    station arrive
+
+    Grid points found in the point cache are not requested, stations whose grid points are all cached are yielded
+    first.
+
+    Args:
+        url: url of an open-meteo API endpoint
+        sections: dict relating sections of the response (hourly, daily, minutely_15) and their variables
+        period: request parameters of the time period, past_days and forecast_days or start_date and end_date
+        fetcher, batch_requests, max_locations, point_cache: see iter_model
+        index: StationIndex of the stations
+
+    Yields:
+        (stations, date_time, interpolated) with an array of station indices, and dicts relating every section and
+        its date-time index and array (stations x variables x time) of interpolated values
+    """
+    params = {section: list(variables) for section, variables in sections.items()}
+    params.update(period)
+
+    # Decoded values (variables x time) of every section and resolved coordinates of every grid point of the index
+    point_values = {section: [None] * len(index.points) for section in sections}
+    resolved = np.full(index.points.shape, np.nan)
+    date_time = {}
+
+    model = model_label(url)
+    if point_cache is not None:
+        run = model_schedule(url).latest_run().strftime('%Y%m%d%H')
+        request = request_key(params)
+        for j, (lat, lon) in enumerate(index.points.tolist()):
+            cached = {section: point_cache.get(model, run, request, lat, lon, variables, section)
+                      for section, variables in sections.items()}
+            if all(c is not None for c in cached.values()):
+                for section, (meta, values) in cached.items():
+                    point_values[section][j] = values
+                    resolved[j] = meta[3:5]
+                    if section not in date_time:
+                        date_time[section] = time_index(*meta[:3])
+
+    def store(point_ids, responses):
+        with METRICS.stage("decode", model=model):
+            store_values(point_ids, responses)
+
+    def store_values(point_ids, responses):
+        for j, r in zip(point_ids, responses):
+            resolved[j] = (r.Latitude(), r.Longitude())
+            for section, variables in sections.items():
+                data = SECTIONS[section](r)
+                if section not in date_time:
+                    date_time[section] = time_index(data.Time(), data.TimeEnd(), data.Interval())
+                values = np.array([data.Variables(k).ValuesAsNumpy() for k in range(len(variables))])
+                point_values[section][j] = values
+                if point_cache is not None:
+                    meta = (data.Time(), data.TimeEnd(), data.Interval(), *resolved[j])
+                    point_cache.put(model, run, request, *index.points[j], variables, meta, values, section)
+
+    def interpolate(ready):
+        with METRICS.stage("interpolate", model=model):
+            return interpolate_values(ready)
+
+    def interpolate_values(ready):
+        # Gather values of the corners of all ready stations and interpolate them at once
+        ready = np.array(ready)
+        ids = index.station_indices[ready]
+        index.resolve(ready, resolved[ids])
+        interpolated = {}
+        for section, values in point_values.items():
+            corner_values = np.array([[values[j] for j in row] for row in ids])
+            interpolated[section] = np.around(index.interpolate(ready, corner_values), decimals=2)
+        return ready, date_time, interpolated
+
+    if batch_requests:
+        # Fetch grid points missing from the cache in chunks, grid points shared by nearby stations are requested once
+        pending = [j for j in range(len(index.points)) if np.isnan(resolved[j, 0])]
+        chunks = [pending[start:start + max_locations] for start in range(0, len(pending), max_locations)]
+    else:
+        # One API call per station with the grid points surrounding it
+        chunks = [[j for j in dict.fromkeys(row) if np.isnan(resolved[j, 0])]
+                  for row in index.station_indices.tolist()]
+    futures = {fetcher.submit(url, locations_params(params, index.points[chunk])): c
+               for c, chunk in enumerate(chunks) if chunk}
+
+    # Chunks still missing for every station, and stations waiting for every chunk
+    if batch_requests:
+        chunk_of = {j: c for c, chunk in enumerate(chunks) for j in chunk}
+        missing = [{chunk_of[j] for j in row if j in chunk_of} for row in index.station_indices.tolist()]
+    else:
+        missing = [{i} if chunk else set() for i, chunk in enumerate(chunks)]
+    waiting = {}
+    for i, station_chunks in enumerate(missing):
+        for c in station_chunks:
+            waiting.setdefault(c, []).append(i)
+
+    cached = [i for i, station_chunks in enumerate(missing) if not station_chunks]
+    if cached:
+        yield interpolate(cached)
+    for future in as_completed(futures):
+        c = futures[future]
+        store(chunks[c], future.result())
+        ready = []
+        for i in waiting.get(c, []):
+            missing[i].discard(c)
+            if not missing[i]:
+                ready.append(i)
+        if ready:
+            yield interpolate(ready)
+
+
+def reindex_columns(columns, positions, length):
+    """Place arrays (stations x time) of columns at positions of a longer time axis, NaN elsewhere"""
+    result = {}
+    for column, values in columns.items():
+        result[column] = np.full(values.shape[:-1] + (length,), np.nan)
+        result[column][..., positions] = values
+    return result
+
+
+def iter_model(endpoint, stations, variables=VARIABLES, past_days=2, forecast_days=7, fetcher=None,
+               batch_requests=True, max_locations=100, log=None, index=None, point_cache=None,
+               daily=None, minutely_15=None, rollups=None, start_date=None, end_date=None):
+    """
+    Fetch weather of an open-meteo model, yielding every station as soon as its responses arrive
+
+    Args:
+        endpoint: model name from MODELS or url of an open-meteo API endpoint
+        stations: list of (station name, latitude, longitude) tuples
+        variables: hourly variables to fetch
+        past_days: weather info for how many past days
+        forecast_days: weather info for how many future days
+        fetcher: Fetcher shared between models, a new one without response cache is created if not given
+        batch_requests: fetch all stations with multi-location requests instead of one request per station
+        max_locations: maximum number of grid points sent in a single multi-location request
+        log: logging.Logger the station info is written to, the weather_api logger if None
+        index: StationIndex of the stations, a new one is built on the grid of the model if not given
+        point_cache: PointCache of decoded grid point values shared between models, not used if None
+        daily: native open-meteo daily variables (e.g. precipitation_sum, temperature_2m_max)
+        minutely_15: native open-meteo 15-minutely variables (e.g. precipitation)
+        rollups: rollups of the hourly variables computed at ingest time (see rollups.py), e.g.
+                 precipitation:daily_sum or precipitation:rolling_sum_24h
+        start_date, end_date: first and last day (YYYY-MM-DD) to fetch instead of past_days and forecast_days
+
+    Yields:
+        (station index, dict relating outputs (hourly, and daily/minutely_15 if requested) and dataframes of the
+        station)
+    """
+    url = model_url(endpoint)
+    if log is None:
+        log = logging.getLogger(LOGGER_NAME)
+    own_fetcher = fetcher is None
+    if own_fetcher:
+        fetcher = Fetcher()
+    if index is None:
+        index = StationIndex.build(stations, model_grid(endpoint))
+    meteo_station = [s[0] for s in stations]
+    variables = list(variables)
+    rollups = list(rollups or [])
+    for rollup in rollups:
+        if parse_rollup(rollup)[0] not in variables:
+            raise ValueError(f"Rollup {rollup} needs the hourly variable {parse_rollup(rollup)[0]}")
+    sections = {"hourly": variables, "daily": list(daily or []), "minutely_15": list(minutely_15 or [])}
+    sections = {section: names for section, names in sections.items() if names or section == "hourly"}
+    if start_date is not None:
+        period = {"start_date": str(start_date), "end_date": str(end_date)}
+    else:
+        period = {"past_days": past_days, "forecast_days": forecast_days}
+
+    try:
+        stations_iter = iter_interpolated(url, sections, period, fetcher, index, batch_requests, max_locations,
+                                          point_cache)
+        for ready, date_time, interpolated in stations_iter:
+            names = [meteo_station[i] for i in ready]
+            log_stations(names, index.latitude[ready], index.longitude[ready], index.corners[ready], log)
+
+            columns = {section: {COLUMN_NAMES.get(v, v): interpolated[section][:, k]
+                                 for k, v in enumerate(section_variables)}
+                       for section, section_variables in sections.items()}
+            hourly_rollups, days, daily_rollups = compute_rollups(rollups, variables, interpolated["hourly"],
+                                                                  date_time["hourly"], COLUMN_NAMES)
+            columns["hourly"].update(hourly_rollups)
+
+            outputs = {"hourly": station_frames(names, date_time["hourly"], columns["hourly"])}
+            if "daily" in sections or daily_rollups:
+                # Native daily variables and daily rollups on the union of their days
+                daily_time = date_time["daily"].union(days) if "daily" in sections else days
+                daily_columns = {}
+                if "daily" in sections:
+                    positions = daily_time.get_indexer(date_time["daily"])
+                    daily_columns.update(reindex_columns(columns["daily"], positions, len(daily_time)))
+                daily_columns.update(reindex_columns(daily_rollups, daily_time.get_indexer(days), len(daily_time)))
+                outputs["daily"] = station_frames(names, daily_time, daily_columns, time_column="date")
+            if "minutely_15" in sections:
+                outputs["minutely_15"] = station_frames(names, date_time["minutely_15"], columns["minutely_15"])
+
+            for k, i in enumerate(ready.tolist()):
+                yield i, {output: frames[k] for output, frames in outputs.items()}
+    finally:
+        if own_fetcher:
+            fetcher.shutdown()
+
+
+def fetch_model(endpoint, stations, variables=VARIABLES, past_days=2, forecast_days=7, fetcher=None,
+                batch_requests=True, max_locations=100, log=None, daily=None, minutely_15=None, rollups=None):
+    """
+    Fetch weather of an open-meteo model and interpolate it to the stations
+
+    Args:
+        endpoint, stations, variables, past_days, forecast_days, fetcher, batch_requests, max_locations, log,
+        daily, minutely_15, rollups: see iter_model
+
+    Returns:
+        Dataframe with hourly data of all stations, or a dict relating outputs (hourly, daily, minutely_15) and
+        their dataframes if daily/minutely_15 variables or rollups are given
+    """
+    stations_iter = iter_model(endpoint, stations, variables, past_days, forecast_days, fetcher, batch_requests,
+                               max_locations, log, daily=daily, minutely_15=minutely_15, rollups=rollups)
+    frames = dict(stations_iter)
+    outputs = {output: pd.concat([frames[i][output] for i in range(len(stations))], ignore_index=True)
+               for output in frames[0]} if frames else {"hourly": pd.DataFrame()}
+    return outputs if daily or minutely_15 or rollups else outputs["hourly"]
+
+
+def run_model(model, stations=STATIONS, variables=None, past_days=2, forecast_days=7, fetcher=None,
+              batch_requests=True, max_locations=100, base_url=BASE_URL, index_dir=INDEX_DIR,
+              output_format="csv", output_dir=OUTPUT_DIR, point_cache=None, daily=None, minutely_15=None,
+              rollups=None, metrics_file=None):
+    """
+    Fetch a model and write its results and JSON log to files named by today's date
+
+    Every station is written to the output sink as soon as its responses arrive. Daily data (native daily variables
+    and daily rollups) and 15-minutely data are written to their own outputs (e.g. gfs_daily_2024-06-01.csv).
+
+    Args:
+        model: model name from MODELS
+        stations, past_days, forecast_days, batch_requests, max_locations: see iter_model
+        variables: hourly variables, list or dict relating model names and their variables (see model_variables)
+        fetcher: Fetcher shared between models, a new one with the default response cache is created if not given
+        base_url: open-meteo server the model is fetched from
+        index_dir: directory of the station index files, the index is rebuilt on every run if None
+        output_format: csv, parquet or arrow (see sinks.py)
+        output_dir: root directory of the parquet/arrow datasets
+        point_cache: PointCache shared between models, a default one is created if neither fetcher nor point_cache
+                     are given
+        daily, minutely_15, rollups: see iter_model
+        metrics_file: Prometheus text file the metrics of the process are written to, not written if None
+
+    Returns:
+        Written csv file or dataset directory of the hourly data
+    """
+    prefix = MODELS[model]["prefix"]
+    variables = model_variables(model, variables)
+    index_path = os.path.join(index_dir, f"{model}.npz") if index_dir else None
+    grid = model_grid(model)
+    index = load_station_index(index_path, stations, grid) if index_path else StationIndex.build(stations, grid)
+    log_filename = datetime.now().strftime(f"{prefix}_%Y-%m-%d.jsonl")
+    url = model_url(model, base_url)
+    label = model_label(url)
+    own_fetcher = fetcher is None
+    if own_fetcher:
+        fetcher = Fetcher(cache=create_cache())
+        if point_cache is None:
+            point_cache = PointCache()
+    log = open_log(log_filename, f"{LOGGER_NAME}.{prefix}")
+    try:
+        stage_start = METRICS.stage_seconds(model=label)
+        log.info("run started", extra={"model": label, "stations": len(stations), "variables": variables})
+        with ExitStack() as sinks:
+            targets = {}
+            stations_iter = iter_model(url, stations, variables, past_days, forecast_days, fetcher, batch_requests,
+                                       max_locations, log, index, point_cache, daily, minutely_15, rollups)
+            for i, frames in stations_iter:
+                for output, df in frames.items():
+                    if output not in targets:
+                        name = prefix if output == "hourly" else f"{prefix}_{output}"
+                        csv_filename = datetime.now().strftime(f"{name}_%Y-%m-%d.csv")
+                        targets[output] = sinks.enter_context(open_sink(output_format, name, csv_filename,
+                                                                        output_dir))
+                    with METRICS.stage("write", model=label):
+                        targets[output].write(df)
+        if fetcher.cache is not None:
+            METRICS.cache_stats(fetcher.cache.store(url), model=label, cache="response")
+            log.info("response cache", extra=fetcher.cache.store(url).stats())
+        if point_cache is not None:
+            METRICS.cache_stats(point_cache, cache="point")
+            log.info("point cache", extra=point_cache.stats())
+        log.info("run finished", extra={"model": label,
+                                        "stage_seconds": METRICS.stage_seconds(stage_start, model=label)})
+    except Exception:
+        log.exception("run failed", extra={"model": label})
+        raise
+    finally:
+        if own_fetcher:
+            fetcher.shutdown()
+        close_log(log)
+    if index_path and index.dirty:
+        index.save(index_path)
+    if metrics_file:
+        METRICS.write_prometheus(metrics_file)
+    return targets["hourly"].target if "hourly" in targets else None
+
+
+def run_models(models, fetcher=None, **kwargs):
+    """
+    Fetch several models at the same time, sharing one HTTP session, cache and request limits
+
+    Args:
+        models: list of model names from MODELS
+        fetcher: Fetcher shared between models, a new one without response cache is created if not given
+        kwargs: arguments of run_model
+
+    Returns:
+        List of written csv files or dataset directories
+    """
+    own_fetcher = fetcher is None
+    if own_fetcher:
+        fetcher = Fetcher()
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(models), 1)) as executor:
+            futures = [executor.submit(run_model, model, fetcher=fetcher, **kwargs) for model in models]
+            return [future.result() for future in futures]
+    finally:
+        if own_fetcher:
+            fetcher.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download and interpolate open-meteo weather for meteo stations.")
+    parser.add_argument("models", nargs="*", metavar="MODEL",
+                        help=f"models to fetch: {', '.join(MODELS)} (default: all)")
+    parser.add_argument("--past-days", type=int, default=2, help="weather info for how many past days")
+    parser.add_argument("--forecast-days", type=int, default=7, help="weather info for how many future days")
+    parser.add_argument("--variables", nargs="+", help="hourly variables of all models (default: variables in MODELS)")
+    parser.add_argument("--model-variables", action="append", default=[], metavar="MODEL=VARIABLE,...",
+                        help="hourly variables of a single model, e.g. gfs=temperature_2m,wind_speed_10m")
+    parser.add_argument("--daily", nargs="+", default=[], help="native daily variables (e.g. precipitation_sum)")
+    parser.add_argument("--minutely-15", nargs="+", default=[], help="native 15-minutely variables")
+    parser.add_argument("--rollups", nargs="+", default=[], metavar="VARIABLE:ROLLUP",
+                        help="rollups computed at ingest time, e.g. precipitation:daily_sum temperature_2m:daily_max "
+                             "precipitation:rolling_sum_72h")
+    parser.add_argument("--max-locations", type=int, default=100,
+                        help="maximum number of grid points sent in a single request")
+    parser.add_argument("--no-batch", dest="batch_requests", action="store_false",
+                        help="send one request per station")
+    parser.add_argument("--max-workers", type=int, default=8, help="maximum number of requests in flight")
+    parser.add_argument("--max-per-host", type=int, default=4,
+                        help="maximum number of requests in flight to a single host")
+    parser.add_argument("--base-url", default=BASE_URL, help="open-meteo server (e.g. a local stub server)")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="directory of the station index files")
+    parser.add_argument("--output-format", default="csv", choices=OUTPUT_FORMATS, help="format of the output")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="root directory of the parquet/arrow datasets")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="directory of the response cache")
+    parser.add_argument("--cache-max-mb", type=int, default=1024,
+                        help="maximum size of the response cache of every model on disk")
+    parser.add_argument("--point-cache-dir", default=POINT_CACHE_DIR, help="directory of the grid point value cache")
+    parser.add_argument("--no-cache", dest="cache", action="store_false",
+                        help="do not cache responses and grid point values")
+    parser.add_argument("--metrics-file", help="Prometheus text file with per-stage timing, requests and cache stats")
+    args = parser.parse_args(argv)
+    unknown = [model for model in args.models if model not in MODELS]
+    if unknown:
+        parser.error(f"unknown models {', '.join(unknown)}")
+    args.models = args.models or list(MODELS)
+    variables = {model: args.variables for model in args.models}
+    for option in args.model_variables:
+        model, _, names = option.partition("=")
+        if model not in MODELS or not names:
+            parser.error(f"invalid --model-variables {option}")
+        variables[model] = names.split(",")
+
+    cache = create_cache(args.cache_dir, max_disk=args.cache_max_mb * 2 ** 20) if args.cache else None
+    point_cache = PointCache(args.point_cache_dir) if args.cache else None
+    with Fetcher(max_workers=args.max_workers, max_per_host=args.max_per_host, cache=cache) as fetcher:
+        run_models(args.models, fetcher, stations=STATIONS, variables=variables, past_days=args.past_days,
+                   forecast_days=args.forecast_days, batch_requests=args.batch_requests,
+                   max_locations=args.max_locations, base_url=args.base_url, index_dir=args.index_dir,
+                   output_format=args.output_format, output_dir=args.output_dir, point_cache=point_cache,
+                   daily=args.daily, minutely_15=args.minutely_15, rollups=args.rollups, metrics_file=args.metrics_file)
+
+
+if __name__ == "__main__":
+    main()
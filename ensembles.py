@@ -0,0 +1,148 @@
+import warnings
+
+import geoglows
+import numpy as np
+import pandas as pd
+
+from instrumentation import METRICS
+from utils import gglow_csv
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Streaming geoglows forecast ensembles
+# The forecast ensembles (52 members per river) are opened lazily from the AWS zarr store and processed one batch of
+# rivers at a time, so peak memory depends on the batch size and not on the number of rivers. Batches can be reduced
+# on the fly to ensemble statistics instead of keeping every member.
+# ----------------------------------------------------------------------------------------------------------------------
+
+# High resolution member, excluded from the ensemble statistics (same as geoglows.analyze.forecast_stats)
+HIGH_RES_MEMBER = 'ensemble_52'
+
+
+def open_forecast_ensembles(river_ids, date=None):
+    """
+    Open forecast ensembles lazily, no data is downloaded until a batch is selected
+
+    Args:
+        river_ids: list of river IDs (LINKNO)
+        date: forecast date (YYYYMMDD), latest available if None
+
+    Returns:
+        xarray Dataset with dimensions ensemble, datetime and river_id
+    """
+    kwargs = {'date': date} if date else {}
+    return geoglows.data.forecast_ensembles(river_id=list(river_ids), format='xarray', **kwargs)
+
+
+def ensembles_frame(ds, river_ids):
+    """
+    Load forecast ensembles of some rivers in the format of geoglows.data.forecast_ensembles
+
+    Args:
+        ds: dataset from open_forecast_ensembles
+        river_ids: list of river IDs to load
+
+    Returns:
+        Dataframe with a (time, river_id) index and one column per ensemble member
+    """
+    df = ds.sel(river_id=list(river_ids)).to_dataframe().round(2).reset_index()
+    df = df.pivot(index=['datetime', 'river_id'], columns='ensemble', values='Qout')
+    df.index.names = ['time', 'river_id']
+    df = df[sorted(df.columns)]
+    df.columns = [f'ensemble_{str(x).zfill(2)}' for x in df.columns]
+    return df
+
+
+def iter_forecast_ensembles(river_ids, dictionary, batch_size=10, date=None, river_column=None):
+    """
+    Yield parsed forecast ensembles one batch of rivers at a time
+
+    Rivers are processed in order of their station names, so the batches together are sorted the same way as
+    gglow_csv sorts a single dataframe.
+
+    Args:
+        river_ids: list of river IDs (LINKNO)
+        dictionary: dict relating river_ids and meteo station names
+        batch_size: number of rivers loaded at once
+        date: forecast date (YYYYMMDD), latest available if None
+        river_column: column the river IDs are kept in (see gglow_csv), not kept if None
+
+    Yields:
+        Dataframe parsed by gglow_csv
+    """
+    river_ids = sorted(river_ids, key=lambda r: str(dictionary.get(r, r)))
+    ds = open_forecast_ensembles(river_ids, date)
+    for start in range(0, len(river_ids), batch_size):
+        with METRICS.stage("geoglows", dataset="forecast_ensembles"):
+            df = ensembles_frame(ds, river_ids[start:start + batch_size])
+        yield gglow_csv(df, dictionary, 'forecast', river_column)
+
+
+def return_period_thresholds(river_ids):
+    """
+    Get return period discharge thresholds of rivers
+
+    Args:
+        river_ids: list of river IDs (LINKNO), listed more than once or not
+
+    Returns:
+        Dataframe with one row per river ID and one column per return period (years)
+    """
+    with METRICS.stage("geoglows", dataset="return_periods"):
+        df = geoglows.data.return_periods(river_id=list(dict.fromkeys(int(r) for r in river_ids)))
+    df.index = df.index.astype(np.int64)
+    df.index.name = 'river_id'
+    return df[~df.index.duplicated()]
+
+
+def reduce_ensembles(df, reductions, thresholds=None, river_column='river_id'):
+    """
+    Reduce parsed forecast ensembles to ensemble statistics in one vectorized pass over all rivers and time steps
+
+    Args:
+        df: dataframe parsed by gglow_csv
+        reductions: list of statistics: mean, median, min, max or pNN for the NN-th percentile (e.g. p10, p90)
+        thresholds: dataframe from return_period_thresholds, adds the probability of exceeding every return period
+        river_column: column with the river IDs of the rows (see gglow_csv), needed with thresholds. Thresholds are
+                      joined on the river ID, so several rivers of the same meteo station get their own thresholds
+
+    Returns:
+        Dataframe with meteo-station, date-time, one flow_<reduction> column per statistic, one prob_rp<N> column
+        per return period (fraction of members exceeding the threshold) and the high_res member
+    """
+    members = [c for c in df.columns if c.startswith('ensemble_') and c != HIGH_RES_MEMBER]
+    values = df[members].to_numpy(dtype=np.float64)  # (rivers x time steps) x members
+    functions = {'mean': np.nanmean, 'median': np.nanmedian, 'min': np.nanmin, 'max': np.nanmax}
+
+    data = {'meteo-station': df['meteo-station'].to_numpy(), 'date-time': df['date-time'].to_numpy()}
+    with warnings.catch_warnings():
+        # All-NaN rows (e.g. time steps without members) give NaN statistics
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for reduction in reductions:
+            if reduction in functions:
+                data[f'flow_{reduction}'] = np.round(functions[reduction](values, axis=1), 2)
+            elif reduction.startswith('p') and reduction[1:].isdigit():
+                data[f'flow_{reduction}'] = np.round(np.nanpercentile(values, int(reduction[1:]), axis=1), 2)
+            else:
+                raise ValueError(f"Unknown ensemble reduction: {reduction}")
+
+        if thresholds is not None:
+            if river_column not in df.columns:
+                raise ValueError(f"Return period exceedance needs the river IDs in the {river_column} column")
+            # Thresholds of the river of every row (rows x return periods)
+            row_thresholds = thresholds.reindex(df[river_column].to_numpy(dtype=np.int64)).to_numpy(dtype=np.float64)
+            valid = ~np.isnan(values)
+            n_valid = valid.sum(axis=1)
+            for k, return_period in enumerate(thresholds.columns):
+                exceeding = (values > row_thresholds[:, k:k + 1]).sum(axis=1)
+                probability = np.where(n_valid > 0, exceeding / np.maximum(n_valid, 1), np.nan)
+                probability[np.isnan(row_thresholds[:, k])] = np.nan
+                data[f'prob_rp{return_period}'] = np.round(probability, 3)
+
+    if HIGH_RES_MEMBER in df.columns:
+        data['high_res'] = df[HIGH_RES_MEMBER].to_numpy()
+    # Compact output: float32 statistics and dictionary encoded station names
+    summary = pd.DataFrame(data)
+    summary = summary.astype({c: 'float32' for c in summary.columns if c not in ('meteo-station', 'date-time')})
+    summary['meteo-station'] = summary['meteo-station'].astype('category')
+    return summary
@@ -0,0 +1,279 @@
+import argparse
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+import geoglows
+import pandas as pd
+
+from instrumentation import LOGGER_NAME, METRICS, close_log, open_log
+from retrospective_store import retrospective_since
+from sinks import OUTPUT_FORMATS, open_sink
+from utils import gglow_csv
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Parallel geoglows fetches
+# River IDs are split into batches (shards) and every shard of every dataset is requested in a shared thread pool, so
+# forecast, forecast_ensembles, retrospective and daily_averages are downloaded at the same time and a slow river only
+# holds up its own shard. A failing shard is retried on its own with exponential backoff; if it keeps failing, its
+# rivers are retried one by one and rivers that still fail are logged and left out instead of failing the whole run.
+# Shards are parsed by gglow_csv as they arrive. Forecast shards hold rivers in order of their station names, so the
+# parsed shards written one after another are sorted like a single gglow_csv frame, without a concat and sort of all
+# rivers. Wide historical shards are joined column-wise on the time index.
+# ----------------------------------------------------------------------------------------------------------------------
+
+# geoglows.data functions and the gglow_csv type of their data
+DATASETS = {
+    "forecast": "forecast",
+    "forecast_ensembles": "forecast",
+    "retrospective": "historical",
+    "daily_averages": "historical",
+}
+
+# Default rivers (LINKNO) and the names of their meteo stations
+RIVERS = {220252711: "Uvac", 220249952: "Kokin Brod", 220212799: "Bistrica"}
+
+
+class GeoglowsFetcher:
+    """
+    Fetch geoglows datasets in shards of rivers in a thread pool
+
+    Args:
+        max_workers: maximum number of geoglows requests in flight
+        batch_size: number of rivers per request
+        retries: number of retries of a failed request
+        backoff_factor: seconds before the first retry, doubled on every further retry
+        log: logging.Logger retries and failed rivers are written to, the weather_api logger if None
+
+    Attributes:
+        failed: dict relating datasets and lists of river IDs that could not be fetched
+    """
+
+    def __init__(self, max_workers=4, batch_size=10, retries=3, backoff_factor=1.0, log=None):
+        self.batch_size = max(batch_size, 1)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.log = log if log is not None else logging.getLogger(LOGGER_NAME)
+        self.failed = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+
+    def _call(self, dataset, river_ids=None, function=None):
+        """Call a geoglows.data function (or function in its place), for the river IDs if given, retrying on error"""
+        function = function if function is not None else getattr(geoglows.data, dataset)
+        kwargs = {} if river_ids is None else {"river_id": list(river_ids)}
+        for attempt in range(self.retries + 1):
+            try:
+                with METRICS.stage("geoglows", dataset=dataset):
+                    return function(**kwargs)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                METRICS.add("geoglows_retries_total", 1, dataset=dataset)
+                self.log.warning("geoglows request failed, retrying",
+                                 extra={"dataset": dataset, "rivers": kwargs.get("river_id"), "attempt": attempt + 1,
+                                        "error": str(e)})
+                time.sleep(self.backoff_factor * 2 ** attempt)
+
+    def forecast_dates(self):
+        """
+        Dates of the forecasts published by geoglows (geoglows.data.dates), without downloading any forecast
+
+        Returns:
+            Sorted list of the forecast dates as run times (00 UTC)
+        """
+        dates = self._call("dates")
+        if isinstance(dates, dict):
+            dates = dates.get("dates", [])
+        elif isinstance(dates, pd.DataFrame):
+            dates = dates.iloc[:, 0]
+        # Dates are given as YYYYMMDD, optionally followed by the hour of the run
+        days = pd.Series(dates, dtype=str).str.replace(r"\D", "", regex=True).str[:8]
+        return sorted(day.to_pydatetime() for day in pd.to_datetime(days, format="%Y%m%d", utc=True))
+
+    def _fetch_shard(self, dataset, river_ids, dictionary, river_column=None, function=None):
+        """Raw data of a shard of rivers, parsed by gglow_csv for forecast data, None if no river could be fetched"""
+        try:
+            frames = [self._call(dataset, river_ids, function)]
+        except Exception as e:
+            if len(river_ids) == 1:
+                self._fail(dataset, river_ids, e)
+                return None
+            # Retry the rivers of the failing shard one by one, so a single bad river does not fail the others
+            frames = []
+            for river_id in river_ids:
+                try:
+                    frames.append(self._call(dataset, [river_id], function))
+                except Exception as e:
+                    self._fail(dataset, [river_id], e)
+            if not frames:
+                return None
+        csv_type = DATASETS[dataset]
+        if csv_type == "forecast":
+            df = frames[0] if len(frames) == 1 else pd.concat(frames)
+            return gglow_csv(df, dictionary, "forecast", river_column)
+        return frames[0] if len(frames) == 1 else pd.concat(frames, axis=1)
+
+    def _fail(self, dataset, river_ids, error):
+        with self._lock:
+            self.failed.setdefault(dataset, []).extend(river_ids)
+        METRICS.add("geoglows_failed_rivers_total", len(river_ids), dataset=dataset)
+        self.log.error("geoglows request failed, rivers left out",
+                       extra={"dataset": dataset, "rivers": list(river_ids), "error": str(error)})
+
+    def shards(self, dataset, river_ids, dictionary):
+        """Split river IDs into shards, rivers of forecast data in order of their station names"""
+        river_ids = [int(r) for r in river_ids]
+        if DATASETS[dataset] == "forecast":
+            river_ids = sorted(river_ids, key=lambda r: str(dictionary.get(r, r)))
+        return [river_ids[start:start + self.batch_size] for start in range(0, len(river_ids), self.batch_size)]
+
+    def submit(self, dataset, river_ids, dictionary, river_column=None):
+        """
+        Schedule the requests of all shards of a dataset
+
+        Args:
+            dataset: dataset from DATASETS
+            river_ids: list of river IDs (LINKNO)
+            dictionary: dict relating river_ids and meteo station names
+            river_column: column the river IDs of forecast data are kept in (see gglow_csv), not kept if None
+
+        Returns:
+            (dataset, dictionary, futures) to pass to iter_shards or merge, the futures are in shard order
+        """
+        if dataset not in DATASETS:
+            raise ValueError(f"Unknown geoglows dataset {dataset}, expected one of {', '.join(DATASETS)}")
+        futures = [self._executor.submit(self._fetch_shard, dataset, shard, dictionary, river_column)
+                   for shard in self.shards(dataset, river_ids, dictionary)]
+        return dataset, dictionary, futures
+
+    def iter_shards(self, submitted):
+        """
+        Yield parsed forecast data one shard at a time, in shard order as soon as the shard arrives
+
+        Args:
+            submitted: result of submit for a forecast dataset
+
+        Yields:
+            Dataframe parsed by gglow_csv
+        """
+        dataset, _, futures = submitted
+        if DATASETS[dataset] != "forecast":
+            raise ValueError(f"{dataset} data is merged column-wise, use merge")
+        for future in futures:
+            df = future.result()
+            if df is not None:
+                yield df
+
+    def merge(self, submitted):
+        """
+        Merge all shards of a dataset into one dataframe parsed by gglow_csv
+
+        Args:
+            submitted: result of submit
+
+        Returns:
+            Dataframe parsed by gglow_csv
+        """
+        dataset, dictionary, futures = submitted
+        if DATASETS[dataset] == "forecast":
+            frames = list(self.iter_shards(submitted))
+            return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        frames = [df for df in (future.result() for future in futures) if df is not None]
+        if not frames:
+            return pd.DataFrame()
+        # Shards hold different rivers of the same time steps
+        return gglow_csv(frames[0] if len(frames) == 1 else pd.concat(frames, axis=1), dictionary, "historical")
+
+    def retrospective(self, river_ids, start=None):
+        """
+        Retrospective discharge of rivers after a timestamp, requested in shards with retries (the fetch function of
+        RetrospectiveStore.update)
+
+        Args:
+            river_ids: list of river IDs (LINKNO)
+            start: only time steps after this timestamp are downloaded, full history if None
+
+        Returns:
+            Dataframe with a time index and one column per river ID, rivers that could not be fetched are left out
+        """
+        function = partial(retrospective_since, start=start)
+        futures = [self._executor.submit(self._fetch_shard, "retrospective", shard, {}, None, function)
+                   for shard in self.shards("retrospective", river_ids, {})]
+        frames = [df for df in (future.result() for future in futures) if df is not None]
+        if not frames:
+            return pd.DataFrame()
+        return frames[0] if len(frames) == 1 else pd.concat(frames, axis=1)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch geoglows datasets of rivers in parallel shards.")
+    parser.add_argument("datasets", nargs="*", metavar="DATASET",
+                        help=f"datasets to fetch: {', '.join(DATASETS)} (default: all)")
+    parser.add_argument("--rivers", nargs="+", metavar="RIVER_ID=STATION",
+                        help="river IDs (LINKNO) and their meteo station names (default: rivers in RIVERS)")
+    parser.add_argument("--batch-size", type=int, default=10, help="number of rivers per geoglows request")
+    parser.add_argument("--max-workers", type=int, default=4, help="maximum number of geoglows requests in flight")
+    parser.add_argument("--retries", type=int, default=3, help="number of retries of a failed request")
+    parser.add_argument("--output-format", default="csv", choices=OUTPUT_FORMATS, help="format of the output")
+    parser.add_argument("--metrics-file", help="Prometheus text file with per-stage timing")
+    args = parser.parse_args(argv)
+    unknown = [dataset for dataset in args.datasets if dataset not in DATASETS]
+    if unknown:
+        parser.error(f"unknown datasets {', '.join(unknown)}")
+    datasets = args.datasets or list(DATASETS)
+    rivers = dict(RIVERS)
+    if args.rivers:
+        rivers = {}
+        for option in args.rivers:
+            river_id, _, station = option.partition("=")
+            if not river_id.isdigit() or not station:
+                parser.error(f"invalid --rivers {option}")
+            rivers[int(river_id)] = station
+    river_ids = list(rivers)
+
+    # Same output files as gglows_forecast.py and gglows_historical.py
+    filenames = {
+        "forecast": datetime.now().strftime("forecast_%Y-%m-%d.csv"),
+        "forecast_ensembles": datetime.now().strftime("forecast_ensembles_%Y-%m-%d.csv"),
+        "retrospective": "retrospective.csv",
+        "daily_averages": datetime.now().strftime("daily_averages_%Y-%m-%d.csv"),
+    }
+    log = open_log(datetime.now().strftime("gglows_fetcher_%Y-%m-%d.jsonl"), f"{LOGGER_NAME}.gglows_fetcher")
+    try:
+        with GeoglowsFetcher(args.max_workers, args.batch_size, args.retries, log=log) as fetcher:
+            # Every dataset is requested before any is written, so all of them are downloaded at the same time
+            submitted = {}
+            for dataset in datasets:
+                log.info(f"Launching geoglows.data.{dataset}.", extra={"dataset": dataset, "rivers": len(river_ids)})
+                submitted[dataset] = fetcher.submit(dataset, river_ids, rivers)
+            for dataset, shards in submitted.items():
+                with open_sink(args.output_format, dataset, filenames[dataset]) as sink:
+                    frames = fetcher.iter_shards(shards) if DATASETS[dataset] == "forecast" else [fetcher.merge(shards)]
+                    for df in frames:
+                        with METRICS.stage("write", dataset=dataset):
+                            sink.write(df)
+                log.info(f"Finished geoglows.data.{dataset}.",
+                         extra={"dataset": dataset, "failed": fetcher.failed.get(dataset, [])})
+        log.info("Finished geoglows datasets.", extra={"stage_seconds": METRICS.stage_seconds()})
+    finally:
+        close_log(log)
+    if args.metrics_file:
+        METRICS.write_prometheus(args.metrics_file)
+
+
+if __name__ == "__main__":
+    main()
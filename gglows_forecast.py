@@ -1,7 +1,9 @@
-import geoglows
-from utils import gglow_csv
+from sinks import open_sink
+from ensembles import iter_forecast_ensembles, reduce_ensembles, return_period_thresholds
+from gglows_fetcher import GeoglowsFetcher
+from instrumentation import METRICS, close_log, open_log
+from contextlib import ExitStack
 from datetime import datetime
-import sys
 
 # ----------------------------------------------------------------------------------------------------------------------
 # geoglows.data module
@@ -20,28 +22,75 @@ river_ids = [220252711, 220249952, 220212799]
 meteo_stations = ["Uvac", "Kokin Brod", "Bistrica"]
 # Create river dictionary
 river_dict = dict(zip(river_ids, meteo_stations))
+output_format = "csv"  # format of the output (possible values: csv, parquet, arrow)
+batch_size = 10  # number of rivers per geoglows request, all batches are requested at the same time
+max_workers = 4  # maximum number of geoglows requests in flight
+retries = 3  # retries of a failed batch, rivers of a batch that keeps failing are retried one by one
+stream_ensembles = True  # open forecast ensembles lazily and load one batch of rivers at a time to bound peak memory
+                         # (False: request them with geoglows.data.forecast_ensembles in batches of batch_size)
+ensemble_batch_size = 10  # number of rivers per streamed batch
+ensemble_members = True  # write every ensemble member
+ensemble_reductions = []  # ensemble statistics (e.g. ["mean", "p10", "p50", "p90"])
+ensemble_exceedance = False  # add the probability of exceeding every return period of each river to the statistics
+metrics_file = None  # Prometheus text file with per-stage timing (e.g. "metrics/gglows_forecast.prom")
 
-# Create log file based on today's date and redirect print statements to it
+# Create JSON log file based on today's date
 today_date = datetime.now().strftime('gglows_forecast_%Y-%m-%d')
-log_filename = f'{today_date}.txt'
-f = open(log_filename, 'w', encoding='utf-8')
-sys.stdout = f
-
-# forecast
-print("Launching geoglows.data.forecast.")
-df_forecast = geoglows.data.forecast(river_id=river_ids)
-df_forecast = gglow_csv(df_forecast, river_dict, "forecast")
-print("\nWriting geoglows.data.forecast csv file.")
-csv_forecast = datetime.now().strftime("forecast_%Y-%m-%d.csv")
-df_forecast.to_csv(csv_forecast, mode='w', index=False, encoding='utf-8-sig')
-print("\nFinished geoglows.data.forecast.")
-
-# forecast_ensembles
-print("\n\nLaunching geoglows.data.forecast_ensembles.")
-df_forecast_ensembles = geoglows.data.forecast_ensembles(river_id=river_ids)
-df_forecast_ensembles = gglow_csv(df_forecast_ensembles, river_dict, "forecast")
-print("\nWriting geoglows.data.forecast_ensembles csv file.")
-csv_forecast_ensembles = datetime.now().strftime("forecast_ensembles_%Y-%m-%d.csv")
-df_forecast_ensembles.to_csv(csv_forecast_ensembles, mode='w', index=False, encoding='utf-8-sig')
-print("\nFinished geoglows.data.forecast_ensembles.")
+log_filename = f'{today_date}.jsonl'
 
+# The log, the fetcher and the sinks are closed (and flushed) even if a request or a write fails
+with ExitStack() as stack:
+    log = open_log(log_filename, "weather_api.gglows_forecast")
+    stack.callback(close_log, log)
+
+    # Forecast (and forecast ensembles unless streamed) of all batches of rivers are requested at the same time
+    fetcher = stack.enter_context(GeoglowsFetcher(max_workers, batch_size, retries, log=log))
+    log.info("Launching geoglows.data.forecast.", extra={"dataset": "forecast", "rivers": len(river_ids)})
+    forecast_shards = fetcher.submit("forecast", river_ids, river_dict)
+    # Exceedance thresholds are joined on the river IDs, kept in the ensemble frames until they are written
+    river_column = "river_id" if ensemble_exceedance else None
+    if not stream_ensembles:
+        log.info("Launching geoglows.data.forecast_ensembles.", extra={"dataset": "forecast_ensembles"})
+        ensemble_shards = fetcher.submit("forecast_ensembles", river_ids, river_dict, river_column)
+
+    # forecast
+    log.info("Writing geoglows.data.forecast file.", extra={"dataset": "forecast"})
+    csv_forecast = datetime.now().strftime("forecast_%Y-%m-%d.csv")
+    with open_sink(output_format, "forecast", csv_forecast) as sink:
+        for df_forecast in fetcher.iter_shards(forecast_shards):
+            with METRICS.stage("write", dataset="forecast"):
+                sink.write(df_forecast)
+    log.info("Finished geoglows.data.forecast.",
+             extra={"dataset": "forecast", "failed": fetcher.failed.get("forecast")})
+
+    # forecast_ensembles
+    write_stats = bool(ensemble_reductions) or ensemble_exceedance
+    thresholds = return_period_thresholds(river_ids) if ensemble_exceedance else None
+    csv_ensemble_stats = datetime.now().strftime("forecast_ensemble_stats_%Y-%m-%d.csv")
+    if stream_ensembles:
+        log.info("Launching geoglows.data.forecast_ensembles.", extra={"dataset": "forecast_ensembles"})
+        ensembles_iter = iter_forecast_ensembles(river_ids, river_dict, ensemble_batch_size,
+                                                 river_column=river_column)
+    else:
+        ensembles_iter = fetcher.iter_shards(ensemble_shards)
+    log.info("Writing geoglows.data.forecast_ensembles file(s) in batches of rivers.",
+             extra={"dataset": "forecast_ensembles"})
+    csv_forecast_ensembles = datetime.now().strftime("forecast_ensembles_%Y-%m-%d.csv")
+    with ExitStack() as sinks:
+        sink = (sinks.enter_context(open_sink(output_format, "forecast_ensembles", csv_forecast_ensembles))
+                if ensemble_members else None)
+        stats_sink = (sinks.enter_context(open_sink(output_format, "forecast_ensemble_stats", csv_ensemble_stats))
+                      if write_stats else None)
+        for df_forecast_ensembles in ensembles_iter:
+            with METRICS.stage("write", dataset="forecast_ensembles"):
+                if stats_sink:
+                    stats_sink.write(reduce_ensembles(df_forecast_ensembles, ensemble_reductions, thresholds))
+                if sink:
+                    sink.write(df_forecast_ensembles.drop(columns=river_column) if river_column
+                               else df_forecast_ensembles)
+    fetcher.shutdown()
+    log.info("Finished geoglows.data.forecast_ensembles.",
+             extra={"dataset": "forecast_ensembles", "failed": fetcher.failed.get("forecast_ensembles"),
+                    "stage_seconds": METRICS.stage_seconds()})
+if metrics_file:
+    METRICS.write_prometheus(metrics_file)
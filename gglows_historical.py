@@ -1,7 +1,11 @@
 import geoglows
 from utils import gglow_csv
+from sinks import open_sink
+from retrospective_store import RetrospectiveStore
+from gglows_fetcher import GeoglowsFetcher
+from instrumentation import METRICS, close_log, open_log
+from contextlib import ExitStack
 from datetime import datetime
-import sys
 
 # ----------------------------------------------------------------------------------------------------------------------
 # geoglows.data module
@@ -20,27 +24,61 @@ river_ids = [220252711, 220249952, 220212799]
 meteo_stations = ["Uvac", "Kokin Brod", "Bistrica"]
 # Create river dictionary
 river_dict = dict(zip(river_ids, meteo_stations))
+output_format = "csv"  # format of the output (possible values: csv, parquet, arrow)
+incremental = True  # keep a local store of retrospective data and download only time steps newer than the stored ones
+batch_size = 10  # number of rivers per geoglows request if not incremental, all batches are requested at the same time
+max_workers = 4  # maximum number of geoglows requests in flight
+retries = 3  # retries of a failed batch, rivers of a batch that keeps failing are retried one by one
+metrics_file = None  # Prometheus text file with per-stage timing (e.g. "metrics/gglows_historical.prom")
 
-# Create log file based on today's date and redirect print statements to it
+# Create JSON log file based on today's date
 today_date = datetime.now().strftime('gglows_historical_%Y-%m-%d')
-log_filename = f'{today_date}.txt'
-f = open(log_filename, 'w', encoding='utf-8')
-sys.stdout = f
+log_filename = f'{today_date}.jsonl'
 
-# retrospective
-print("\n\nLaunching geoglows.data.retrospective.")
-df_retrospective = geoglows.data.retrospective(river_id=river_ids)
-df_retrospective = gglow_csv(df_retrospective, river_dict, "historical")
-print("\nWriting geoglows.data.retrospectives csv file.")
-csv_retrospective = "retrospective.csv"
-df_retrospective.to_csv(csv_retrospective, mode='w', index=False, encoding='utf-8-sig')
-print("\nFinished geoglows.data.retrospectives.")
+# The log and the fetcher are closed (and flushed) even if a request or a write fails
+with ExitStack() as stack:
+    log = open_log(log_filename, "weather_api.gglows_historical")
+    stack.callback(close_log, log)
+    fetcher = stack.enter_context(GeoglowsFetcher(max_workers, batch_size, retries, log=log))
+    try:
+        # retrospective
+        log.info("Launching geoglows.data.retrospective.", extra={"dataset": "retrospective", "rivers": len(river_ids)})
+        if incremental:
+            store = RetrospectiveStore()
+            added = store.update(river_ids, fetcher.retrospective)
+            log.info("New time steps per river id.", extra={"dataset": "retrospective", "added": added})
+            df_retrospective_raw = store.read(river_ids)
+            df_retrospective = gglow_csv(df_retrospective_raw, river_dict, "historical")
+        else:
+            # Retrospective data and daily averages of all batches of rivers are requested at the same time
+            retrospective_shards = fetcher.submit("retrospective", river_ids, river_dict)
+            daily_average_shards = fetcher.submit("daily_averages", river_ids, river_dict)
+            df_retrospective = fetcher.merge(retrospective_shards)
+        log.info("Writing geoglows.data.retrospectives file.", extra={"dataset": "retrospective"})
+        csv_retrospective = "retrospective.csv"
+        with METRICS.stage("write", dataset="retrospective"), \
+                open_sink(output_format, "retrospective", csv_retrospective) as sink:
+            sink.write(df_retrospective)
+        log.info("Finished geoglows.data.retrospectives.", extra={"dataset": "retrospective"})
 
-# daily_averages
-print("\n\nLaunching geoglows.data.daily_averages.")
-df_daily_averages = geoglows.data.daily_averages(river_id=river_ids)
-df_daily_averages = gglow_csv(df_daily_averages, river_dict, "historical")
-print("\nWriting geoglows.data.daily_averages csv file.")
-csv_daily_averages = datetime.now().strftime("daily_averages_%Y-%m-%d.csv")
-df_daily_averages.to_csv(csv_daily_averages, mode='w', index=False, encoding='utf-8-sig')
-print("\nFinished geoglows.data.daily_averages.")
+        # daily_averages
+        log.info("Launching geoglows.data.daily_averages.", extra={"dataset": "daily_averages"})
+        if incremental:
+            # Calculated from the stored retrospective data instead of downloading it again
+            df_daily_averages = gglow_csv(geoglows.analyze.daily_averages(df_retrospective_raw), river_dict,
+                                          "historical")
+        else:
+            df_daily_averages = fetcher.merge(daily_average_shards)
+        log.info("Writing geoglows.data.daily_averages file.", extra={"dataset": "daily_averages"})
+        csv_daily_averages = datetime.now().strftime("daily_averages_%Y-%m-%d.csv")
+        with METRICS.stage("write", dataset="daily_averages"), \
+                open_sink(output_format, "daily_averages", csv_daily_averages) as sink:
+            sink.write(df_daily_averages)
+        log.info("Finished geoglows.data.daily_averages.",
+                 extra={"dataset": "daily_averages", "failed": fetcher.failed,
+                        "stage_seconds": METRICS.stage_seconds()})
+    except Exception:
+        log.exception("gglows_historical failed", extra={"failed": fetcher.failed})
+        raise
+if metrics_file:
+    METRICS.write_prometheus(metrics_file)
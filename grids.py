@@ -0,0 +1,106 @@
+import numpy as np
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Grid registry
+# Open-meteo returns the value of the grid cell a coordinate falls into, so the neighbours of a station have to be
+# picked on the real grid of the model. Requesting 0.25° corners from a finer grid interpolates from cells that do
+# not surround the station, and from a coarser grid returns the same cell several times.
+# ----------------------------------------------------------------------------------------------------------------------
+
+class RegularGrid:
+    """
+    Regular latitude/longitude grid
+
+    Args:
+        name: name of the grid
+        spacing: grid spacing in degrees (latitude, longitude)
+        bounds: (min latitude, max latitude, min longitude, max longitude) of the domain, global if None
+        origin: (latitude, longitude) of a grid point
+    """
+
+    def __init__(self, name, spacing, bounds=None, origin=(0.0, 0.0)):
+        self.name = name
+        self.spacing = spacing
+        self.bounds = bounds
+        self.origin = origin
+
+    @property
+    def key(self):
+        return f"{self.name}:regular:{self.spacing}:{self.bounds}:{self.origin}"
+
+    def contains(self, latitude, longitude):
+        if self.bounds is None:
+            return True
+        return self.bounds[0] <= latitude <= self.bounds[1] and self.bounds[2] <= longitude <= self.bounds[3]
+
+    def cell(self, latitude, longitude):
+        """
+        Get the grid cell surrounding a point
+
+        Args:
+            latitude, longitude: coordinates of the point
+
+        Returns:
+             corners: four (latitude, longitude) grid points ordered (lat0, lon0), (lat1, lon1), (lat0, lon1),
+                      (lat1, lon0), corners collapse when the point lies on a grid line
+             position: (tx, ty) relative position of the point inside the cell along longitude and latitude
+        """
+        row = (latitude - self.origin[0]) / self.spacing[0]
+        col = (longitude - self.origin[1]) / self.spacing[1]
+        # Round away floating point noise so points on grid lines are not moved to the next cell
+        row, col = round(row, 9), round(col, 9)
+        lat0, lat1 = (round(float(self.origin[0] + r * self.spacing[0]), 6) for r in (np.floor(row), np.ceil(row)))
+        lon0, lon1 = (round(float(self.origin[1] + c * self.spacing[1]), 6) for c in (np.floor(col), np.ceil(col)))
+        corners = [(lat0, lon0), (lat1, lon1), (lat0, lon1), (lat1, lon0)]
+        return corners, (float(col - np.floor(col)), float(row - np.floor(row)))
+
+
+class ModelGrid:
+    """
+    Grids of a model in order of priority, e.g. a regional high resolution model nested in a global model
+
+    Args:
+        name: name of the model
+        grids: list of grids, the first grid containing a point is used
+    """
+
+    def __init__(self, name, grids):
+        self.name = name
+        self.grids = grids
+
+    @property
+    def key(self):
+        return f"{self.name}[" + ",".join(grid.key for grid in self.grids) + "]"
+
+    def contains(self, latitude, longitude):
+        return any(grid.contains(latitude, longitude) for grid in self.grids)
+
+    def cell(self, latitude, longitude):
+        """Get the grid cell surrounding a point on the first grid containing it, see RegularGrid.cell"""
+        for grid in self.grids:
+            if grid.contains(latitude, longitude):
+                return grid.cell(latitude, longitude)
+        raise ValueError(f"Point {latitude}°N {longitude}°E is outside of the {self.name} grids")
+
+
+# Global 0.25° grid, used for endpoints not in the registry
+GLOBAL_025 = RegularGrid("global_025", (0.25, 0.25))
+
+# Grids of the open-meteo models
+ECMWF_IFS025 = RegularGrid("ecmwf_ifs025", (0.25, 0.25))
+GFS_025 = RegularGrid("gfs025", (0.25, 0.25))
+ERA5 = RegularGrid("era5", (0.25, 0.25))
+
+# Grid registry of the open-meteo endpoints
+GRIDS = {
+    "weather": ModelGrid("best_match", [GLOBAL_025]),  # seamless model, regional models only for the first days
+    "gfs": ModelGrid("gfs_seamless", [GFS_025]),  # HRRR over the United States for the first hours, GFS after that
+    "ecmwf": ModelGrid("ecmwf_ifs025", [ECMWF_IFS025]),
+    "archive": ModelGrid("era5", [ERA5]),  # Historical Weather API (reanalysis)
+}
+
+
+def model_grid(model):
+    """Grid of a model from the registry, the global 0.25° grid for unknown models"""
+    return GRIDS.get(model, ModelGrid(GLOBAL_025.name, [GLOBAL_025]))
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Structured logging and metrics
+# Log records are written as one JSON object per line with the extra fields of the record (station, model, stage,
+# seconds, ...), through the thread-safe logging module instead of redirecting sys.stdout.
+# Metrics collects per-stage wall time (fetch, decode, interpolate, write and geoglows calls), request counts,
+# downloaded bytes and cache hit rates per model, and writes them in the Prometheus text format, e.g.
+#   weather_api_stage_seconds_total{model="v1_gfs",stage="fetch"} 1.52
+#   weather_api_http_bytes_total{model="v1_gfs"} 48211
+# ----------------------------------------------------------------------------------------------------------------------
+
+LOGGER_NAME = "weather_api"
+METRICS_PREFIX = "weather_api"
+
+# Attributes of every log record, everything else was passed through extra
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects"""
+
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        data.update({k: v for k, v in vars(record).items() if k not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def open_log(filename, name=LOGGER_NAME, level=logging.INFO):
+    """
+    Logger writing JSON lines to a file (the file is overwritten)
+
+    Args:
+        filename: log file
+        name: name of the logger, child loggers of weather_api also propagate to handlers of the application
+        level: logging level
+
+    Returns:
+        logging.Logger, close it with close_log
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    handler = logging.FileHandler(filename, mode='w', encoding='utf-8')
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    return logger
+
+
+def close_log(logger):
+    """Close and remove the file handlers of a logger opened with open_log"""
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.FileHandler):
+            logger.removeHandler(handler)
+            handler.close()
+
+
+def model_label(url):
+    """Metrics label of the model of an url (path of the endpoint, e.g. v1_gfs)"""
+    return urlparse(url).path.strip('/').replace('/', '_') or 'default'
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters, gauges and stage timers with labels
+
+    Attributes:
+        counters: dict relating (name, labels) and summed values
+        gauges: dict relating (name, labels) and last values
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def add(self, name, value=1, **labels):
+        """Add value to a counter"""
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge"""
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    @contextmanager
+    def stage(self, stage, **labels):
+        """Measure the wall time of a stage (stage_seconds_total and stage_calls_total counters)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add("stage_seconds_total", time.perf_counter() - start, stage=stage, **labels)
+            self.add("stage_calls_total", 1, stage=stage, **labels)
+
+    def stage_seconds(self, since=None, **labels):
+        """
+        Wall time of every stage matching the labels
+
+        Counters are cumulative over the process, pass the result of a call at the start of a run as since to get the
+        wall time of that run only (e.g. for the run-finished log record of a resident process)
+
+        Args:
+            since: earlier result of stage_seconds with the same labels, subtracted from the totals if given
+            labels: labels the stages must match
+
+        Returns:
+            Dict relating stages and seconds
+        """
+        seconds = {}
+        with self._lock:
+            for (name, key_labels), value in self.counters.items():
+                key_labels = dict(key_labels)
+                if name == "stage_seconds_total" and all(key_labels.get(k) == str(v) for k, v in labels.items()):
+                    seconds[key_labels["stage"]] = seconds.get(key_labels["stage"], 0.0) + value
+        if since:
+            seconds = {stage: value - since.get(stage, 0.0) for stage, value in seconds.items()
+                       if value > since.get(stage, 0.0)}
+        return seconds
+
+    def cache_stats(self, source, **labels):
+        """Set gauges from the stats of a cache (hits, misses, hit_rate, ...)"""
+        for name, value in source.stats().items():
+            self.set(f"cache_{name}", value, **labels)
+
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for kind, values in (("counter", self.counters), ("gauge", self.gauges)):
+                names = sorted({name for name, _ in values})
+                for name in names:
+                    lines.append(f"# TYPE {METRICS_PREFIX}_{name} {kind}")
+                    for (key_name, labels), value in sorted(values.items()):
+                        if key_name == name:
+                            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                            lines.append(f"{METRICS_PREFIX}_{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the metrics to a Prometheus text file (e.g. for the node exporter textfile collector)"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + f".{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+
+# Metrics of the process
+METRICS = Metrics()
+
+
+def track_session(session, metrics=METRICS):
+    """Count HTTP requests and downloaded bytes of a requests session per model"""
+
+    def hook(response, *args, **kwargs):
+        model = model_label(response.url)
+        metrics.add("http_requests_total", 1, model=model, status=response.status_code)
+        metrics.add("http_bytes_total", len(response.content or b""), model=model)
+
+    session.hooks["response"].append(hook)
+    return session
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Grid point value cache
+# Decoded values of every grid point are kept as memory-mappable .npy files, one per model run, request, grid point
+# and variable (of the hourly, daily or minutely_15 section of the response):
+#   .point_cache/<model>/<run>/<request hash>/<latitude>_<longitude>/<section>.<variable>.npy
+# Stations sharing grid points, overlapping station lists of other scripts and other variable lists take the values
+# straight from the cache, without an API call and without decoding flatbuffers. Runs older than the latest run of a
+# model are removed, and arrays kept in memory are evicted least recently used first beyond max_memory.
+# ----------------------------------------------------------------------------------------------------------------------
+
+POINT_CACHE_DIR = ".point_cache"
+
+
+def request_key(params):
+    """
+    Hash of the request parameters that change the values of a grid point (all but coordinates and variables)
+
+    past_days and forecast_days are counted from the current date, so the date is part of the key.
+    """
+    base = {k: v for k, v in params.items()
+            if k not in ("latitude", "longitude", "hourly", "daily", "minutely_15", "format")}
+    base["date"] = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    return hashlib.sha1(json.dumps(base, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+class PointCache:
+    """
+    Decoded values of grid points, shared by all stations and models
+
+    Args:
+        directory: cache directory, values are kept only in memory if None
+        max_memory: maximum size of the arrays kept in memory in bytes (memory-mapped arrays count with their size)
+    """
+
+    def __init__(self, directory=POINT_CACHE_DIR, max_memory=256 * 2 ** 20):
+        self.directory = directory
+        self.max_memory = max_memory
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._values = OrderedDict()
+        self._memory_bytes = 0
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def _path(self, model, run, request, latitude, longitude, name):
+        return os.path.join(self.directory or "", model, run, request, f"{latitude}_{longitude}", name + ".npy")
+
+    def _load(self, key, path):
+        """Array of a key from memory or from a memory-mapped file, None if not cached"""
+        array = self._values.get(key)
+        if array is not None:
+            self._values.move_to_end(key)
+        elif self.directory and os.path.exists(path):
+            array = np.load(path, mmap_mode='r')
+            self._remember(key, array)
+        return array
+
+    def _remember(self, key, array):
+        """Keep an array in memory, evicting the least recently used arrays beyond max_memory"""
+        if key in self._values:
+            self._memory_bytes -= self._values.pop(key).nbytes
+        self._values[key] = array
+        self._memory_bytes += array.nbytes
+        while self._memory_bytes > self.max_memory and len(self._values) > 1:
+            self._memory_bytes -= self._values.popitem(last=False)[1].nbytes
+            self.evictions += 1
+
+    def _save(self, key, path, array):
+        self._remember(key, array)
+        if self.directory:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never map a partial file
+            tmp_path = path + f".{threading.get_ident()}.tmp.npy"
+            np.save(tmp_path, array)
+            os.replace(tmp_path, path)
+
+    def _drop_older_runs(self, model, run):
+        if self._runs.get(model, "") >= run:
+            return
+        self._runs[model] = run
+        for key in [k for k in self._values if k[0] == model and k[1] < run]:
+            self._memory_bytes -= self._values.pop(key).nbytes
+        model_dir = os.path.join(self.directory, model) if self.directory else None
+        if model_dir and os.path.isdir(model_dir):
+            for name in os.listdir(model_dir):
+                if name < run:
+                    shutil.rmtree(os.path.join(model_dir, name), ignore_errors=True)
+
+    def get(self, model, run, request, latitude, longitude, variables, section="hourly"):
+        """
+        Get the cached values of a grid point
+
+        Args:
+            model: model name (e.g. v1_gfs)
+            run: model run as %Y%m%d%H
+            request: hash of the request parameters (see request_key)
+            latitude, longitude: requested coordinates of the grid point
+            variables: list of variables
+            section: section of the response the variables belong to (hourly, daily or minutely_15)
+
+        Returns:
+            (meta, values) with meta an array (time, time end, interval, resolved latitude, resolved longitude) and
+            values an array (variables x time), None if any of the variables is not cached
+        """
+        point = (model, run, request, float(latitude), float(longitude))
+        with self._lock:
+            self._drop_older_runs(model, run)
+            meta = self._load(point + (section,), self._path(*point, name=f"{section}._meta"))
+            values = None
+            if meta is not None:
+                values = [self._load(point + (section, v), self._path(*point, name=f"{section}.{v}"))
+                          for v in variables]
+            if values is None or any(v is None for v in values):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return meta, np.array(values)
+
+    def put(self, model, run, request, latitude, longitude, variables, meta, values, section="hourly"):
+        """Cache the values (variables x time) of a grid point, see get"""
+        point = (model, run, request, float(latitude), float(longitude))
+        with self._lock:
+            self._drop_older_runs(model, run)
+            if run < self._runs[model]:
+                return
+            self._save(point + (section,), self._path(*point, name=f"{section}._meta"),
+                       np.asarray(meta, dtype=np.float64))
+            for variable, array in zip(variables, values):
+                self._save(point + (section, variable), self._path(*point, name=f"{section}.{variable}"),
+                           np.asarray(array))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions, "memory_bytes": self._memory_bytes}
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Forecast-run-aware response cache
+# Responses are cached per model and grid point (one flatbuffer message per location), keyed by the request
+# parameters and the latest model run. When the model publishes a new run, the key changes and older runs are
+# dropped, instead of expiring after a fixed TTL. Every model has its own in-memory LRU store and its own cache
+# directory, so concurrent runs never share a database lock.
+# ----------------------------------------------------------------------------------------------------------------------
+
+CACHE_DIR = ".run_cache"
+
+
+class ModelSchedule:
+    """
+    Publish schedule of a model
+
+    Args:
+        interval: hours between model runs
+        delay: hours after the run time until the run is available through the API
+
+    Attributes:
+        observed: run time of the latest run published upstream (see observe), None if not known
+    """
+
+    def __init__(self, interval=1, delay=0):
+        self.interval = interval
+        self.delay = delay
+        self.observed = None
+
+    def latest_run(self, now=None):
+        """Run time (UTC) of the latest available model run, the observed run if known"""
+        if self.observed is not None:
+            return self.observed
+        if now is None:
+            now = datetime.now(timezone.utc)
+        available = now - timedelta(hours=self.delay)
+        hour = available.hour - available.hour % self.interval if self.interval < 24 else 0
+        return available.replace(hour=hour, minute=0, second=0, microsecond=0)
+
+    def observe(self, run):
+        """
+        Record the latest run published upstream (e.g. in the model metadata), used as latest run instead of the run
+        expected from the schedule, so caches keyed on the run switch exactly when upstream does
+
+        Args:
+            run: run time (UTC) of the published run, None to go back to the schedule
+        """
+        self.observed = run
+
+
+class ModelStore:
+    """
+    LRU store of flatbuffer messages of one model, in memory and on disk
+
+    Args:
+        directory: cache directory of the model, messages are kept only in memory if None
+        schedule: ModelSchedule of the model
+        max_memory: maximum size of the in-memory store in bytes
+        max_disk: maximum size of the cache directory in bytes
+    """
+
+    def __init__(self, directory, schedule, max_memory=256 * 2 ** 20, max_disk=2 ** 30):
+        self.directory = directory
+        self.schedule = schedule
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._run = None
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".fb")
+
+    def _drop_older_runs(self, run):
+        """Drop messages of runs older than run"""
+        if self._run is not None and run <= self._run:
+            return
+        self._run = run
+        prefix = run.strftime('%Y%m%d%H')
+        for key in [k for k in self._memory if k[:10] < prefix]:
+            self._memory_bytes -= len(self._memory.pop(key))
+        if self.directory:
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name[:10] < prefix:
+                    self._disk_bytes -= entry.stat().st_size
+                    os.remove(entry.path)
+
+    def _evict(self):
+        while self._memory_bytes > self.max_memory and self._memory:
+            self._memory_bytes -= len(self._memory.popitem(last=False)[1])
+            self.evictions += 1
+        if self.directory and self._disk_bytes > self.max_disk:
+            # Least recently used files first (reads update the modification time)
+            entries = sorted((e for e in os.scandir(self.directory) if e.is_file()), key=lambda e: e.stat().st_mtime)
+            for entry in entries:
+                if self._disk_bytes <= self.max_disk:
+                    break
+                self._disk_bytes -= entry.stat().st_size
+                os.remove(entry.path)
+                self.evictions += 1
+
+    def get(self, key, run):
+        with self._lock:
+            self._drop_older_runs(run)
+            message = self._memory.get(key)
+            if message is not None:
+                self._memory.move_to_end(key)
+            elif self.directory and os.path.exists(self._path(key)):
+                with open(self._path(key), 'rb') as f:
+                    message = f.read()
+                os.utime(self._path(key))
+                self._memory[key] = message
+                self._memory_bytes += len(message)
+                self._evict()
+            if message is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return message
+
+    def put(self, key, message, run):
+        with self._lock:
+            self._drop_older_runs(run)
+            if key not in self._memory:
+                self._memory[key] = message
+                self._memory_bytes += len(message)
+            if self.directory and not os.path.exists(self._path(key)):
+                tmp_path = self._path(key) + f".{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(message)
+                os.replace(tmp_path, self._path(key))
+                self._disk_bytes += len(message)
+            self._evict()
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions, "memory_bytes": self._memory_bytes, "disk_bytes": self._disk_bytes}
+
+
+def fetch_messages(session, url, params):
+    """
+    Request open-meteo flatbuffers and split the response into one message per location
+
+    Args:
+        session: requests session used for the API call
+        url: open-meteo API endpoint
+        params: request parameters
+
+    Returns:
+        List of flatbuffer messages (bytes)
+    """
+    response = session.get(url, params=dict(params, format="flatbuffers"))
+    if response.status_code in (400, 429):
+        raise RuntimeError(f"open-meteo error: {response.json()}")
+    response.raise_for_status()
+
+    data = response.content
+    messages = []
+    pos = 0
+    while pos < len(data):
+        length = int.from_bytes(data[pos:pos + 4], byteorder="little")
+        messages.append(data[pos + 4:pos + 4 + length])
+        pos += length + 4
+    return messages
+
+
+class RunCache:
+    """
+    Response cache with one ModelStore per model
+
+    Args:
+        session: requests session used for the API calls
+        schedules: dict relating url paths of the models (e.g. /v1/gfs) and their ModelSchedule, unknown models are
+                   cached per hour
+        directory: cache directory, one subdirectory per model, in-memory only if None
+        max_memory: maximum size of the in-memory store of every model in bytes
+        max_disk: maximum size of the cache directory of every model in bytes
+    """
+
+    def __init__(self, session, schedules=None, directory=CACHE_DIR, max_memory=256 * 2 ** 20, max_disk=2 ** 30):
+        self.session = session
+        self.schedules = schedules or {}
+        self.directory = directory
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def store(self, url):
+        """ModelStore of the model of an url"""
+        path = urlparse(url).path
+        with self._lock:
+            if path not in self._stores:
+                name = path.strip('/').replace('/', '_') or 'default'
+                directory = os.path.join(self.directory, name) if self.directory else None
+                self._stores[path] = ModelStore(directory, self.schedules.get(path, ModelSchedule()),
+                                                self.max_memory, self.max_disk)
+            return self._stores[path]
+
+    def weather_api(self, url, params):
+        """
+        Same as openmeteo_requests.Client.weather_api, requesting only grid points missing from the cache
+
+        Args:
+            url: open-meteo API endpoint
+            params: request parameters with lists of latitudes and longitudes
+
+        Returns:
+            List of WeatherApiResponse in the order of the coordinates
+        """
+        store = self.store(url)
+        run = store.schedule.latest_run()
+        latitude, longitude = list(params["latitude"]), list(params["longitude"])
+        base = {k: v for k, v in params.items() if k not in ("latitude", "longitude", "format")}
+        # past_days and forecast_days are counted from the current date
+        base_key = json.dumps(dict(base, date=datetime.now(timezone.utc).strftime('%Y-%m-%d')), sort_keys=True,
+                              default=str)
+        keys = [run.strftime('%Y%m%d%H') + "_" +
+                hashlib.sha1(f"{base_key}|{lat}|{lon}".encode('utf-8')).hexdigest()
+                for lat, lon in zip(latitude, longitude)]
+
+        messages = [store.get(key, run) for key in keys]
+        missing = [i for i, message in enumerate(messages) if message is None]
+        if missing:
+            fetched = fetch_messages(self.session, url, dict(base, latitude=[latitude[i] for i in missing],
+                                                        longitude=[longitude[i] for i in missing]))
+            for i, message in zip(missing, fetched):
+                store.put(keys[i], message, run)
+                messages[i] = message
+        return [WeatherApiResponse.GetRootAs(message, 0) for message in messages]
+
+    def stats(self):
+        """Hit/miss counters of every model"""
+        with self._lock:
+            return {path: store.stats() for path, store in self._stores.items()}
@@ -0,0 +1,132 @@
+import json
+import os
+
+import geoglows
+import pandas as pd
+
+from instrumentation import METRICS
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Incremental geoglows retrospective store
+# The retrospective simulation holds decades of daily discharge per river and only grows at the end. The store keeps
+# one parquet file per river ID and a manifest with the last timestamp of every river. An update opens the
+# retrospective zarr lazily (geoglows format='xarray') and downloads only the time steps after the last stored one of
+# every river; full history is downloaded only for new river IDs. The download can be passed in as a fetch function
+# (e.g. GeoglowsFetcher.retrospective, which requests shards of rivers with retries and leaves out failing rivers).
+# ----------------------------------------------------------------------------------------------------------------------
+
+STORE_DIR = "retrospective_store"
+
+
+def retrospective_since(river_id, start=None):
+    """
+    Download retrospective discharge of rivers after a timestamp
+
+    Args:
+        river_id: list of river IDs (LINKNO)
+        start: only time steps after this timestamp are downloaded, full history if None
+
+    Returns:
+        Dataframe with a time index and one column per river ID
+    """
+    selection = geoglows.data.retrospective(river_id=list(river_id), format='xarray')['Qout']
+    if start is not None:
+        selection = selection.sel(time=slice(start + pd.Timedelta(seconds=1), None))
+    return selection.to_dataframe().reset_index().pivot(index='time', columns='rivid', values='Qout')
+
+
+class RetrospectiveStore:
+    """
+    Local columnar store of geoglows retrospective discharge
+
+    Args:
+        root: directory of the store
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self._manifest_path = os.path.join(root, "manifest.json")
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, encoding='utf-8') as f:
+                self.manifest = {int(k): pd.Timestamp(v) for k, v in json.load(f).items()}
+        else:
+            self.manifest = {}
+
+    def path(self, river_id):
+        return os.path.join(self.root, f"river_id={river_id}.parquet")
+
+    def last_time(self, river_id):
+        """Last stored timestamp of a river, None for new river IDs"""
+        return self.manifest.get(int(river_id))
+
+    def _save_manifest(self):
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({str(k): v.isoformat() for k, v in self.manifest.items()}, f, indent=1)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _append(self, river_id, series):
+        """Append discharge (series with a time index) of a river to its parquet file"""
+        series = series.dropna()
+        if series.empty:
+            return 0
+        new = series.rename('Qout').rename_axis('time').reset_index()
+        path = self.path(river_id)
+        if os.path.exists(path):
+            new = pd.concat([pd.read_parquet(path), new], ignore_index=True)
+        # Write to a temporary file first so an interrupted update never leaves a broken file
+        new.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+        self.manifest[int(river_id)] = pd.Timestamp(new['time'].iloc[-1])
+        return len(series)
+
+    def update(self, river_ids, fetch=None):
+        """
+        Download retrospective data newer than the stored data
+
+        Every river is downloaded from its own last stored timestamp, rivers with the same last timestamp (usually all
+        rivers updated together) share one download. New river IDs get their full history.
+
+        Args:
+            river_ids: list of river IDs (LINKNO)
+            fetch: function (river_ids, start) returning the time steps after start (all if None) in the format of
+                retrospective_since, rivers it leaves out are not updated; retrospective_since if None
+
+        Returns:
+            Dict with the number of new time steps of every river
+        """
+        river_ids = [int(r) for r in river_ids]
+        starts = {}
+        for river_id in river_ids:
+            starts.setdefault(self.last_time(river_id), []).append(river_id)
+        added = {}
+        for start, rivers in starts.items():
+            if fetch is None:
+                with METRICS.stage("geoglows", dataset="retrospective"):
+                    df = retrospective_since(rivers, start)
+            else:
+                df = fetch(rivers, start)
+            for river_id in rivers:
+                added[river_id] = self._append(river_id, df[river_id]) if river_id in df.columns else 0
+
+        self._save_manifest()
+        return added
+
+    def read(self, river_ids):
+        """
+        Read stored data in the format of geoglows.data.retrospective
+
+        Args:
+            river_ids: list of river IDs (LINKNO), rivers without stored data (e.g. no data downloaded yet) are left out
+
+        Returns:
+            Dataframe with a time index and one column per stored river ID, empty if no river is stored
+        """
+        series = {int(r): pd.read_parquet(self.path(r)).set_index('time')['Qout']
+                  for r in river_ids if os.path.exists(self.path(r))}
+        df = pd.DataFrame(series).sort_index(axis=1) if series else pd.DataFrame(index=pd.DatetimeIndex([]))
+        df.index.name = 'time'
+        df.columns.name = 'rivid'
+        return df
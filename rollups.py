@@ -0,0 +1,134 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Ingest-time rollups
+# Aggregates of the interpolated hourly values are computed while the stations are ingested, as vectorized reductions
+# over the (stations x time) arrays, so downstream jobs never have to read the hourly csv files back and resample.
+# A rollup is given as "<hourly variable>:<rollup>", e.g.
+#   precipitation:daily_sum      daily precipitation total
+#   temperature_2m:daily_min     daily minimum temperature (also daily_max, daily_mean)
+#   precipitation:rolling_sum_24h  precipitation of the past 24 hours (any number of hours, also rolling_mean_<N>h)
+# Daily rollups are written with the native open-meteo daily variables, rolling rollups as hourly columns.
+# Days are UTC days, the time zone of the open-meteo responses.
+# ----------------------------------------------------------------------------------------------------------------------
+
+DAILY_ROLLUPS = {
+    "daily_sum": np.add,
+    "daily_min": np.fmin,
+    "daily_max": np.fmax,
+    "daily_mean": np.add,
+}
+ROLLING_ROLLUP = re.compile(r"rolling_(sum|mean)_(\d+)h$")
+
+
+def parse_rollup(rollup):
+    """
+    Split a rollup into variable and rollup name
+
+    Args:
+        rollup: "<hourly variable>:<rollup>"
+
+    Returns:
+        (variable, rollup name)
+    """
+    variable, _, name = rollup.partition(":")
+    if not variable or not (name in DAILY_ROLLUPS or ROLLING_ROLLUP.match(name)):
+        raise ValueError(f"Invalid rollup {rollup}, expected <variable>:<daily_sum|daily_min|daily_max|daily_mean|"
+                         f"rolling_sum_<N>h|rolling_mean_<N>h>")
+    return variable, name
+
+
+def daily_groups(date_time):
+    """
+    Start positions of the days of a date-time index
+
+    Returns:
+        (days, starts) with the dates of the days and the position of their first time step
+    """
+    days = date_time.floor('D')
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    return days[starts], starts
+
+
+def daily_reduce(values, starts, name):
+    """
+    Reduce values (stations x time) to days starting at positions starts, NaN values are skipped
+
+    Args:
+        values: array (stations x time)
+        starts: positions of the first time step of every day
+        name: daily rollup from DAILY_ROLLUPS
+
+    Returns:
+        Array (stations x days)
+    """
+    valid = ~np.isnan(values)
+    counts = np.add.reduceat(valid, starts, axis=-1)
+    if name in ("daily_sum", "daily_mean"):
+        result = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=-1)
+        if name == "daily_mean":
+            result = result / np.maximum(counts, 1)
+    else:
+        result = DAILY_ROLLUPS[name].reduceat(values, starts, axis=-1)
+    return np.where(counts > 0, result, np.nan)
+
+
+def rolling_reduce(values, window, name):
+    """
+    Rolling sum/mean over the past window time steps (including the current one), NaN until the window is full
+
+    Args:
+        values: array (stations x time)
+        window: number of time steps
+        name: sum or mean
+
+    Returns:
+        Array (stations x time)
+    """
+    valid = ~np.isnan(values)
+    total = np.cumsum(np.where(valid, values, 0.0), axis=-1)
+    count = np.cumsum(valid, axis=-1)
+    total[..., window:] = total[..., window:] - total[..., :-window]
+    count[..., window:] = count[..., window:] - count[..., :-window]
+    result = total / np.maximum(count, 1) if name == "mean" else total
+    result = np.where(count > 0, result, np.nan)
+    result[..., :window - 1] = np.nan
+    return result
+
+
+def compute_rollups(rollups, variables, interpolated, date_time, column_names=None):
+    """
+    Compute rollups of interpolated hourly values
+
+    Args:
+        rollups: list of "<hourly variable>:<rollup>"
+        variables: hourly variables of interpolated
+        interpolated: array (stations x variables x time) of interpolated hourly values
+        date_time: date-time index of the hourly values
+        column_names: dict relating variables and names of their output columns
+
+    Returns:
+        (hourly, days, daily): dicts relating output column names and arrays (stations x time) of rolling and
+        (stations x days) of daily rollups, and the dates of the days
+    """
+    column_names = column_names or {}
+    days, starts = daily_groups(date_time)
+    interval = (date_time[1] - date_time[0]) if len(date_time) > 1 else pd.Timedelta(hours=1)
+    hourly, daily = {}, {}
+    for rollup in rollups:
+        variable, name = parse_rollup(rollup)
+        if variable not in variables:
+            raise ValueError(f"Rollup {rollup} needs the hourly variable {variable}")
+        values = interpolated[:, variables.index(variable)].astype(np.float64)
+        column = f"{column_names.get(variable, variable)}_{name}"
+        if name in DAILY_ROLLUPS:
+            daily[column] = np.around(daily_reduce(values, starts, name), decimals=2)
+        else:
+            kind, hours = ROLLING_ROLLUP.match(name).groups()
+            window = max(int(pd.Timedelta(hours=int(hours)) / interval), 1)
+            hourly[column] = np.around(rolling_reduce(values, window, kind), decimals=2)
+    return hourly, days, daily
@@ -0,0 +1,497 @@
+import argparse
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from engine import (BASE_URL, INDEX_DIR, MODELS, STATIONS, Fetcher, create_cache, create_session, iter_model,
+                    latest_model_run, model_url, model_variables)
+from gglows_fetcher import DATASETS, RIVERS, GeoglowsFetcher
+from grids import model_grid
+from instrumentation import LOGGER_NAME, METRICS, close_log, model_label, open_log
+from point_cache import POINT_CACHE_DIR, PointCache
+from response_cache import CACHE_DIR, ModelSchedule
+from sinks import OUTPUT_DIR, OUTPUT_FORMATS, open_sink
+from station_index import StationIndex, load_station_index
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Resident service mode
+# Keeps one process running with a warm HTTP session, response and grid point caches, and the station index of every
+# model in memory. Every poll asks upstream for the latest run before downloading anything: the init time of the last
+# run of every open-meteo model (model metadata, the publish schedule if the metadata is not available) and, once the
+# daily schedule expects a new geoglows forecast, the dates of the published forecasts. A source is fetched,
+# interpolated and written only when upstream has a run newer than the one served. A failed fetch, or a geoglows
+# forecast that is not published yet, is checked again after retry_seconds.
+# The latest data of every source is kept in memory and served by a local HTTP endpoint:
+#   GET /sources                                         sources with their run, update time and stations
+#   GET /series?source=gfs&station=Pljevlja              latest series of a station as JSON (format=csv for csv)
+#   GET /series?source=gfs&station=Pljevlja&output=daily other outputs of a model (daily, minutely_15)
+#   GET /health, GET /metrics                            status of the service, metrics in the Prometheus format
+# ----------------------------------------------------------------------------------------------------------------------
+
+# geoglows forecasts are computed once a day from the 00 UTC ECMWF run and published in the course of the day
+GEOGLOWS_SCHEDULE = ModelSchedule(24, 12)
+
+# geoglows datasets the service can poll (historical datasets are updated by gglows_historical.py)
+GEOGLOWS_DATASETS = [dataset for dataset, csv_type in DATASETS.items() if csv_type == "forecast"]
+
+
+class Service:
+    """
+    Resident process polling open-meteo models and geoglows forecasts and serving their latest data from memory
+
+    Args:
+        models: list of model names from MODELS
+        stations: list of (station name, latitude, longitude) tuples
+        variables: hourly variables, list or dict relating model names and their variables (see model_variables)
+        past_days: weather info for how many past days
+        forecast_days: weather info for how many future days
+        rivers: dict relating river IDs (LINKNO) and meteo station names
+        geoglows_datasets: geoglows datasets from GEOGLOWS_DATASETS to poll, none if empty
+        fetcher: Fetcher kept for the life of the service, a new one with an in-memory response cache is created if
+                 not given
+        point_cache: PointCache kept for the life of the service
+        geoglows_fetcher: GeoglowsFetcher kept for the life of the service, a new one is created if not given
+        base_url: open-meteo server the models are fetched from
+        index_dir: directory of the station index files, indexes are only kept in memory if None
+        output_format: csv, parquet or arrow (see sinks.py)
+        output_dir: root directory of the parquet/arrow datasets
+        write: write every new run to the output files, runs are only served from memory if False
+        retry_seconds: seconds before a failed or not yet published run is polled again
+        metrics_file: Prometheus text file written after every run, not written if None
+        log: logging.Logger of the service, the weather_api logger if None
+
+    Attributes:
+        latest: dict relating sources (model names and geoglows datasets) and their latest data, dicts with run,
+                updated and outputs (dict relating outputs and dicts relating station names and dataframes)
+    """
+
+    def __init__(self, models=None, stations=STATIONS, variables=None, past_days=2, forecast_days=7, rivers=None,
+                 geoglows_datasets=("forecast",), fetcher=None, point_cache=None, geoglows_fetcher=None,
+                 base_url=BASE_URL, index_dir=INDEX_DIR, output_format="csv", output_dir=OUTPUT_DIR, write=True,
+                 retry_seconds=900, metrics_file=None, log=None):
+        self.stations = stations
+        self.past_days = past_days
+        self.forecast_days = forecast_days
+        self.rivers = dict(RIVERS if rivers is None else rivers)
+        self.base_url = base_url
+        self.index_dir = index_dir
+        self.output_format = output_format
+        self.output_dir = output_dir
+        self.write = write
+        self.retry_seconds = retry_seconds
+        self.metrics_file = metrics_file
+        self.log = log if log is not None else logging.getLogger(LOGGER_NAME)
+        self.fetcher = fetcher if fetcher is not None else Fetcher(cache=create_cache(None))
+        self.point_cache = point_cache
+        self.geoglows_fetcher = geoglows_fetcher if geoglows_fetcher is not None else GeoglowsFetcher(log=self.log)
+        self.session = create_session(retries=2)
+        self.latest = {}
+
+        # Sources with the function returning their latest upstream run and the function fetching a run
+        self.sources = {}
+        self.variables = {}
+        self.indexes = {}
+        for model in (list(MODELS) if models is None else models):
+            self.variables[model] = model_variables(model, variables)
+            index_path = self._index_path(model)
+            grid = model_grid(model)
+            self.indexes[model] = (load_station_index(index_path, stations, grid) if index_path
+                                   else StationIndex.build(stations, grid))
+            self.sources[model] = (self.check_model, self.fetch_model)
+        for dataset in geoglows_datasets:
+            if dataset not in GEOGLOWS_DATASETS:
+                raise ValueError(f"geoglows dataset must be one of {', '.join(GEOGLOWS_DATASETS)}")
+            self.sources[dataset] = (self.check_geoglows, self.fetch_geoglows)
+
+        self._running = set()
+        self._next_poll = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=max(len(self.sources), 1))
+        self._server = None
+
+    def _index_path(self, model):
+        return os.path.join(self.index_dir, f"{model}.npz") if self.index_dir else None
+
+    def _sink(self, sinks, targets, output, name):
+        """Output sink of a run, opened on its first write"""
+        if output not in targets:
+            csv_filename = datetime.now().strftime(f"{name}_%Y-%m-%d.csv")
+            targets[output] = sinks.enter_context(open_sink(self.output_format, name, csv_filename, self.output_dir))
+        return targets[output]
+
+    def check_model(self, model, now):
+        """
+        Latest run of an open-meteo model, from the model metadata without downloading any data
+
+        Args:
+            model: model name from MODELS
+            now: current time (UTC)
+
+        Returns:
+            Init time of the latest run, the run expected from the publish schedule if the metadata is not available
+        """
+        schedule = MODELS[model]["schedule"]
+        try:
+            run = latest_model_run(model, self.base_url, self.session)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            self.log.warning("model metadata not available, using the publish schedule",
+                             extra={"source": model, "error": str(e)})
+            schedule.observe(None)
+            return schedule.latest_run(now)
+        # Response and point caches are keyed on the run of the schedule, switch them to the published run
+        schedule.observe(run)
+        return run
+
+    def fetch_model(self, model, run):
+        """
+        Fetch, interpolate and write a run of an open-meteo model
+
+        Args:
+            model: model name from MODELS
+            run: init time of the model run (not used for the request, the API serves its latest run)
+
+        Returns:
+            Dict relating outputs and dicts relating station names and dataframes
+        """
+        prefix = MODELS[model]["prefix"]
+        url = model_url(model, self.base_url)
+        label = model_label(url)
+        index = self.indexes[model]
+        outputs = {}
+        with ExitStack() as sinks:
+            targets = {}
+            stations_iter = iter_model(url, self.stations, self.variables[model], self.past_days, self.forecast_days,
+                                       self.fetcher, log=self.log, index=index, point_cache=self.point_cache)
+            for i, frames in stations_iter:
+                for output, df in frames.items():
+                    outputs.setdefault(output, {})[self.stations[i][0]] = df
+                    if self.write:
+                        name = prefix if output == "hourly" else f"{prefix}_{output}"
+                        with METRICS.stage("write", model=label):
+                            self._sink(sinks, targets, output, name).write(df)
+        if self.fetcher.cache is not None:
+            METRICS.cache_stats(self.fetcher.cache.store(url), model=label, cache="response")
+        if self.point_cache is not None:
+            METRICS.cache_stats(self.point_cache, cache="point")
+        index_path = self._index_path(model)
+        if index_path and index.dirty:
+            index.save(index_path)
+        return outputs
+
+    def check_geoglows(self, dataset, now):
+        """
+        Latest geoglows forecast, from the published forecast dates without downloading the forecast
+
+        The dates are only requested when GEOGLOWS_SCHEDULE expects a forecast newer than the one served; if it is not
+        published yet, the dates are requested again after retry_seconds.
+
+        Args:
+            dataset: dataset from GEOGLOWS_DATASETS
+            now: current time (UTC)
+
+        Returns:
+            Date (00 UTC) of the latest forecast
+        """
+        with self._lock:
+            served = self.latest.get(dataset)
+        if served is not None and GEOGLOWS_SCHEDULE.latest_run(now) <= served["run"]:
+            return served["run"]
+        dates = self.geoglows_fetcher.forecast_dates()
+        if not dates:
+            raise RuntimeError("No geoglows forecast dates published")
+        if served is not None and dates[-1] <= served["run"]:
+            self.log.info("forecast not published yet", extra={"source": dataset, "run": served["run"].isoformat()})
+            self._retry_later(dataset)
+        return dates[-1]
+
+    def fetch_geoglows(self, dataset, run):
+        """
+        Fetch and write a geoglows forecast dataset
+
+        Args:
+            dataset: dataset from GEOGLOWS_DATASETS
+            run: date of the forecast (not used for the request, geoglows serves its latest forecast)
+
+        Returns:
+            Dict relating the forecast output and a dict relating station names and dataframes
+        """
+        submitted = self.geoglows_fetcher.submit(dataset, list(self.rivers), self.rivers)
+        shards = list(self.geoglows_fetcher.iter_shards(submitted))
+        if not shards:
+            raise RuntimeError(f"No river of geoglows.data.{dataset} could be fetched")
+        stations = {}
+        with ExitStack() as sinks:
+            targets = {}
+            for df in shards:
+                if self.write:
+                    with METRICS.stage("write", dataset=dataset):
+                        self._sink(sinks, targets, "forecast", dataset).write(df)
+                for station, station_df in df.groupby("meteo-station", sort=False):
+                    stations[station] = station_df.reset_index(drop=True)
+        return {"forecast": stations}
+
+    def poll(self, now=None):
+        """
+        Start a fetch of every source whose latest upstream run is newer than the one served, sources already being
+        fetched or waiting for a retry are skipped
+
+        Args:
+            now: current time (UTC), datetime.now if None
+
+        Returns:
+            Dict relating the started sources and their futures
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+        started = {}
+        for source, (check, fetch) in self.sources.items():
+            with self._lock:
+                if source in self._running or now < self._next_poll.get(source, now):
+                    continue
+            try:
+                run = check(source, now)
+            except Exception:
+                self.log.exception("run check failed", extra={"source": source})
+                self._retry_later(source)
+                continue
+            with self._lock:
+                served = self.latest.get(source)
+                if source in self._running or (served is not None and served["run"] >= run):
+                    continue
+                self._running.add(source)
+            started[source] = self._executor.submit(self._fetch, source, run, fetch)
+        return started
+
+    def _fetch(self, source, run, fetch):
+        """Fetch a run of a source and replace its served data, returns True if a new run was stored"""
+        # Stages of the run are labelled like the stages of the fetch (model for open-meteo, dataset for geoglows)
+        labels = {"model": model_label(model_url(source, self.base_url))} if source in MODELS else {"dataset": source}
+        stage_start = METRICS.stage_seconds(**labels)
+        self.log.info("run started", extra={"source": source, "run": run.isoformat()})
+        try:
+            with METRICS.stage("service_run", **labels):
+                outputs = fetch(source, run)
+            updated = datetime.now(timezone.utc)
+            with self._lock:
+                # Readers always see all stations of the same run
+                self.latest[source] = {"run": run, "updated": updated, "outputs": outputs}
+            METRICS.set("service_run_timestamp", run.timestamp(), source=source)
+            METRICS.set("service_updated_timestamp", updated.timestamp(), source=source)
+            self.log.info("run finished", extra={"source": source, "run": run.isoformat(),
+                                                 "stations": len(outputs.get("hourly", outputs.get("forecast", {}))),
+                                                 "stage_seconds": METRICS.stage_seconds(stage_start, **labels)})
+            return True
+        except Exception:
+            METRICS.add("service_failed_runs_total", 1, source=source)
+            self.log.exception("run failed", extra={"source": source, "run": run.isoformat()})
+            self._retry_later(source)
+            return False
+        finally:
+            with self._lock:
+                self._running.discard(source)
+            if self.metrics_file:
+                METRICS.write_prometheus(self.metrics_file)
+
+    def _retry_later(self, source):
+        with self._lock:
+            self._next_poll[source] = datetime.now(timezone.utc) + timedelta(seconds=self.retry_seconds)
+
+    def series(self, source, station, output=None):
+        """
+        Latest data of a station
+
+        Args:
+            source: model name or geoglows dataset
+            station: meteo station name
+            output: hourly, daily or minutely_15 for models, forecast for geoglows, the first output if None
+
+        Returns:
+            (run time, dataframe), None if the source, output or station is not served
+        """
+        with self._lock:
+            served = self.latest.get(source)
+        if served is None:
+            return None
+        outputs = served["outputs"]
+        frames = outputs.get(output) if output else next(iter(outputs.values()), None)
+        if frames is None or station not in frames:
+            return None
+        return served["run"], frames[station]
+
+    def status(self):
+        """Served sources with their run, update time, outputs and stations"""
+        with self._lock:
+            latest = dict(self.latest)
+            running = set(self._running)
+        status = {}
+        for source in self.sources:
+            served = latest.get(source)
+            status[source] = {"run": None, "updated": None, "outputs": [], "stations": [],
+                              "fetching": source in running}
+            if served is not None:
+                outputs = served["outputs"]
+                status[source].update(run=served["run"].isoformat(), updated=served["updated"].isoformat(),
+                                      outputs=list(outputs), stations=list(next(iter(outputs.values()), {})))
+        return status
+
+    def _handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                if url.path == "/health":
+                    self._respond(200, {"status": "ok", "sources": len(service.latest)})
+                elif url.path == "/sources":
+                    self._respond(200, service.status())
+                elif url.path == "/metrics":
+                    self._respond(200, METRICS.prometheus(), "text/plain; version=0.0.4")
+                elif url.path == "/series":
+                    self._series(query)
+                else:
+                    self._respond(404, {"error": f"unknown path {url.path}"})
+
+            def _series(self, query):
+                if "source" not in query or "station" not in query:
+                    self._respond(400, {"error": "source and station are required"})
+                    return
+                result = service.series(query["source"], query["station"], query.get("output"))
+                if result is None:
+                    self._respond(404, {"error": f"no data of {query['station']} from {query['source']}"})
+                    return
+                run, df = result
+                if query.get("format") == "csv":
+                    self._respond(200, df.to_csv(index=False), "text/csv")
+                    return
+                data = json.loads(df.to_json(orient="split", index=False, date_format="iso"))
+                self._respond(200, {"source": query["source"], "station": query["station"], "run": run.isoformat(),
+                                    "columns": data["columns"], "data": data["data"]})
+
+            def _respond(self, status, body, content_type="application/json"):
+                if not isinstance(body, str):
+                    body = json.dumps(body, ensure_ascii=False)
+                body = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def serve(self, host="127.0.0.1", port=8765):
+        """Start the query endpoint in a background thread, returns the server"""
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.log.info("query endpoint started", extra={"host": host, "port": self._server.server_port})
+        return self._server
+
+    def run_forever(self, poll_seconds=60):
+        """Poll the sources every poll_seconds until stop is called"""
+        self.poll()
+        while not self._stop.wait(poll_seconds):
+            self.poll()
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self.geoglows_fetcher.shutdown()
+        self.fetcher.shutdown()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Poll open-meteo models and geoglows forecasts in a resident process "
+                                                 "and serve the latest station data.")
+    parser.add_argument("models", nargs="*", metavar="MODEL",
+                        help=f"models to poll: {', '.join(MODELS)} (default: all)")
+    parser.add_argument("--geoglows", nargs="*", default=["forecast"], metavar="DATASET",
+                        help=f"geoglows datasets to poll: {', '.join(GEOGLOWS_DATASETS)} (none if empty)")
+    parser.add_argument("--rivers", nargs="+", metavar="RIVER_ID=STATION",
+                        help="river IDs (LINKNO) and their meteo station names (default: rivers in RIVERS)")
+    parser.add_argument("--past-days", type=int, default=2, help="weather info for how many past days")
+    parser.add_argument("--forecast-days", type=int, default=7, help="weather info for how many future days")
+    parser.add_argument("--variables", nargs="+", help="hourly variables of all models (default: variables in MODELS)")
+    parser.add_argument("--host", default="127.0.0.1", help="address of the query endpoint")
+    parser.add_argument("--port", type=int, default=8765, help="port of the query endpoint")
+    parser.add_argument("--poll-seconds", type=int, default=60, help="seconds between checks of the latest runs")
+    parser.add_argument("--retry-seconds", type=int, default=900,
+                        help="seconds before a failed or not yet published run is polled again")
+    parser.add_argument("--once", action="store_true", help="fetch every source once and exit, without the endpoint")
+    parser.add_argument("--no-write", dest="write", action="store_false",
+                        help="serve new runs from memory only, without writing output files")
+    parser.add_argument("--max-workers", type=int, default=8, help="maximum number of requests in flight")
+    parser.add_argument("--max-per-host", type=int, default=4,
+                        help="maximum number of requests in flight to a single host")
+    parser.add_argument("--base-url", default=BASE_URL, help="open-meteo server (e.g. a local stub server)")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="directory of the station index files")
+    parser.add_argument("--output-format", default="csv", choices=OUTPUT_FORMATS, help="format of the output")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="root directory of the parquet/arrow datasets")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="directory of the response cache")
+    parser.add_argument("--point-cache-dir", default=POINT_CACHE_DIR, help="directory of the grid point value cache")
+    parser.add_argument("--metrics-file", help="Prometheus text file with per-stage timing, requests and cache stats")
+    args = parser.parse_args(argv)
+    unknown = [model for model in args.models if model not in MODELS]
+    if unknown:
+        parser.error(f"unknown models {', '.join(unknown)}")
+    unknown = [dataset for dataset in args.geoglows if dataset not in GEOGLOWS_DATASETS]
+    if unknown:
+        parser.error(f"unknown geoglows datasets {', '.join(unknown)}")
+    models = args.models or list(MODELS)
+    rivers = dict(RIVERS)
+    if args.rivers:
+        rivers = {}
+        for option in args.rivers:
+            river_id, _, station = option.partition("=")
+            if not river_id.isdigit() or not station:
+                parser.error(f"invalid --rivers {option}")
+            rivers[int(river_id)] = station
+
+    log = open_log("service.jsonl", f"{LOGGER_NAME}.service")
+    fetcher = Fetcher(max_workers=args.max_workers, max_per_host=args.max_per_host, cache=create_cache(args.cache_dir))
+    service = Service(models, STATIONS, args.variables, args.past_days, args.forecast_days, rivers, args.geoglows,
+                      fetcher, PointCache(args.point_cache_dir), GeoglowsFetcher(log=log), args.base_url,
+                      args.index_dir, args.output_format, args.output_dir, args.write, args.retry_seconds,
+                      args.metrics_file, log)
+    try:
+        with service:
+            if args.once:
+                for future in service.poll().values():
+                    future.result()
+                return
+            service.serve(args.host, args.port)
+            print(f"Serving the latest station data on http://{args.host}:{args.port}/sources")
+            try:
+                service.run_forever(args.poll_seconds)
+            except KeyboardInterrupt:
+                pass
+    finally:
+        close_log(log)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import os
+import shutil
+from datetime import datetime
+from urllib.parse import quote
+
+import pandas as pd
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Output sinks
+# csv: dataframes are appended to a single csv file (default, same files as before)
+# parquet/arrow: columnar dataset partitioned by model/run-date/station (hive layout, e.g.
+#   output/model=gfs/run-date=2024-06-01/meteo-station=Pljevlja/part-0.parquet), station names are dictionary
+#   encoded and float values are stored as float32. Requires pyarrow (or fastparquet for parquet).
+# ----------------------------------------------------------------------------------------------------------------------
+
+OUTPUT_FORMATS = ["csv", "parquet", "arrow"]
+OUTPUT_DIR = "output"
+
+
+class CsvSink:
+    """
+    Append dataframes to a csv file, the header is written only once
+
+    Args:
+        filename: csv file, overwritten when the sink is opened
+    """
+
+    def __init__(self, filename):
+        self.target = filename
+        self._file = open(filename, 'w', encoding='utf-8-sig', newline='')
+        self._header = True
+
+    def write(self, df):
+        df.to_csv(self._file, index=False, header=self._header)
+        self._header = False
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PartitionedSink:
+    """
+    Write dataframes to a parquet/arrow dataset partitioned by model/run-date/station
+
+    The first write replaces the whole output of earlier runs with the same model and run date, including partitions of
+    stations that are no longer in the run, so reruns never duplicate or keep stale data. Further writes to the same
+    partition add new part files.
+    Dataframes without a station column (e.g. wide historical geoglows data) are partitioned by model/run-date only.
+
+    Args:
+        root: root directory of the dataset
+        model: model (dataset) name
+        run_date: date of the run, today if None
+        file_format: parquet or arrow
+        station_column: column the data is partitioned by
+    """
+
+    def __init__(self, root, model, run_date=None, file_format="parquet", station_column="meteo-station"):
+        if run_date is None:
+            run_date = datetime.now().strftime('%Y-%m-%d')
+        self.target = os.path.join(root, f"model={quote(model, safe='')}", f"run-date={run_date}")
+        self.file_format = file_format
+        self.station_column = station_column
+        self._parts = {}
+        self._cleared = False
+
+    def _write_file(self, df, directory):
+        part = self._parts.get(directory, 0)
+        if part == 0:
+            os.makedirs(directory, exist_ok=True)
+        self._parts[directory] = part + 1
+        # Values as float32, string columns dictionary encoded
+        df = df.astype({c: 'float32' for c in df.columns if df[c].dtype == 'float64'})
+        df = df.astype({c: 'category' for c in df.columns if pd.api.types.is_string_dtype(df[c])})
+        if self.file_format == "parquet":
+            df.to_parquet(os.path.join(directory, f"part-{part}.parquet"), index=False)
+        else:
+            df.reset_index(drop=True).to_feather(os.path.join(directory, f"part-{part}.arrow"))
+
+    def write(self, df):
+        if not self._cleared:
+            # Remove the output of an earlier run with the same run date
+            shutil.rmtree(self.target, ignore_errors=True)
+            self._cleared = True
+        if self.station_column not in df.columns:
+            self._write_file(df, self.target)
+            return
+        for station, group in df.groupby(self.station_column, sort=False, observed=True):
+            directory = os.path.join(self.target, f"{self.station_column}={quote(str(station), safe='')}")
+            self._write_file(group.drop(columns=self.station_column), directory)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_sink(output_format, model, csv_filename, output_dir=OUTPUT_DIR, run_date=None):
+    """
+    Open the output sink of a model
+
+    Args:
+        output_format: csv, parquet or arrow
+        model: model (dataset) name used for the partitioned datasets
+        csv_filename: file written by the csv sink
+        output_dir: root directory of the partitioned datasets
+        run_date: run date of the partitioned datasets, today if None
+
+    Returns:
+        CsvSink or PartitionedSink
+    """
+    if output_format == "csv":
+        return CsvSink(csv_filename)
+    elif output_format in ("parquet", "arrow"):
+        return PartitionedSink(output_dir, model, run_date, output_format)
+    raise ValueError(f"output_format must be one of {', '.join(OUTPUT_FORMATS)}")
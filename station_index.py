@@ -0,0 +1,141 @@
+import hashlib
+import os
+
+import numpy as np
+
+from grids import GLOBAL_025
+from utils import unique_grid_points, idw_weights, bilinear_weights, weighted_average
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Station index
+# Station coordinates never change, so the grid points surrounding every station and the interpolation weights are
+# computed once and stored in a compact .npz file. A run only has to gather the values of the grid points and take
+# a weighted average.
+# ----------------------------------------------------------------------------------------------------------------------
+
+def stations_key(stations, grid):
+    """Hash identifying a station list and model grid"""
+    text = repr([(name, float(lat), float(lon)) for name, lat, lon in stations]) + grid.key
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class StationIndex:
+    """
+    Grid points and interpolation weights of a list of stations
+
+    Attributes:
+        key: hash of the station list and model grid the index was built for
+        grid: key of the model grid
+        latitude, longitude: arrays (stations) with station coordinates
+        points: array (grid points x 2) of distinct grid points requested from the API
+        station_indices: array (stations x 4) with indices of the corners of every station in points
+        corners: array (stations x 4 x 2) of corner coordinates as resolved by the API
+        idw: array (stations x 4) of IDW weights computed from the resolved corners
+        bilinear: array (stations x 4) of bilinear weights of the requested corners
+        dirty: index changed since it was loaded/built
+    """
+
+    def __init__(self, key, grid, latitude, longitude, points, station_indices, corners, idw, bilinear):
+        self.key = key
+        self.grid = grid
+        self.latitude = latitude
+        self.longitude = longitude
+        self.points = points
+        self.station_indices = station_indices
+        self.corners = corners
+        self.idw = idw
+        self.bilinear = bilinear
+        self.dirty = False
+
+    @classmethod
+    def build(cls, stations, grid=GLOBAL_025):
+        """Build the index of a list of (station name, latitude, longitude) tuples on a grid from grids.py"""
+        latitude = np.array([s[1] for s in stations], dtype=np.float64)
+        longitude = np.array([s[2] for s in stations], dtype=np.float64)
+        points, station_indices = unique_grid_points(latitude, longitude, lambda lat, lon: grid.cell(lat, lon)[0])
+        points = np.array(points, dtype=np.float64)
+        station_indices = np.array(station_indices, dtype=np.int64)
+        # Until the API resolves them, the corners are the requested grid points
+        corners = points[station_indices]
+
+        # Corners are ordered (lat0, lon0), (lat1, lon1), (lat0, lon1), (lat1, lon0), bilinear weights are for
+        # the points (lon0, lat0), (lon0, lat1), (lon1, lat0), (lon1, lat1) of the unit cell
+        position = np.array([grid.cell(lat, lon)[1] for lat, lon in zip(latitude, longitude)], dtype=np.float64)
+        bilinear = bilinear_weights(position[:, 0], position[:, 1], 0.0, 1.0, 0.0, 1.0)[:, [0, 3, 2, 1]]
+
+        index = cls(stations_key(stations, grid), grid.key, latitude, longitude, points, station_indices,
+                    corners, idw_weights(latitude, longitude, corners), bilinear)
+        index.dirty = True
+        return index
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(str(data['key']), str(data['grid']), data['latitude'], data['longitude'],
+                       data['points'], data['station_indices'], data['corners'], data['idw'], data['bilinear'])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Write to a temporary file first so an interrupted run never leaves a broken index
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, key=self.key, grid=self.grid, latitude=self.latitude,
+                 longitude=self.longitude, points=self.points, station_indices=self.station_indices,
+                 corners=self.corners, idw=self.idw, bilinear=self.bilinear)
+        os.replace(tmp_path, path)
+        self.dirty = False
+
+    def resolve(self, stations, corners):
+        """
+        Update the IDW weights of stations whose corners were resolved by the API to different coordinates
+
+        Args:
+            stations: array with indices of stations
+            corners: array (stations x 4 x 2) of corner coordinates returned by the API
+        """
+        stations = np.asarray(stations)
+        changed = ~np.all(self.corners[stations] == corners, axis=(1, 2))
+        if changed.any():
+            stations = stations[changed]
+            self.corners[stations] = corners[changed]
+            self.idw[stations] = idw_weights(self.latitude[stations], self.longitude[stations], corners[changed])
+            self.dirty = True
+
+    def interpolate(self, stations, values, method='idw'):
+        """
+        Interpolate values of the corners of stations
+
+        Args:
+            stations: array with indices of stations
+            values: array (stations x 4 x ...) with values of the corners
+            method: idw (NaN values are skipped) or bilinear (NaN values propagate)
+
+        Returns:
+            Array (stations x ...) of interpolated values
+        """
+        if method == 'idw':
+            return weighted_average(self.idw[stations], values)
+        elif method == 'bilinear':
+            weights = self.bilinear[stations].reshape(len(stations), 4, *(1,) * (np.ndim(values) - 2))
+            # Corners without weight (degenerate cells) are ignored
+            return np.where(weights != 0, weights * values, 0.0).sum(axis=1)
+        raise ValueError("method must be either idw or bilinear")
+
+
+def load_station_index(path, stations, grid=GLOBAL_025):
+    """
+    Load the station index from path, rebuilding it if the station list or model grid changed
+
+    Args:
+        path: .npz file of the index
+        stations: list of (station name, latitude, longitude) tuples
+        grid: model grid from grids.py
+
+    Returns:
+        StationIndex
+    """
+    if os.path.exists(path):
+        index = StationIndex.load(path)
+        if index.key == stations_key(stations, grid):
+            return index
+    return StationIndex.build(stations, grid)
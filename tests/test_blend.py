@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from blend import blend_columns, blend_values, common_time_axis, fill_gaps, to_time_axis
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Multi-model blend: gap filling, moving models to the common hourly time axis and the consensus of the models
+# ----------------------------------------------------------------------------------------------------------------------
+
+NAN = np.nan
+
+
+def hours(start, periods, freq="h"):
+    return pd.date_range(start, periods=periods, freq=freq, tz="UTC")
+
+
+def test_fill_gaps_instantaneous():
+    values = np.array([[NAN, 1.0, NAN, NAN, 4.0, 5.0, NAN],
+                       [2.0, NAN, 2.0, NAN, NAN, NAN, NAN]])
+    # Values are kept, gaps between two values are interpolated, gaps at the start and end stay NaN
+    np.testing.assert_array_equal(fill_gaps(values), [[NAN, 1.0, 2.0, 3.0, 4.0, 5.0, NAN],
+                                                      [2.0, 2.0, 2.0, NAN, NAN, NAN, NAN]])
+
+
+def test_fill_gaps_max_gap():
+    values = np.array([1.0, NAN, NAN, 4.0, NAN, 6.0])
+    np.testing.assert_array_equal(fill_gaps(values, max_gap=1), [1.0, NAN, NAN, 4.0, 5.0, 6.0])
+    np.testing.assert_array_equal(fill_gaps(values, max_gap=2), [1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+
+
+def test_fill_gaps_accumulated():
+    # 3-hourly sums on an hourly axis are spread over the hours of their time step, totals are kept
+    values = np.array([0.0, NAN, NAN, 3.0, NAN, NAN, 6.0])
+    filled = fill_gaps(values, accumulated=True)
+    np.testing.assert_array_equal(filled, [0.0, 1.0, 1.0, 1.0, 2.0, 2.0, 2.0])
+    assert filled.sum() == np.nansum(values)
+
+
+def test_fill_gaps_accumulated_without_start():
+    # A sum without a known start keeps its value, the hours before it and after the last value stay NaN
+    values = np.array([NAN, NAN, 3.0, NAN, 4.0, NAN])
+    np.testing.assert_array_equal(fill_gaps(values, accumulated=True), [NAN, NAN, 3.0, 2.0, 2.0, NAN])
+    values = np.array([1.0, NAN, NAN, NAN, 8.0])
+    np.testing.assert_array_equal(fill_gaps(values, accumulated=True, max_gap=2), [1.0, NAN, NAN, NAN, 8.0])
+
+
+def test_fill_gaps_complete():
+    values = np.arange(6.0)
+    assert fill_gaps(values) is values
+
+
+def test_to_time_axis_instantaneous():
+    date_time = hours("2024-06-01", 3, "3h")
+    axis = hours("2024-05-31 23:00", 11)
+    result = to_time_axis(np.array([[0.0, 3.0, 9.0]]), date_time, axis)
+    np.testing.assert_allclose(result, [[NAN, 0, 1, 2, 3, 5, 7, 9, NAN, NAN, NAN]])
+
+
+def test_to_time_axis_accumulated():
+    date_time = hours("2024-06-01", 3, "3h")
+    axis = hours("2024-05-31 22:00", 11)
+    result = to_time_axis(np.array([6.0, 3.0, 9.0]), date_time, axis, accumulated=True)
+    # Every hour gets its share of the time step it belongs to, including the hours before the first time step
+    np.testing.assert_allclose(result, [2, 2, 2, 1, 1, 1, 3, 3, 3, NAN, NAN])
+
+
+def test_to_time_axis_hourly_unchanged():
+    date_time = hours("2024-06-01", 5)
+    values = np.arange(10.0).reshape(2, 5)
+    np.testing.assert_array_equal(to_time_axis(values, date_time, date_time), values)
+    np.testing.assert_array_equal(to_time_axis(values, date_time, date_time, accumulated=True), values)
+
+
+def test_models_ending_at_different_times():
+    hourly = hours("2024-06-01", 13)
+    three_hourly = hours("2024-06-01", 3, "3h")
+    axis = common_time_axis([hourly, three_hourly])
+    assert axis.equals(hourly)
+
+    long_model = to_time_axis(np.full((1, 13), 10.0), hourly, axis)
+    short_model = to_time_axis(np.full((1, 3), 20.0), three_hourly, axis)
+    assert np.isnan(short_model[0, 7:]).all()
+    consensus, spread = blend_values(np.array([long_model, short_model]), [1.0, 1.0])
+    np.testing.assert_allclose(consensus[0, :7], 15.0)
+    np.testing.assert_allclose(spread[0, :7], 5.0)
+    # Hours after the end of the short model only hold the long model
+    np.testing.assert_allclose(consensus[0, 7:], 10.0)
+    np.testing.assert_allclose(spread[0, 7:], 0.0)
+
+
+def test_common_time_axis_later_start():
+    axis = common_time_axis([hours("2024-06-01 06:00", 4), hours("2024-06-01", 3, "3h")])
+    assert axis[0] == pd.Timestamp("2024-06-01", tz="UTC")
+    assert axis[-1] == pd.Timestamp("2024-06-01 09:00", tz="UTC")
+    assert len(axis) == 10
+
+
+def test_blend_values_weights_and_missing():
+    values = np.array([[1.0, NAN, NAN], [4.0, 2.0, NAN]])
+    consensus, spread = blend_values(values, [2.0, 1.0])
+    np.testing.assert_allclose(consensus, [2.0, 2.0, NAN])
+    np.testing.assert_allclose(spread, [np.sqrt(2.0), 0.0, NAN])
+
+
+def test_blend_columns():
+    hourly = hours("2024-06-01", 7)
+    gfs = np.stack([np.arange(7.0), np.full(7, 1.0)])[None]
+    # 3-hourly ECMWF data returned on an hourly axis, with precipitation summed over the preceding 3 hours
+    ecmwf = np.array([[[0.0, NAN, NAN, 3.0, NAN, NAN, 6.0], [0.0, NAN, NAN, 3.0, NAN, NAN, 3.0]]])
+    columns = blend_columns(["gfs", "ecmwf"], ["temperature_2m", "precipitation"], hourly,
+                            [(hourly, gfs), (hourly, ecmwf)], [1.0, 1.0])
+    assert list(columns) == ["temperature", "temperature_spread", "temperature_gfs", "temperature_ecmwf",
+                             "precipitation", "precipitation_spread", "precipitation_gfs", "precipitation_ecmwf"]
+    np.testing.assert_allclose(columns["temperature_ecmwf"][0], np.arange(7.0))
+    np.testing.assert_allclose(columns["precipitation_ecmwf"][0], [0, 1, 1, 1, 1, 1, 1])
+    np.testing.assert_allclose(columns["precipitation"][0], [0.5, 1, 1, 1, 1, 1, 1])
+    assert columns["temperature_spread"][0] == pytest.approx(np.zeros(7))
@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from benchmarks.server import StandInServer
+from engine import create_session, model_url
+from point_cache import PointCache
+from response_cache import ModelSchedule, ModelStore, RunCache
+from utils import locations_params
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Response and grid point caches: LRU eviction and invalidation of older runs when a model run advances
+# ----------------------------------------------------------------------------------------------------------------------
+
+RUN = datetime(2024, 6, 1, 6, tzinfo=timezone.utc)
+PARAMS = {"hourly": ["temperature_2m"], "past_days": 0, "forecast_days": 1}
+
+
+def run_key(run, name):
+    return run.strftime('%Y%m%d%H') + "_" + name
+
+
+def test_schedule_observed_run():
+    schedule = ModelSchedule(6, 4)
+    now = datetime(2024, 6, 1, 11, 30, tzinfo=timezone.utc)
+    assert schedule.latest_run(now) == RUN
+    schedule.observe(RUN + timedelta(hours=3))
+    assert schedule.latest_run(now) == RUN + timedelta(hours=3)
+    schedule.observe(None)
+    assert schedule.latest_run(now) == RUN
+
+
+def test_model_store_lru():
+    store = ModelStore(None, ModelSchedule(), max_memory=300)
+    for name in "abc":
+        store.put(run_key(RUN, name), bytes(100), RUN)
+    assert store.get(run_key(RUN, "a"), RUN) is not None
+    store.put(run_key(RUN, "d"), bytes(100), RUN)
+    # b is the least recently used message
+    assert store.get(run_key(RUN, "b"), RUN) is None
+    assert all(store.get(run_key(RUN, name), RUN) is not None for name in "acd")
+    assert store.stats()["evictions"] == 1
+    assert store.stats()["memory_bytes"] == 300
+
+
+def test_model_store_drops_older_runs(tmp_path):
+    schedule = ModelSchedule(6, 0)
+    schedule.observe(RUN)
+    store = ModelStore(str(tmp_path), schedule)
+    store.put(run_key(schedule.latest_run(), "a"), b"old", schedule.latest_run())
+    assert len(list(tmp_path.iterdir())) == 1
+
+    schedule.observe(RUN + timedelta(hours=6))
+    run = schedule.latest_run()
+    assert store.get(run_key(RUN, "a"), run) is None
+    assert not list(tmp_path.iterdir())
+    assert store.stats()["memory_bytes"] == store.stats()["disk_bytes"] == 0
+
+    store.put(run_key(run, "a"), b"new", run)
+    # A lookup of an older run does not drop the newer one
+    store.get(run_key(RUN, "a"), RUN)
+    assert store.get(run_key(run, "a"), run) == b"new"
+
+
+def test_run_cache_follows_observed_runs(tmp_path):
+    schedule = ModelSchedule(6, 0)
+    schedule.observe(RUN)
+    points = [(43.25, 19.25), (43.5, 19.5)]
+    with StandInServer() as server:
+        url = model_url("gfs", server.url)
+        cache = RunCache(create_session(retries=0), {"/v1/gfs": schedule}, str(tmp_path))
+        first = cache.weather_api(url, locations_params(PARAMS, points))
+        cache.weather_api(url, locations_params(PARAMS, points))
+        assert server.requests == 1
+        assert [(r.Latitude(), r.Longitude()) for r in first] == pytest.approx(points)
+
+        # A new run changes the keys, so the grid points are requested again and the older run is dropped
+        schedule.observe(RUN + timedelta(hours=6))
+        cache.weather_api(url, locations_params(PARAMS, points))
+        assert server.requests == 2
+        files = list((tmp_path / "v1_gfs").iterdir())
+        assert len(files) == len(points)
+        assert all(f.name.startswith("2024060112") for f in files)
+
+
+def point_values(steps=100):
+    return np.arange(steps, dtype=np.float64)[None, :]
+
+
+def test_point_cache_lru(tmp_path):
+    cache = PointCache(str(tmp_path), max_memory=3 * 800 + 3 * 40)
+    meta = [0, 0, 3600, 43.25, 19.25]
+    for lat in (43.0, 43.25, 43.5):
+        cache.put("v1_gfs", "2024060106", "r", lat, 19.25, ["t"], meta, point_values())
+    assert cache.stats()["evictions"] == 0
+    assert cache.get("v1_gfs", "2024060106", "r", 43.0, 19.25, ["t"]) is not None
+
+    cache.put("v1_gfs", "2024060106", "r", 43.75, 19.25, ["t"], meta, point_values())
+    stats = cache.stats()
+    assert stats["evictions"] == 2
+    assert stats["memory_bytes"] <= cache.max_memory
+    # Evicted arrays are mapped again from disk
+    meta_values = cache.get("v1_gfs", "2024060106", "r", 43.25, 19.25, ["t"])
+    assert meta_values is not None
+    np.testing.assert_array_equal(meta_values[1], point_values())
+
+
+def test_point_cache_memory_only_lru():
+    cache = PointCache(None, max_memory=2 * (800 + 40))
+    meta = [0, 0, 3600, 43.25, 19.25]
+    for lat in (43.0, 43.25, 43.5):
+        cache.put("v1_gfs", "2024060106", "r", lat, 19.25, ["t"], meta, point_values())
+    assert cache.get("v1_gfs", "2024060106", "r", 43.0, 19.25, ["t"]) is None
+    assert cache.get("v1_gfs", "2024060106", "r", 43.5, 19.25, ["t"]) is not None
+    assert cache.stats()["memory_bytes"] <= cache.max_memory
+
+
+def test_point_cache_drops_older_runs(tmp_path):
+    schedule = ModelSchedule(6, 0)
+    schedule.observe(RUN)
+    cache = PointCache(str(tmp_path))
+    meta = [0, 0, 3600, 43.25, 19.25]
+    old = schedule.latest_run().strftime('%Y%m%d%H')
+    cache.put("v1_gfs", old, "r", 43.25, 19.25, ["t"], meta, point_values())
+    assert (tmp_path / "v1_gfs" / old).is_dir()
+
+    schedule.observe(RUN + timedelta(hours=6))
+    new = schedule.latest_run().strftime('%Y%m%d%H')
+    assert cache.get("v1_gfs", new, "r", 43.25, 19.25, ["t"]) is None
+    assert not (tmp_path / "v1_gfs" / old).exists()
+    assert cache.stats()["memory_bytes"] == 0
+
+    # Values of an older run are not stored once a newer run was seen
+    cache.put("v1_gfs", old, "r", 43.25, 19.25, ["t"], meta, point_values())
+    assert not (tmp_path / "v1_gfs" / old).exists()
@@ -0,0 +1,114 @@
+import math
+import time
+
+import numpy as np
+import pytest
+
+from benchmarks.fixtures import stations
+from benchmarks.server import StandInServer
+from engine import Fetcher, create_client, iter_model, model_url
+from grids import model_grid
+from station_index import StationIndex
+from utils import locations_params
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Fetcher against the stand-in open-meteo server (benchmarks/server.py), no network access needed:
+#   python -m pytest
+# ----------------------------------------------------------------------------------------------------------------------
+
+PARAMS = {"hourly": ["temperature_2m", "precipitation"], "past_days": 0, "forecast_days": 1}
+
+
+class SlowServer(StandInServer):
+    """Stand-in server answering after a delay, recording the most requests in flight at the same time"""
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+
+    def body(self, query):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            return super().body(query)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def server():
+    with StandInServer() as server:
+        yield server
+
+
+def test_multi_location_request_keeps_order(server):
+    points = [(43.25, 19.25), (43.5, 19.5), (42.75, 19.75)]
+    with Fetcher(create_client(retries=0)) as fetcher:
+        responses = fetcher.submit(model_url("gfs", server.url), locations_params(PARAMS, points)).result()
+    assert server.requests == 1
+    assert [(r.Latitude(), r.Longitude()) for r in responses] == pytest.approx(points)
+    assert all(r.Hourly().VariablesLength() == 2 for r in responses)
+
+
+@pytest.mark.parametrize("max_locations", [16, 100])
+def test_batched_requests(server, max_locations):
+    points = stations(50)
+    index = StationIndex.build(points, model_grid("gfs"))
+    with Fetcher(create_client(retries=0)) as fetcher:
+        frames = dict(iter_model(model_url("gfs", server.url), points, fetcher=fetcher, index=index,
+                                 max_locations=max_locations))
+    # Every grid point is requested once, in chunks of at most max_locations
+    assert server.requests == math.ceil(len(index.points) / max_locations)
+    assert sorted(frames) == list(range(len(points)))
+    assert not np.isnan(frames[0]["hourly"]["temperature"].to_numpy()).any()
+
+
+def test_one_request_per_station_without_batching(server):
+    points = stations(10)
+    with Fetcher(create_client(retries=0)) as fetcher:
+        frames = dict(iter_model(model_url("gfs", server.url), points, fetcher=fetcher, batch_requests=False))
+    assert server.requests == len(points)
+    assert len(frames) == len(points)
+
+
+def test_per_host_limit():
+    with SlowServer(0.2) as server, Fetcher(create_client(retries=0), max_workers=8, max_per_host=2) as fetcher:
+        url = model_url("gfs", server.url)
+        futures = [fetcher.submit(url, locations_params(PARAMS, [(43.0 + k, 19.0)])) for k in range(6)]
+        assert all(len(future.result()) == 1 for future in futures)
+    assert server.max_active == 2
+
+
+def test_limit_is_per_host():
+    # 127.0.0.1 and localhost are different hosts for the fetcher, both reach the same server
+    with SlowServer(0.3) as server, Fetcher(create_client(retries=0), max_workers=8, max_per_host=2) as fetcher:
+        urls = [model_url("gfs", server.url), model_url("gfs", server.url.replace("127.0.0.1", "localhost"))]
+        futures = [fetcher.submit(url, locations_params(PARAMS, [(43.0 + k, 19.0)])) for url in urls for k in range(4)]
+        assert all(len(future.result()) == 1 for future in futures)
+    assert 2 < server.max_active <= 4
+
+
+def test_retry_on_server_error(server):
+    server.failures = 2
+    with Fetcher(create_client(retries=3, backoff_factor=0)) as fetcher:
+        responses = fetcher.submit(model_url("gfs", server.url), locations_params(PARAMS, [(43.25, 19.25)])).result()
+    assert len(responses) == 1
+    assert server.failures == 0
+    assert server.requests == 1
+
+
+def test_error_after_retries(server):
+    server.failures = 5
+    with Fetcher(create_client(retries=2, backoff_factor=0)) as fetcher:
+        future = fetcher.submit(model_url("gfs", server.url), locations_params(PARAMS, [(43.25, 19.25)]))
+        with pytest.raises(Exception):
+            future.result()
+    # First try and two retries
+    assert server.failures == 2
+    assert server.requests == 0
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from rollups import compute_rollups, daily_groups, daily_reduce, parse_rollup, rolling_reduce
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Ingest-time rollups against the equivalent pandas resample/rolling of the hourly values
+# ----------------------------------------------------------------------------------------------------------------------
+
+def hourly_values(stations=3, hours=80, start="2024-06-01 05:00"):
+    """Hourly values (stations x time) with scattered NaN values, a day without values and a station without values"""
+    rng = np.random.default_rng(3)
+    date_time = pd.date_range(start, periods=hours, freq="h", tz="UTC")
+    values = rng.gamma(1.5, 2.0, (stations, hours))
+    values[rng.random(values.shape) < 0.15] = np.nan
+    values[0, (date_time >= "2024-06-02") & (date_time < "2024-06-03")] = np.nan
+    values[-1] = np.nan
+    return date_time, values
+
+
+def station_series(date_time, values):
+    return [pd.Series(row, index=date_time) for row in values]
+
+
+@pytest.mark.parametrize("name, reduce", [
+    ("daily_sum", lambda resampled: resampled.sum(min_count=1)),
+    ("daily_min", lambda resampled: resampled.min()),
+    ("daily_max", lambda resampled: resampled.max()),
+    ("daily_mean", lambda resampled: resampled.mean()),
+])
+def test_daily_matches_resample(name, reduce):
+    date_time, values = hourly_values()
+    days, starts = daily_groups(date_time)
+    result = daily_reduce(values, starts, name)
+    for row, series in zip(result, station_series(date_time, values)):
+        expected = reduce(series.resample("D"))
+        assert list(days) == list(expected.index)
+        np.testing.assert_allclose(row, expected.to_numpy(), equal_nan=True)
+    # Days without any value are NaN
+    assert np.isnan(result[0, 1])
+    assert np.isnan(result[-1]).all()
+
+
+@pytest.mark.parametrize("window", [1, 3, 24])
+@pytest.mark.parametrize("kind", ["sum", "mean"])
+def test_rolling_matches_pandas(window, kind):
+    date_time, values = hourly_values()
+    result = rolling_reduce(values, window, kind)
+    for row, series in zip(result, station_series(date_time, values)):
+        expected = getattr(series.rolling(window, min_periods=1), kind)().to_numpy(copy=True)
+        # NaN until the window is full
+        expected[:window - 1] = np.nan
+        np.testing.assert_allclose(row, expected, equal_nan=True, atol=1e-9)
+
+
+def test_rolling_window_without_values():
+    values = np.array([[1.0, np.nan, np.nan, np.nan, 2.0]])
+    np.testing.assert_array_equal(rolling_reduce(values, 2, "sum"), [[np.nan, 1.0, np.nan, np.nan, 2.0]])
+    np.testing.assert_array_equal(rolling_reduce(values, 2, "mean"), [[np.nan, 1.0, np.nan, np.nan, 2.0]])
+
+
+def test_compute_rollups():
+    date_time, precipitation = hourly_values()
+    temperature = precipitation * 3 - 5
+    interpolated = np.stack([temperature, precipitation], axis=1)
+    rollups = ["precipitation:daily_sum", "temperature_2m:daily_max", "precipitation:rolling_sum_24h",
+               "temperature_2m:rolling_mean_6h"]
+    hourly, days, daily = compute_rollups(rollups, ["temperature_2m", "precipitation"], interpolated, date_time,
+                                          {"temperature_2m": "temperature"})
+    assert sorted(daily) == ["precipitation_daily_sum", "temperature_daily_max"]
+    assert sorted(hourly) == ["precipitation_rolling_sum_24h", "temperature_rolling_mean_6h"]
+    assert len(days) == daily["precipitation_daily_sum"].shape[1] == 4
+
+    series = pd.Series(precipitation[1], index=date_time)
+    expected = series.resample("D").sum(min_count=1).round(2)
+    np.testing.assert_allclose(daily["precipitation_daily_sum"][1], expected, equal_nan=True)
+    expected = series.rolling(24, min_periods=1).sum().round(2).to_numpy(copy=True)
+    expected[:23] = np.nan
+    np.testing.assert_allclose(hourly["precipitation_rolling_sum_24h"][1], expected, equal_nan=True, atol=0.011)
+
+
+def test_rolling_window_in_time_steps():
+    # 24 hours of 3-hourly values are 8 time steps
+    date_time = pd.date_range("2024-06-01", periods=16, freq="3h", tz="UTC")
+    interpolated = np.ones((1, 1, 16))
+    hourly, _, _ = compute_rollups(["precipitation:rolling_sum_24h"], ["precipitation"], interpolated, date_time)
+    result = hourly["precipitation_rolling_sum_24h"][0]
+    assert np.isnan(result[:7]).all()
+    np.testing.assert_array_equal(result[7:], 8.0)
+
+
+def test_invalid_rollups():
+    assert parse_rollup("precipitation:rolling_mean_72h") == ("precipitation", "rolling_mean_72h")
+    with pytest.raises(ValueError):
+        parse_rollup("precipitation:weekly_sum")
+    with pytest.raises(ValueError):
+        parse_rollup(":daily_sum")
+    date_time, values = hourly_values()
+    with pytest.raises(ValueError):
+        compute_rollups(["snowfall:daily_sum"], ["precipitation"], values[:, None], date_time)
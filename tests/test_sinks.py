@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pytest
+
+from sinks import CsvSink, PartitionedSink, open_sink
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Output sinks: reruns replace the run-date partition, station names survive the partition path encoding
+# ----------------------------------------------------------------------------------------------------------------------
+
+STATIONS = ["Pljevlja", "Kolašin", "Kokin Brod", "Uvac/Bistrica", "50% Rijeka=Ibar"]
+
+
+def station_frame(stations, hours=3, value=1.0):
+    time = pd.date_range("2024-06-01", periods=hours, freq="h", tz="UTC")
+    return pd.DataFrame({"meteo-station": np.repeat(stations, hours), "date-time": np.tile(time, len(stations)),
+                         "temperature": value + np.arange(hours * len(stations), dtype=np.float64)})
+
+
+def read_dataset(root, file_format):
+    if file_format == "parquet":
+        return pd.read_parquet(root)
+    return ds.dataset(root, format="ipc", partitioning="hive").to_table().to_pandas()
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow"])
+def test_station_names_read_back(tmp_path, file_format):
+    with PartitionedSink(str(tmp_path), "gfs", "2024-06-01", file_format) as sink:
+        sink.write(station_frame(STATIONS))
+    assert len(list(tmp_path.glob("model=gfs/run-date=2024-06-01/meteo-station=*"))) == len(STATIONS)
+    df = read_dataset(str(tmp_path), file_format)
+    assert sorted(df["meteo-station"].astype(str).unique()) == sorted(STATIONS)
+    assert df["temperature"].dtype == np.float32
+    assert len(df) == 3 * len(STATIONS)
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow"])
+def test_rerun_replaces_run_date(tmp_path, file_format):
+    with PartitionedSink(str(tmp_path), "gfs", "2024-06-01", file_format) as sink:
+        sink.write(station_frame(STATIONS))
+    with PartitionedSink(str(tmp_path), "gfs", "2024-06-02", file_format) as sink:
+        sink.write(station_frame(STATIONS[:1]))
+    # Rerun of the first date without most of the stations and with new values, written in two parts
+    with PartitionedSink(str(tmp_path), "gfs", "2024-06-01", file_format) as sink:
+        sink.write(station_frame(STATIONS[:2], value=100.0))
+        sink.write(station_frame(STATIONS[:1], value=200.0))
+
+    run = tmp_path / "model=gfs" / "run-date=2024-06-01"
+    assert sorted(p.name for p in run.iterdir()) == ["meteo-station=Kola%C5%A1in", "meteo-station=Pljevlja"]
+    assert len(list((run / "meteo-station=Pljevlja").iterdir())) == 2
+    df = read_dataset(str(run), file_format)
+    assert len(df) == 3 * 3
+    assert df["temperature"].min() >= 100.0
+    # Other run dates are kept
+    assert (tmp_path / "model=gfs" / "run-date=2024-06-02" / "meteo-station=Pljevlja").is_dir()
+
+
+def test_partition_without_station_column(tmp_path):
+    df = pd.DataFrame({"time": pd.date_range("2024-06-01", periods=4, freq="D"), "220252711": np.arange(4.0)})
+    with PartitionedSink(str(tmp_path), "retrospective", "2024-06-01") as sink:
+        sink.write(df)
+        sink.write(df)
+    files = sorted(p.name for p in (tmp_path / "model=retrospective" / "run-date=2024-06-01").iterdir())
+    assert files == ["part-0.parquet", "part-1.parquet"]
+
+
+def test_csv_sink_appends_with_one_header(tmp_path):
+    path = tmp_path / "gfs.csv"
+    with open_sink("csv", "gfs", str(path)) as sink:
+        assert isinstance(sink, CsvSink)
+        sink.write(station_frame(STATIONS[:1]))
+        sink.write(station_frame(STATIONS[1:2]))
+    df = pd.read_csv(path, encoding="utf-8-sig")
+    assert list(df["meteo-station"].unique()) == STATIONS[:2]
+    assert len(df) == 6
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        open_sink("xlsx", "gfs", str(tmp_path / "gfs.csv"))
@@ -0,0 +1,98 @@
+import numpy as np
+
+from grids import ECMWF_IFS025, GFS_025, ModelGrid
+from station_index import StationIndex, load_station_index, stations_key
+from utils import idw_weights
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Station index: npz round trip, rebuild on a changed station list or grid, corners resolved by the API
+# ----------------------------------------------------------------------------------------------------------------------
+
+STATIONS = [("Pljevlja", 43.35, 19.36), ("Kolašin", 42.83, 19.52), ("Zlatibor", 43.74, 19.71)]
+GFS = ModelGrid("gfs", [GFS_025])
+ECMWF = ModelGrid("ecmwf", [ECMWF_IFS025])
+
+ARRAYS = ["latitude", "longitude", "points", "station_indices", "corners", "idw", "bilinear"]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "index" / "gfs.npz")
+    index = StationIndex.build(STATIONS, GFS)
+    assert index.dirty
+    index.save(path)
+    assert not index.dirty
+
+    loaded = StationIndex.load(path)
+    assert (loaded.key, loaded.grid) == (index.key, index.grid)
+    for name in ARRAYS:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(index, name))
+    assert not loaded.dirty
+    assert not list(tmp_path.glob("index/*.tmp.npz"))
+
+
+def test_corners_surround_stations():
+    index = StationIndex.build(STATIONS, GFS)
+    corners = index.points[index.station_indices]
+    assert (corners[..., 0].min(axis=1) <= index.latitude).all()
+    assert (corners[..., 0].max(axis=1) >= index.latitude).all()
+    assert (corners[..., 1].min(axis=1) <= index.longitude).all()
+    assert (corners[..., 1].max(axis=1) >= index.longitude).all()
+    # Shared grid points are stored once
+    assert len(np.unique(index.points, axis=0)) == len(index.points)
+
+
+def test_load_existing(tmp_path):
+    path = str(tmp_path / "gfs.npz")
+    StationIndex.build(STATIONS, GFS).save(path)
+    index = load_station_index(path, STATIONS, GFS)
+    assert not index.dirty
+    assert index.key == stations_key(STATIONS, GFS)
+
+
+def test_rebuild_on_changed_stations(tmp_path):
+    path = str(tmp_path / "gfs.npz")
+    StationIndex.build(STATIONS, GFS).save(path)
+    stations = STATIONS + [("Žabljak", 43.15, 19.12)]
+    index = load_station_index(path, stations, GFS)
+    assert index.dirty
+    assert index.key == stations_key(stations, GFS)
+    assert len(index.latitude) == len(stations)
+
+    moved = [("Pljevlja", 43.36, 19.36)] + STATIONS[1:]
+    assert load_station_index(path, moved, GFS).dirty
+
+
+def test_rebuild_on_changed_grid(tmp_path):
+    path = str(tmp_path / "index.npz")
+    StationIndex.build(STATIONS, GFS).save(path)
+    index = load_station_index(path, STATIONS, ECMWF)
+    assert index.dirty
+    assert index.grid == ECMWF.key
+
+
+def test_resolve_snapped_corners():
+    index = StationIndex.build(STATIONS, GFS)
+    index.dirty = False
+    idw = index.idw.copy()
+    # The API snaps the corners of the second station to slightly different coordinates
+    stations = np.arange(len(STATIONS))
+    corners = index.corners.copy()
+    corners[1] += [0.01, -0.02]
+    index.resolve(stations, corners)
+
+    assert index.dirty
+    np.testing.assert_array_equal(index.corners, corners)
+    np.testing.assert_allclose(index.idw[1], idw_weights(index.latitude[[1]], index.longitude[[1]], corners[[1]])[0])
+    np.testing.assert_array_equal(index.idw[[0, 2]], idw[[0, 2]])
+    # Requested grid points are not changed
+    np.testing.assert_allclose(index.points[index.station_indices[1]], index.corners[1] - [0.01, -0.02])
+
+
+def test_resolve_unchanged_corners():
+    index = StationIndex.build(STATIONS, GFS)
+    index.dirty = False
+    idw = index.idw.copy()
+    index.resolve(np.arange(len(STATIONS)), index.corners.copy())
+    assert not index.dirty
+    np.testing.assert_array_equal(index.idw, idw)
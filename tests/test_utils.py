@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from utils import (bilinear_interpolation, bilinear_interpolation_batch, bilinear_weights, inverse_distance_weighting,
+                   inverse_distance_weighting_batch)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Batch interpolation kernels against the per-station functions they replace in the engine
+# ----------------------------------------------------------------------------------------------------------------------
+
+RNG = np.random.default_rng(7)
+
+
+def corner_values(stations, variables=2, steps=24, nan=0.0):
+    """Values (stations x 4 corners x variables x time) with a fraction nan of NaN values"""
+    values = RNG.normal(10, 5, (stations, 4, variables, steps))
+    values[RNG.random(values.shape) < nan] = np.nan
+    return values
+
+
+def cell(x, y):
+    """Corners of the 0.25° cell around a point as [(x1, y1), (x1, y2), (x2, y1), (x2, y2)]"""
+    x1, x2 = np.floor(x * 4) / 4, np.ceil(x * 4) / 4
+    y1, y2 = np.floor(y * 4) / 4, np.ceil(y * 4) / 4
+    return [(x1, y1), (x1, y2), (x2, y1), (x2, y2)]
+
+
+def idw_cases():
+    """Stations inside cells, on a grid point, on a grid line, with NaN corners and an all-NaN corner"""
+    x = np.array([19.36, 19.5, 19.5, 19.71, 19.12, 19.9])
+    y = np.array([43.35, 42.75, 43.6, 43.74, 42.01, 43.3])
+    points = np.array([cell(a, b) for a, b in zip(x, y)])
+    values = corner_values(len(x), nan=0.2)
+    values[4, 2] = np.nan
+    values[5] = np.nan
+    return x, y, points, values
+
+
+def test_idw_batch_matches_scalar():
+    x, y, points, values = idw_cases()
+    batch = inverse_distance_weighting_batch(x, y, points, values)
+    for i in range(len(x)):
+        expected = inverse_distance_weighting(x[i], y[i], [tuple(p) for p in points[i]], list(values[i]))
+        np.testing.assert_allclose(batch[i], expected, equal_nan=True)
+
+
+def test_idw_batch_exact_hit():
+    x, y = np.array([19.5]), np.array([42.75])
+    points = np.array([[(19.25, 42.5), (19.5, 42.75), (19.5, 42.75), (19.75, 43.0)]])
+    values = corner_values(1)
+    values[0, 1, 0, :3] = np.nan
+    batch = inverse_distance_weighting_batch(x, y, points, values)
+    # The first point at the station wins, its NaN values stay NaN
+    np.testing.assert_array_equal(batch[0], values[0, 1])
+    np.testing.assert_array_equal(batch[0], inverse_distance_weighting(19.5, 42.75, points[0], list(values[0])))
+
+
+def test_idw_batch_all_nan():
+    x, y, points, values = idw_cases()
+    batch = inverse_distance_weighting_batch(x, y, points, values)
+    assert np.isnan(batch[5]).all()
+    assert not np.isnan(batch[4]).all()
+
+
+def bilinear_cases():
+    """Interior points, exact grid hits and degenerate cells collapsed along x, y or both"""
+    x = np.array([19.36, 19.71, 19.5, 19.5, 19.3, 19.25])
+    y = np.array([43.35, 43.74, 42.75, 43.1, 43.0, 42.5])
+    x1 = np.array([19.25, 19.5, 19.5, 19.5, 19.25, 19.25])
+    x2 = np.array([19.5, 19.75, 19.5, 19.5, 19.5, 19.25])
+    y1 = np.array([43.25, 43.5, 42.75, 43.0, 43.0, 42.5])
+    y2 = np.array([43.5, 43.75, 42.75, 43.25, 43.0, 42.5])
+    return x, y, x1, x2, y1, y2
+
+
+def scalar_bilinear(x, y, x1, x2, y1, y2, values):
+    return np.array([bilinear_interpolation(x[i], y[i], x1[i], x2[i], y1[i], y2[i], *values[i])
+                     for i in range(len(x))])
+
+
+def test_bilinear_batch_matches_scalar():
+    x, y, x1, x2, y1, y2 = bilinear_cases()
+    values = corner_values(len(x))
+    batch = bilinear_interpolation_batch(x, y, x1, x2, y1, y2, *values.transpose(1, 0, 2, 3))
+    np.testing.assert_allclose(batch, scalar_bilinear(x, y, x1, x2, y1, y2, values), atol=1e-9)
+
+
+@pytest.mark.parametrize("block", [1, 4, 1024])
+def test_bilinear_batch_blocks(block):
+    x, y, x1, x2, y1, y2 = bilinear_cases()
+    values = corner_values(len(x))
+    batch = bilinear_interpolation_batch(x, y, x1, x2, y1, y2, *values.transpose(1, 0, 2, 3), block=block)
+    np.testing.assert_allclose(batch, scalar_bilinear(x, y, x1, x2, y1, y2, values), atol=1e-9)
+
+
+def test_bilinear_batch_nan_corners():
+    x, y, x1, x2, y1, y2 = bilinear_cases()
+    values = corner_values(len(x), nan=0.3)
+    batch = bilinear_interpolation_batch(x, y, x1, x2, y1, y2, *values.transpose(1, 0, 2, 3))
+    scalar = scalar_bilinear(x, y, x1, x2, y1, y2, values)
+    # Interior points: a NaN corner makes the value NaN, like in the scalar function
+    np.testing.assert_allclose(batch[:2], scalar[:2], atol=1e-9, equal_nan=True)
+    # Corners with a zero weight do not contribute, not even their NaN values
+    weights = bilinear_weights(x, y, x1, x2, y1, y2)
+    for i in range(2, len(x)):
+        used = weights[i] != 0
+        expected = np.round((weights[i][used, None, None] * values[i][used]).sum(axis=0), 2)
+        np.testing.assert_allclose(batch[i], expected, atol=1e-9, equal_nan=True)
+
+
+def test_bilinear_weights_degenerate_cells():
+    x, y, x1, x2, y1, y2 = bilinear_cases()
+    weights = bilinear_weights(x, y, x1, x2, y1, y2)
+    np.testing.assert_allclose(weights.sum(axis=1), 1.0)
+    # Exact grid hit: all weight on (x1, y1)
+    np.testing.assert_allclose(weights[2], [1, 0, 0, 0])
+    np.testing.assert_allclose(weights[5], [1, 0, 0, 0])
+    # x1 == x2: linear in y between (x1, y1) and (x1, y2)
+    np.testing.assert_allclose(weights[3], [0.6, 0.4, 0, 0])
+    # y1 == y2: linear in x between (x1, y1) and (x2, y1)
+    np.testing.assert_allclose(weights[4], [0.8, 0, 0.2, 0])
@@ -65,6 +65,81 @@ def inverse_distance_weighting(x, y, points, values, power=2):
     return result
 
 
+def idw_weights(x, y, points, power=2):
+    """
+    Calculate Inverse Distance Weighting (IDW) weights for many stations at once.
+
+    A station coinciding with one of its data points gets all the weight on the first such point.
+
+    Args:
+        x, y: Arrays (stations) with the coordinates of the points to interpolate
+        points: Array (stations x neighbours x 2) with the coordinates of the known data points
+        power: The power parameter which controls how the weight decreases with distance
+
+    Returns:
+        Array (stations x neighbours) of weights
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    points = np.asarray(points, dtype=np.float64)
+
+    distance = np.sqrt((x[:, None] - points[..., 0]) ** 2 + (y[:, None] - points[..., 1]) ** 2)
+    exact = distance == 0
+    with np.errstate(divide='ignore'):
+        weights = np.where(exact, 0.0, 1 / distance ** power)
+
+    # Stations coinciding with one of the data points take the values of the first such point
+    hit = exact.any(axis=1)
+    weights[hit] = 0.0
+    weights[hit, exact[hit].argmax(axis=1)] = 1.0
+    return weights
+
+
+def weighted_average(weights, values):
+    """
+    Weighted average of the neighbours of many stations, skipping NaN values.
+
+    Args:
+        weights: Array (stations x neighbours) of weights
+        values: Array (stations x neighbours x ...) with values at the known data points
+
+    Returns:
+        Array (stations x ...) of averaged values, NaN where no valid values exist
+    """
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64).reshape(weights.shape + (1,) * (values.ndim - 2))
+
+    # Add weighted values where valid (ignoring NaNs)
+    valid = ~np.isnan(values)
+    weights = weights * valid
+    weighted_sum = (weights * np.where(valid, values, 0.0)).sum(axis=1)
+    weight_sum = weights.sum(axis=1)
+
+    # Final result: weighted_sum / weight_sum where weight_sum > 0, NaN where no valid weights exist
+    result = np.full_like(weighted_sum, np.nan)
+    np.divide(weighted_sum, weight_sum, out=result, where=weight_sum > 0)
+    return result
+
+
+def inverse_distance_weighting_batch(x, y, points, values, power=2):
+    """
+    Perform Inverse Distance Weighting (IDW) interpolation for many stations and variables at once.
+
+    Same semantics as inverse_distance_weighting: NaN values are skipped, a station coinciding with one of its
+    data points takes the values of that point, and NaN is returned where no valid values exist.
+
+    Args:
+        x, y: Arrays (stations) with the coordinates of the points to interpolate
+        points: Array (stations x neighbours x 2) with the coordinates of the known data points
+        values: Array (stations x neighbours x variables x time) with values at the known data points
+        power: The power parameter which controls how the weight decreases with distance
+
+    Returns:
+        Array (stations x variables x time) of interpolated values
+    """
+    return weighted_average(idw_weights(x, y, points, power), values)
+
+
 def bilinear_interpolation(x, y, x1, x2, y1, y2, T11, T12, T21, T22):
     """
     Perform bilinear or linear interpolation for arrays.
@@ -99,7 +174,64 @@ def bilinear_interpolation(x, y, x1, x2, y1, y2, T11, T12, T21, T22):
     return np.round(T, 2)
 
 
-def gglow_csv(df, dictionary, csv_type):
+def bilinear_interpolation_batch(x, y, x1, x2, y1, y2, T11, T12, T21, T22, block=1024):
+    """
+    Perform bilinear or linear interpolation for many stations at once.
+
+    Same semantics as bilinear_interpolation, the degenerate cases (x1 == x2 and/or y1 == y2) are handled per station
+    by the weights of bilinear_weights, corners with a zero weight do not contribute (not even their NaN values).
+
+    Args:
+        x, y  : Arrays (stations) with the longitudes and latitudes of the points to interpolate
+        x1, x2: Arrays (stations) with longitudes of the data points
+        y1, y2: Arrays (stations) with latitudes of the data points
+        T11, T12, T21, T22: Arrays (stations x ...) of values at the points (x1, y1), (x1, y2), (x2, y1), and (x2, y2)
+        block: number of stations summed at a time
+
+    Returns:
+        Array (stations x ...) of values at the points (x, y)
+    """
+    corners = [np.asarray(T) for T in (T11, T12, T21, T22)]
+    weights = bilinear_weights(x, y, x1, x2, y1, y2)
+    # Reshape weights so they broadcast against the trailing dimensions of the values
+    weights = weights.reshape(weights.shape + (1,) * (corners[0].ndim - 1))
+
+    # Single weighted sum over the four corners, in blocks of stations so the temporary term stays small
+    result = np.zeros(corners[0].shape, dtype=np.float64)
+    term = np.empty((min(block, len(result)),) + result.shape[1:])
+    for start in range(0, len(result), block):
+        rows = slice(start, start + block)
+        size = len(result[rows])
+        for k, T in enumerate(corners):
+            weight = weights[rows, k]
+            np.multiply(T[rows], weight, out=term[:size])
+            np.add(result[rows], term[:size], out=result[rows], where=weight != 0)
+    return np.round(result, 2, out=result)
+
+
+def bilinear_weights(x, y, x1, x2, y1, y2):
+    """
+    Calculate bilinear interpolation weights for many stations at once.
+
+    In the degenerate cases (x1 == x2 and/or y1 == y2) the weights fall back to linear interpolation, the same
+    way as in bilinear_interpolation.
+
+    Args:
+        x, y  : Arrays (stations) with the longitudes and latitudes of the points to interpolate
+        x1, x2: Arrays (stations) with longitudes of the data points
+        y1, y2: Arrays (stations) with latitudes of the data points
+
+    Returns:
+        Array (stations x 4) of weights for the points (x1, y1), (x1, y2), (x2, y1), and (x2, y2)
+    """
+    x, y, x1, x2, y1, y2 = (np.asarray(c, dtype=np.float64) for c in (x, y, x1, x2, y1, y2))
+    # Relative position of the point inside the cell, 0 along collapsed directions
+    tx = np.divide(x - x1, x2 - x1, out=np.zeros_like(x), where=x1 != x2)
+    ty = np.divide(y - y1, y2 - y1, out=np.zeros_like(y), where=y1 != y2)
+    return np.stack([(1 - tx) * (1 - ty), (1 - tx) * ty, tx * (1 - ty), tx * ty], axis=1)
+
+
+def gglow_csv(df, dictionary, csv_type, river_column=None):
     """
     Parse csv files created by geoglows API calls
 
@@ -107,6 +239,7 @@ def gglow_csv(df, dictionary, csv_type):
         df: original dataframe to be parsed
         dictionary: dict relating river_ids and meteo station names
         csv_type: data type (historical/forecast)
+        river_column: column the river_ids of forecast data are kept in, river_ids are only replaced if None
 
     Returns:
         Parsed dataframe
@@ -114,10 +247,12 @@ def gglow_csv(df, dictionary, csv_type):
     if csv_type == 'forecast':  # forecast data
         df = df.dropna(how='all')  # remove nan rows
         df.reset_index(inplace=True)
+        river_ids = df['river_id'].to_numpy()
         df['river_id'] = df['river_id'].map(dictionary)  # replace river_id values with meteo-station
-        df.rename(columns={'river_id': 'meteo-station'}, inplace=True)
-        df.rename(columns={'time': 'date-time'}, inplace=True)
-        df = df.sort_values(by=['meteo-station', 'date-time'], ascending=[True, True])
+        df.rename(columns={'river_id': 'meteo-station', 'time': 'date-time'}, inplace=True)
+        if river_column:
+            df[river_column] = river_ids
+        df.sort_values(by=['meteo-station', 'date-time'], ascending=[True, True], inplace=True)
     elif csv_type == "historical":  # historical data
         df = df.dropna(how='all')  # remove nan rows
         new_columns = [dictionary[int(col)] if int(col) in dictionary else col for col in df.columns]
@@ -127,3 +262,59 @@ def gglow_csv(df, dictionary, csv_type):
     else:
         print("csv_type must be either forecast of historical")
     return df
+
+
+def station_corners(latitude, longitude):
+    """
+    Get the four closest grid points (resolution 0.25) surrounding a station
+
+    Args:
+        latitude, longitude: coordinates of the station
+
+    Returns:
+        List of four (latitude, longitude) tuples
+    """
+    closest_latitude = closest_quarters(latitude)
+    closest_longitude = closest_quarters(longitude)
+    return [(closest_latitude[0], closest_longitude[0]), (closest_latitude[1], closest_longitude[1]),
+            (closest_latitude[0], closest_longitude[1]), (closest_latitude[1], closest_longitude[0])]
+
+
+def unique_grid_points(latitude, longitude, corners=station_corners):
+    """
+    Collect the corner points of all stations, removing grid points shared by nearby stations
+
+    Args:
+        latitude, longitude: lists of station coordinates
+        corners: function returning the four corners of a station
+
+    Returns:
+         points: list of distinct (latitude, longitude) grid points
+         station_indices: for every station, indices of its four corners in points
+    """
+    points = []
+    point_index = {}
+    station_indices = []
+    for lat, lon in zip(latitude, longitude):
+        indices = []
+        for corner in corners(lat, lon):
+            if corner not in point_index:
+                point_index[corner] = len(points)
+                points.append(corner)
+            indices.append(point_index[corner])
+        station_indices.append(indices)
+    return points, station_indices
+
+
+def locations_params(params, points):
+    """
+    Add the coordinates of a multi-location open-meteo request to the request parameters
+
+    Args:
+        params: request parameters without latitude/longitude
+        points: list of (latitude, longitude) tuples
+
+    Returns:
+        New dict with request parameters
+    """
+    return dict(params, latitude=[float(p[0]) for p in points], longitude=[float(p[1]) for p in points])